@@ -1,20 +1,27 @@
 import os
 import sys
+import asyncio
 import time
+
+# Startup reports how long the import took
+IMPORT_STARTED = time.perf_counter()
 import traceback
 import json
 import random
 import traceback
-from web3 import Web3, AsyncWeb3
-from eth_account import Account
+from eth_utils import to_checksum_address
 from fastapi import (
     FastAPI,
     Depends,
     HTTPException,
+    Header,
+    Request,
+    Response,
     BackgroundTasks,
     WebSocket,
     WebSocketDisconnect,
 )
+import aiohttp
 import aiomysql
 from contextlib import asynccontextmanager
 from typing import List
@@ -25,11 +32,47 @@ from socketio import AsyncServer, ASGIApp
 from dotenv import load_dotenv
 
 
-# In-memory game store
-TABLE_STORE = {}
+# One actor per table, all mutations for a table go through it
+TABLE_ACTORS = {}
+# Sequence numbers for each table's emitted events
+TABLE_STREAMS = {}
 
 sys.path.append("../")
-from vanillapoker import poker, pokerutils
+from vanillapoker import poker, pokerutils, tableactor, dbpool, ledger, leaderboard
+from vanillapoker import views, eventstream, snapshotcache, lobby, registry
+from vanillapoker import sharding, bus, memorydb, nftindexer, startup, cachedvalue
+from vanillapoker import earnings, accrual, listings, nftstore
+
+# Which tables this worker owns - shard 0 also owns balances/NFTs/leaderboard
+SHARD = sharding.config_from_env()
+# Cross-worker messages (lobby updates), only when running sharded
+BUS = bus.client_for(SHARD.bus_url) if SHARD.bus_url else None
+# Other shards make their balance changes through the home shard's ledger
+HOME_SESSION = None
+# Settlements the home shard didn't take yet, retried in the background
+SETTLE_OUTBOX = []
+# One sender drains the outbox at a time, so nothing is sent twice or skipped
+SETTLE_LOCK = asyncio.Lock()
+LOBBY_SYNC_INTERVAL = float(os.environ.get("LOBBY_SYNC_INTERVAL", 10))
+
+# In-memory game store, tables that sit empty get collected in the background
+TABLE_REGISTRY = registry.TableRegistry(
+    allocator=registry.TableIdAllocator(
+        shard_index=SHARD.shard_index,
+        num_shards=SHARD.num_shards,
+        # Table ids are part of the ledger's hand keys, so never reuse one
+        state_path=os.environ.get(
+            "TABLE_ID_STATE", f"table_ids.{SHARD.shard_index}.json"
+        ),
+    ),
+    idle_ttl=float(os.environ.get("TABLE_IDLE_TTL", 600)),
+)
+TABLE_STORE = TABLE_REGISTRY.tables
+TABLE_GC_INTERVAL = float(os.environ.get("TABLE_GC_INTERVAL", 30))
+# Encoded /getTable and /getGamestate responses per table version
+SNAPSHOT_CACHE = snapshotcache.SnapshotCache()
+# /getTables index, kept up to date on create/join/leave
+LOBBY = lobby.LobbyIndex()
 
 # Load environment variables from .env file
 load_dotenv()
@@ -39,12 +82,14 @@ alchemy_key = os.environ["ALCHEMY_KEY"]
 infura_url = f"https://base-sepolia.infura.io/v3/{infura_key}"
 alchemy_url = f"https://base-sepolia.g.alchemy.com/v2/{alchemy_key}"
 
-web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(alchemy_url)) # if alchemy_url else Web3(Web3.HTTPProvider(infura_url))
+# "tester" runs an in-process chain so load tests never touch the network
+WEB3_PROVIDER = os.environ.get("WEB3_PROVIDER", "alchemy")
+# Calls made within this many seconds of each other go out as one JSON-RPC
+# batch, 0 sends each on its own
+RPC_BATCH_WINDOW = float(os.environ.get("RPC_BATCH_WINDOW", 0.005))
+RPC_BATCH_MAX = int(os.environ.get("RPC_BATCH_MAX", 100))
 token_vault_address = "0xbCb7d24815d3CB781C42A3d5403E3443F1234166"
 
-with open("TokenVault.json", "r") as f:
-    token_vault_abi = json.loads(f.read())
-
 
 # nft_contract_address = "0xc87716e22EFc71D35717166A83eC0Dc751DbC421"
 nft_contract_address = "0x50cf8d7bF52D50A77ecBF3f8310dE0200c7D8352"
@@ -74,53 +119,178 @@ nft_contract_abi = """
 nft_contract_abi = [{'type': 'function', 'name': 'approve', 'inputs': [{'name': 'to', 'type': 'address', 'internalType': 'address'}, {'name': 'tokenId', 'type': 'uint256', 'internalType': 'uint256'}], 'outputs': [], 'stateMutability': 'nonpayable'}, {'type': 'function', 'name': 'balanceOf', 'inputs': [{'name': 'owner', 'type': 'address', 'internalType': 'address'}], 'outputs': [{'name': '', 'type': 'uint256', 'internalType': 'uint256'}], 'stateMutability': 'view'}, {'type': 'function', 'name': 'getApproved', 'inputs': [{'name': 'tokenId', 'type': 'uint256', 'internalType': 'uint256'}], 'outputs': [{'name': '', 'type': 'address', 'internalType': 'address'}], 'stateMutability': 'view'}, {'type': 'function', 'name': 'isApprovedForAll', 'inputs': [{'name': 'owner', 'type': 'address', 'internalType': 'address'}, {'name': 'operator', 'type': 'address', 'internalType': 'address'}], 'outputs': [{'name': '', 'type': 'bool', 'internalType': 'bool'}], 'stateMutability': 'view'}, {'type': 'function', 'name': 'name', 'inputs': [], 'outputs': [{'name': '', 'type': 'string', 'internalType': 'string'}], 'stateMutability': 'view'}, {'type': 'function', 'name': 'ownerOf', 'inputs': [{'name': 'tokenId', 'type': 'uint256', 'internalType': 'uint256'}], 'outputs': [{'name': '', 'type': 'address', 'internalType': 'address'}], 'stateMutability': 'view'}, {'type': 'function', 'name': 'safeTransferFrom', 'inputs': [{'name': 'from', 'type': 'address', 'internalType': 'address'}, {'name': 'to', 'type': 'address', 'internalType': 'address'}, {'name': 'tokenId', 'type': 'uint256', 'internalType': 'uint256'}], 'outputs': [], 'stateMutability': 'nonpayable'}, {'type': 'function', 'name': 'safeTransferFrom', 'inputs': [{'name': 'from', 'type': 'address', 'internalType': 'address'}, {'name': 'to', 'type': 'address', 'internalType': 'address'}, {'name': 'tokenId', 'type': 'uint256', 'internalType': 'uint256'}, {'name': 'data', 'type': 'bytes', 'internalType': 'bytes'}], 'outputs': [], 'stateMutability': 'nonpayable'}, {'type': 'function', 'name': 'setApprovalForAll', 'inputs': [{'name': 'operator', 'type': 'address', 'internalType': 'address'}, {'name': 'approved', 'type': 'bool', 'internalType': 'bool'}], 'outputs': [], 'stateMutability': 'nonpayable'}, {'type': 'function', 'name': 'supportsInterface', 'inputs': [{'name': 'interfaceId', 'type': 'bytes4', 'internalType': 'bytes4'}], 'outputs': [{'name': '', 'type': 'bool', 'internalType': 'bool'}], 'stateMutability': 'view'}, {'type': 'function', 'name': 'symbol', 'inputs': [], 'outputs': [{'name': '', 'type': 'string', 'internalType': 'string'}], 'stateMutability': 'view'}, {'type': 'function', 'name': 'tokenURI', 'inputs': [{'name': 'tokenId', 'type': 'uint256', 'internalType': 'uint256'}], 'outputs': [{'name': '', 'type': 'string', 'internalType': 'string'}], 'stateMutability': 'view'}, {'type': 'function', 'name': 'transferFrom', 'inputs': [{'name': 'from', 'type': 'address', 'internalType': 'address'}, {'name': 'to', 'type': 'address', 'internalType': 'address'}, {'name': 'tokenId', 'type': 'uint256', 'internalType': 'uint256'}], 'outputs': [], 'stateMutability': 'nonpayable'}, {'type': 'event', 'name': 'Approval', 'inputs': [{'name': 'owner', 'type': 'address', 'indexed': True, 'internalType': 'address'}, {'name': 'approved', 'type': 'address', 'indexed': True, 'internalType': 'address'}, {'name': 'tokenId', 'type': 'uint256', 'indexed': True, 'internalType': 'uint256'}], 'anonymous': False}, {'type': 'event', 'name': 'ApprovalForAll', 'inputs': [{'name': 'owner', 'type': 'address', 'indexed': True, 'internalType': 'address'}, {'name': 'operator', 'type': 'address', 'indexed': True, 'internalType': 'address'}, {'name': 'approved', 'type': 'bool', 'indexed': False, 'internalType': 'bool'}], 'anonymous': False}, {'type': 'event', 'name': 'Transfer', 'inputs': [{'name': 'from', 'type': 'address', 'indexed': True, 'internalType': 'address'}, {'name': 'to', 'type': 'address', 'indexed': True, 'internalType': 'address'}, {'name': 'tokenId', 'type': 'uint256', 'indexed': True, 'internalType': 'uint256'}], 'anonymous': False}, {'type': 'error', 'name': 'ERC721IncorrectOwner', 'inputs': [{'name': 'sender', 'type': 'address', 'internalType': 'address'}, {'name': 'tokenId', 'type': 'uint256', 'internalType': 'uint256'}, {'name': 'owner', 'type': 'address', 'internalType': 'address'}]}, {'type': 'error', 'name': 'ERC721InsufficientApproval', 'inputs': [{'name': 'operator', 'type': 'address', 'internalType': 'address'}, {'name': 'tokenId', 'type': 'uint256', 'internalType': 'uint256'}]}, {'type': 'error', 'name': 'ERC721InvalidApprover', 'inputs': [{'name': 'approver', 'type': 'address', 'internalType': 'address'}]}, {'type': 'error', 'name': 'ERC721InvalidOperator', 'inputs': [{'name': 'operator', 'type': 'address', 'internalType': 'address'}]}, {'type': 'error', 'name': 'ERC721InvalidOwner', 'inputs': [{'name': 'owner', 'type': 'address', 'internalType': 'address'}]}, {'type': 'error', 'name': 'ERC721InvalidReceiver', 'inputs': [{'name': 'receiver', 'type': 'address', 'internalType': 'address'}]}, {'type': 'error', 'name': 'ERC721InvalidSender', 'inputs': [{'name': 'sender', 'type': 'address', 'internalType': 'address'}]}, {'type': 'error', 'name': 'ERC721NonexistentToken', 'inputs': [{'name': 'tokenId', 'type': 'uint256', 'internalType': 'uint256'}]}]
 # fmt: on
 
-# Create a contract instance
-nft_contract_async = web3.eth.contract(
-    address=nft_contract_address, abi=nft_contract_abi
+# Set up by connect_chain once the app is already serving
+web3 = None
+nft_contract_async = None
+token_vault = None
+Account = None
+encode_defunct = None
+# The BatchingProvider behind web3 when RPC_BATCH_WINDOW is on
+RPC_BATCHER = None
+# Signs and sends our transactions (withdraw, nft transfers, airdrops), set
+# up in the signer phase when PRIVATE_KEY is configured
+TX_QUEUE = None
+# ETH in the vault - the UI polls the conversion rate, so this is shared and
+# refreshed in the background instead of fetched per request
+VAULT_BALANCE = cachedvalue.CachedValue(
+    lambda: web3.eth.get_balance(token_vault_address),
+    ttl=float(os.environ.get("VAULT_BALANCE_TTL", 5)),
 )
-token_vault = web3.eth.contract(address=token_vault_address, abi=token_vault_abi["abi"])
-print(token_vault)
-START_TIME = time.time()
-
-TOTAL_TOKENS = 0
 
 
-def generate_card_properties():
+def connect_chain():
     """
-    Use PRNG to deterministically generate random properties for the NFTs
+    web3 and eth_account take most of a second to import, so they're loaded
+    in a startup phase rather than before the app can take requests
     """
-    import random
+    global web3, nft_contract_async, token_vault, Account, encode_defunct, RPC_BATCHER
+    from web3 import AsyncWeb3
+    from eth_account import Account
+    from eth_account.messages import encode_defunct
+
+    if WEB3_PROVIDER == "tester":
+        from web3.providers.eth_tester import AsyncEthereumTesterProvider
 
-    random.seed(0)
+        web3 = AsyncWeb3(AsyncEthereumTesterProvider())
+    elif RPC_BATCH_WINDOW > 0:
+        from vanillapoker import rpcbatch
 
-    # Map from nft tokenId to properties
-    nft_map = {}
+        RPC_BATCHER = rpcbatch.BatchingProvider(
+            alchemy_url, window=RPC_BATCH_WINDOW, max_batch=RPC_BATCH_MAX
+        )
+        web3 = AsyncWeb3(RPC_BATCHER)
+    else:
+        web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(alchemy_url)) # if alchemy_url else Web3(Web3.HTTPProvider(infura_url))
+
+    with open("TokenVault.json", "r") as f:
+        token_vault_abi = json.loads(f.read())
+
+    # Create a contract instance
+    nft_contract_async = web3.eth.contract(
+        address=nft_contract_address, abi=nft_contract_abi
+    )
+    token_vault = web3.eth.contract(
+        address=token_vault_address, abi=token_vault_abi["abi"]
+    )
+    NFT_INDEXER.source = nftindexer.Web3LogSource(web3, nft_contract_address)
 
-    for i in range(1000):
-        # Copying naming convention from solidity contract
-        cardNumber = random.randint(0, 51)
-        rarity = random.randint(1, 100)
-        nft_map[i] = {"cardNumber": cardNumber, "rarity": rarity, "forSale": False}
 
-    return nft_map
+TOTAL_TOKENS = 0
 
 
 # Storing NFT metadata properties locally for now - in future pull from chain
-nft_map = generate_card_properties()
-# Track true/false - listed for sale?
-nft_listings_map = {}
+# Generated from a fixed seed, so every token keeps the same card
+NFT_STORE = nftstore.NFTStore(
+    count=1000, max_tokens=int(os.environ.get("NFT_MAX_TOKENS", 1000000))
+)
+# Marketplace listings, sorted by price for /getListings
+NFT_LISTINGS = listings.ListingIndex()
 
 
 sio = AsyncServer(async_mode="asgi", cors_allowed_origins="*")
 
 
+DB_POOL = None
+# In-memory user_balances, written back to mysql in the background
+LEDGER = None
+BALANCE_FLUSH_INTERVAL = float(os.environ.get("BALANCE_FLUSH_INTERVAL", 1.0))
+# How long a request waits on a startup phase before giving up with a 503
+STARTUP_WAIT = float(os.environ.get("STARTUP_WAIT", 10))
+
+
+# Lobby and table reads are served as soon as the app is up, everything slow
+# loads in phases behind it - see /health/ready
+STARTUP = startup.Startup()
+
+
+async def phase_ready(name):
+    """
+    Wait for a startup phase before touching what it sets up
+    """
+    try:
+        await STARTUP.wait(name, timeout=STARTUP_WAIT)
+    except (RuntimeError, asyncio.TimeoutError) as e:
+        raise HTTPException(status_code=503, detail="Starting up") from e
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # await database.database.connect()
-    pass
+    global HOME_SESSION
+    STARTUP.record("import", IMPORT_SECONDS)
+    tasks = [asyncio.create_task(collect_idle_tables(TABLE_GC_INTERVAL))]
+
+    async def open_ledger():
+        global DB_POOL, LEDGER
+        if os.environ.get("BALANCE_STORE") == "memory":
+            DB_POOL = memorydb.MemoryPool()
+        else:
+            DB_POOL = dbpool.pool_from_env()
+        await DB_POOL.open()
+        LEDGER = ledger.BalanceLedger(
+            DB_POOL, os.environ.get("BALANCE_JOURNAL", "balance_journal.log")
+        )
+        LEDGER.listeners.append(update_leaderboard_balance)
+        await LEDGER.load()
+        tasks.append(asyncio.create_task(LEDGER.run_flusher(BALANCE_FLUSH_INTERVAL)))
+
+    async def start_nft_indexer():
+        NFT_INDEXER.load_checkpoint()
+        EARNINGS.reconcile()
+        await STARTUP.wait("chain")
+        tasks.append(asyncio.create_task(NFT_INDEXER.run(NFT_INDEX_INTERVAL)))
+
+    async def start_signer():
+        global TX_QUEUE
+        await STARTUP.wait("chain")
+        # Imports web3, so not until the chain phase has
+        from vanillapoker import txqueue
+
+        TX_QUEUE = txqueue.TxQueue(
+            web3,
+            Account.from_key(os.environ["PRIVATE_KEY"]),
+            max_in_flight=int(os.environ.get("TX_MAX_IN_FLIGHT", 16)),
+            send_interval=float(os.environ.get("TX_SEND_INTERVAL", 0)),
+            bump_after=float(os.environ.get("TX_BUMP_AFTER", 30)),
+            give_up_after=float(os.environ.get("TX_GIVE_UP_AFTER", 600)),
+        )
+        TX_QUEUE.listeners.append(on_tx_finished)
+        tasks.append(asyncio.create_task(TX_QUEUE.run()))
+
+    STARTUP.start("lookupTables", load_lookup_tables)
+    STARTUP.start("chain", connect_chain, required=False)
+    if SHARD.is_home:
+        # Before any NFT owners are loaded or minted, see EarningsIndex.load_checkpoint
+        EARNINGS.load_checkpoint()
+        tasks.append(asyncio.create_task(EARNINGS.run(EARNINGS_SAVE_INTERVAL)))
+        STARTUP.start("ledger", open_ledger)
+        STARTUP.start("nfts", start_nft_indexer, required=False)
+        STARTUP.start("signer", start_signer, required=False)
+    else:
+        HOME_SESSION = aiohttp.ClientSession()
+        tasks.append(asyncio.create_task(retry_settlements(BALANCE_FLUSH_INTERVAL)))
+    if BUS is not None:
+        if SHARD.is_home:
+            BUS.subscribe("lobby", on_lobby_message)
+        else:
+            tasks.append(asyncio.create_task(sync_lobby(LOBBY_SYNC_INTERVAL)))
+        BUS.start()
     yield
-    pass
-    # await database.database.disconnect()
+    STARTUP.cancel()
+    for task in tasks:
+        task.cancel()
+    for actor in TABLE_ACTORS.values():
+        await actor.stop()
+    if BUS is not None:
+        await BUS.stop()
+    if SHARD.is_home:
+        # Might not have got that far
+        if LEDGER is not None:
+            await LEDGER.close()
+        if DB_POOL is not None:
+            await DB_POOL.close()
+        EARNINGS.save_checkpoint()
+    else:
+        await HOME_SESSION.close()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -138,7 +308,7 @@ app.add_middleware(
 socket_app = ASGIApp(sio, other_asgi_app=app)
 
 
-# Have to initialize the lookup tables before the API will work
+# Hands can't be scored until these are in, loaded as a startup phase
 def load_lookup_tables():
     with open("lookup_table_flushes.json", "r") as f:
         lookup_table_flush_5c = json.loads(f.read())
@@ -146,17 +316,74 @@ def load_lookup_tables():
     with open("lookup_table_basic_7c.json", "r") as f:
         lookup_table_basic_7c = json.loads(f.read())
 
-    return lookup_table_flush_5c, lookup_table_basic_7c
+    poker.PokerTable.set_lookup_tables(lookup_table_basic_7c, lookup_table_flush_5c)
 
 
-lookup_table_flush_5c, lookup_table_basic_7c = load_lookup_tables()
-poker.PokerTable.set_lookup_tables(lookup_table_basic_7c, lookup_table_flush_5c)
+@app.get("/health/live")
+async def health_live(response: Response):
+    """
+    Fails only if a phase the app can't work without failed - restart it
+    """
+    if STARTUP.failed:
+        response.status_code = 503
+    return {"live": not STARTUP.failed}
+
+
+@app.get("/health/ready")
+async def health_ready(response: Response):
+    """
+    Ready once every required phase is done, the body has the time each
+    phase took either way
+    """
+    if not STARTUP.ready:
+        response.status_code = 503
+    return STARTUP.report()
+
+
+# How old a signed socket login can be, in seconds
+AUTH_MAX_AGE = int(os.environ.get("AUTH_MAX_AGE", 300))
+
+
+def auth_message(address, timestamp):
+    # Clients sign this exact text with personal_sign
+    return f"vanillapoker login {address} {timestamp}"
+
+
+def recover_auth_address(auth):
+    """
+    auth is {"address", "timestamp", "signature"}, returns the checksummed
+    address if the signature is valid and recent, otherwise None
+    """
+    try:
+        address = to_checksum_address(auth["address"])
+        timestamp = int(auth["timestamp"])
+        if abs(time.time() - timestamp) > AUTH_MAX_AGE:
+            return None
+        message = encode_defunct(text=auth_message(auth["address"], timestamp))
+        signer = Account.recover_message(message, signature=auth["signature"])
+    except Exception:
+        return None
+    if to_checksum_address(signer) != address:
+        return None
+    return address
 
 
 # Define Socket.IO event handlers
 @sio.event
-async def connect(sid, environ):
-    print("Client connected:", sid)
+async def connect(sid, environ, auth=None):
+    """
+    Spectators can connect without auth, players pass a signed login as auth
+    to be able to send actions over the socket
+    """
+    if auth:
+        # eth_account comes in with the chain phase
+        await phase_ready("chain")
+    address = recover_auth_address(auth) if auth else None
+    if auth and address is None:
+        # Bad signature - refuse rather than silently downgrade to spectator
+        return False
+    await sio.save_session(sid, {"address": address})
+    print("Client connected:", sid, address)
 
 
 @sio.event
@@ -164,17 +391,332 @@ async def disconnect(sid):
     print("Client disconnected:", sid)
 
 
+def table_room(table_id):
+    return f"table-{table_id}"
+
+
+def seat_room(table_id, seat_i):
+    return f"table-{table_id}-seat-{seat_i}"
+
+
+async def join_table_rooms(sid, data):
+    """
+    Put sid in the table's room, plus its seat room if it's the player at
+    data["seat"].  Returns (error, seat_i)
+    """
+    table_id = str(data["tableId"])
+    if table_id not in TABLE_STORE:
+        return "Table not found!", None
+    await sio.enter_room(sid, table_room(table_id))
+    if data.get("seat") is None:
+        return None, None
+
+    poker_table_obj = TABLE_STORE[table_id]
+    try:
+        seat_i = int(data["seat"])
+    except (TypeError, ValueError):
+        return "Invalid seat!", None
+    # Negative indexes would pick a seat from the end
+    if not 0 <= seat_i < poker_table_obj.num_seats:
+        return "Invalid seat!", None
+    seat = poker_table_obj.seats[seat_i]
+    # Only the address they authenticated with at connect time counts
+    session = await sio.get_session(sid)
+    address = session.get("address")
+    if address is None:
+        return "Login required to subscribe to a seat!", None
+    if seat is None or seat["address"] != address:
+        return "Player not at seat!", None
+    await sio.enter_room(sid, seat_room(table_id, seat_i))
+    return None, seat_i
+
+
+@sio.event
+async def subscribe(sid, data):
+    """
+    Start receiving events for a table: {"tableId": "123", "seat": 0}
+    seat is optional, only for the player sitting in that seat on a
+    connection authenticated as them - they'll get their own holecards,
+    everyone else gets them redacted
+    The ack carries the seq they're subscribed from
+    """
+    table_id = str(data["tableId"])
+    # On the table actor, so no event lands between joining and the catch-up
+    return await run_on_table(table_id, _subscribe, sid, data)
+
+
+async def _subscribe(sid, data):
+    error, seat_i = await join_table_rooms(sid, data)
+    if error:
+        return {"success": False, "error": error}
+    table_id = str(data["tableId"])
+    stream = get_event_stream(table_id)
+    if seat_i is not None:
+        seat = TABLE_STORE[table_id].seats[seat_i]
+        # Cards may have been dealt before they subscribed
+        if seat["holecards"]:
+            tag_hc = {
+                "tag": "cards",
+                "cardType": f"p{seat_i}",
+                "cards": seat["holecards"],
+            }
+            # Same seq the deal went out with, so clients can dedupe it
+            seq = stream.seq
+            for dealt_seq, event in reversed(stream.buffer):
+                if event.get("cardType") == tag_hc["cardType"]:
+                    seq = dealt_seq
+                    break
+            await emit_to_sid(sid, table_id, seq, tag_hc)
+    return {"success": True, "seq": stream.seq}
+
+
+async def emit_to_sid(sid, table_id, seq, event):
+    """
+    One event to one client, framed the way EMIT_MODE sends live events
+    """
+    if EMIT_MODE == "batch":
+        frame = {
+            "tableId": table_id,
+            "ts": time.time(),
+            "events": [{"seq": seq, "event": event}],
+        }
+        await sio.emit("tableEvents", frame, to=sid)
+    else:
+        await sio.emit(table_id, {**event, "seq": seq}, to=sid)
+
+
+@sio.event
+async def resume(sid, data):
+    """
+    Reconnecting client: {"tableId", "lastSeq", "seat"?}
+    Subscribes them again and sends only what they missed after lastSeq,
+    framed the way EMIT_MODE sends live events, or a 'tableKeyframe' of the
+    current table state if that's no longer buffered
+    """
+    table_id = str(data["tableId"])
+    # Run on the table actor so nothing gets emitted between joining the
+    # rooms, building the replay and sending it
+    return await run_on_table(table_id, _resume, sid, data)
+
+
+async def _resume(sid, data):
+    error, seat_i = await join_table_rooms(sid, data)
+    if error:
+        return {"success": False, "error": error}
+    table_id = str(data["tableId"])
+    catchup = build_catchup(table_id, int(data["lastSeq"]), seat_i)
+    if "keyframe" in catchup:
+        await sio.emit("tableKeyframe", catchup, to=sid)
+        return {"success": True, "seq": catchup["seq"], "keyframe": True}
+    if EMIT_MODE == "batch":
+        await sio.emit("tableEvents", catchup, to=sid)
+    else:
+        for item in catchup["events"]:
+            await emit_to_sid(sid, table_id, item["seq"], item["event"])
+    return {"success": True, "seq": catchup["seq"], "replayed": len(catchup["events"])}
+
+
+def build_catchup(table_id, last_seq, seat_i=None):
+    """
+    Either a frame of the events after last_seq, same shape as a live
+    'tableEvents' frame, or a compact keyframe if the gap is too old
+    """
+    stream = get_event_stream(table_id)
+    missed = stream.since(last_seq)
+    if missed is None:
+        poker_table_obj = TABLE_STORE[table_id]
+        return {
+            "tableId": table_id,
+            "seq": stream.seq,
+            "keyframe": build_table_info(table_id, poker_table_obj, seat_i),
+        }
+    return {
+        "tableId": table_id,
+        "seq": stream.seq,
+        "ts": time.time(),
+        "events": [
+            {"seq": seq, "event": views.view_for(event, seat_i)}
+            for seq, event in missed
+        ],
+    }
+
+
+@sio.event
+async def unsubscribe(sid, data):
+    table_id = str(data["tableId"])
+    for room in sio.rooms(sid):
+        if room == table_room(table_id) or room.startswith(table_room(table_id) + "-"):
+            await sio.leave_room(sid, room)
+    return {"success": True}
+
+
+# "event" is one emit per event, named after the table id - what clients
+# listen for. "batch" (opt-in) sends everything one request produced as a
+# single framed 'tableEvents' message
+EMIT_MODE = os.environ.get("EMIT_MODE", "event")
+
+
+def get_event_stream(table_id):
+    if table_id not in TABLE_STREAMS:
+        TABLE_STREAMS[table_id] = eventstream.EventStream()
+    return TABLE_STREAMS[table_id]
+
+
 async def ws_emit_actions(table_id, poker_table_obj):
-    # while True:
-    #     is_event, event = poker_table_obj.get_next_event(0)
-    #     if is_event:
-    #         await sio.emit(table_id, event)
-    #     else:
-    #         break
-    while poker_table_obj.events_pop:
-        event = poker_table_obj.events_pop.pop(0)
-        print("EMITTING EVENT", event)
-        await sio.emit(table_id, event)
+    """
+    Emit everything the engine produced since the last call
+    Returns the sequence number of the last event
+    """
+    stream = get_event_stream(table_id)
+    events = poker_table_obj.events_pop
+    if not events:
+        return stream.seq
+    poker_table_obj.events_pop = []
+    seq_events = stream.publish(events)
+
+    # Only clients subscribed to this table get its events, and each
+    # seat only sees its own holecards
+    num_seats = poker_table_obj.num_seats
+    seat_sids = get_seat_sids(table_id, num_seats)
+    if EMIT_MODE == "batch":
+        ts = time.time()
+
+        def build_frame(seat_i):
+            return {
+                "tableId": table_id,
+                "ts": ts,
+                "events": [
+                    {"seq": seq, "event": views.view_for(event, seat_i)}
+                    for seq, event in seq_events
+                ],
+            }
+
+        def sees_private(seat_i):
+            return any(views.sees_private(event, seat_i) for _, event in seq_events)
+
+        for audiences, frame in views.project(build_frame, sees_private, num_seats):
+            await emit_to_audiences(
+                table_id, audiences, "tableEvents", frame, seat_sids
+            )
+    else:
+        for seq, event in seq_events:
+            for audiences, view in views.project_event(event, num_seats):
+                view = {**view, "seq": seq}
+                await emit_to_audiences(table_id, audiences, table_id, view, seat_sids)
+    return stream.seq
+
+
+def get_seat_sids(table_id, num_seats):
+    seat_sids = {}
+    for seat_i in range(num_seats):
+        participants = sio.manager.get_participants("/", seat_room(table_id, seat_i))
+        seat_sids[seat_i] = [sid for sid, _ in participants]
+    return seat_sids
+
+
+async def emit_to_audiences(table_id, audiences, event_name, data, seat_sids):
+    """
+    audiences holds seat indexes, plus None for spectators
+    Seated players are in the table room too, so spectator views skip any seat
+    that should see something else
+    """
+    if None in audiences:
+        skip_sid = [
+            sid
+            for seat_i, sids in seat_sids.items()
+            if seat_i not in audiences
+            for sid in sids
+        ]
+        await sio.emit(event_name, data, room=table_room(table_id), skip_sid=skip_sid)
+    else:
+        rooms = [seat_room(table_id, seat_i) for seat_i in audiences]
+        await sio.emit(event_name, data, room=rooms)
+
+
+def get_table_actor(table_id):
+    if table_id not in TABLE_ACTORS:
+        TABLE_ACTORS[table_id] = tableactor.TableActor(table_id)
+    return TABLE_ACTORS[table_id]
+
+
+async def run_on_table(table_id, fn, *args):
+    """
+    Serialize fn(*args) with every other mutation on this table
+    """
+    if table_id not in TABLE_STORE:
+        return {"success": False, "error": "Table not found!"}
+    try:
+        return await get_table_actor(table_id).submit(fn, *args)
+    except tableactor.TableBusyError as e:
+        return {"success": False, "error": str(e)}
+
+
+async def collect_idle_tables(interval: float):
+    """
+    Background task - drop tables that have sat empty past TABLE_IDLE_TTL
+    """
+    while True:
+        await asyncio.sleep(interval)
+        for table_id in TABLE_REGISTRY.collectable():
+            res = await run_on_table(table_id, _collect_table, table_id)
+            if res is True:
+                actor = TABLE_ACTORS.pop(table_id, None)
+                if actor is not None:
+                    await actor.stop()
+
+
+async def _collect_table(table_id):
+    # Runs on the actor, so a join queued ahead of us has already landed
+    if not TABLE_REGISTRY.collect(table_id):
+        return False
+    await lobby_remove(table_id)
+    SNAPSHOT_CACHE.drop_table(table_id)
+    TABLE_STREAMS.pop(table_id, None)
+    await sio.close_room(table_room(table_id))
+    return True
+
+
+async def settle_hands(table_id, poker_table_obj):
+    """
+    Apply each finished hand's stack deltas to inPlay in a single ledger write,
+    the ledger flush then lands them in one db transaction
+    """
+    while poker_table_obj.settlements_pop:
+        settlement = poker_table_obj.settlements_pop.pop(0)
+        hand = f"{table_id}-{settlement['handId']}"
+        if SHARD.is_home:
+            LEDGER.settle_hand(hand, settlement["deltas"])
+            continue
+        SETTLE_OUTBOX.append({"hand": hand, "deltas": settlement["deltas"]})
+    if SHARD.is_home:
+        # On disk before the action that ended the hand is acknowledged
+        await LEDGER.sync()
+    elif SETTLE_OUTBOX:
+        await send_settlements()
+
+
+async def send_settlements():
+    # Whoever holds the lock also sends anything appended meanwhile
+    if SETTLE_LOCK.locked():
+        return
+    async with SETTLE_LOCK:
+        # In order, and the ledger skips hands it already has, so resending
+        # after a failed call is safe
+        while SETTLE_OUTBOX:
+            entry = SETTLE_OUTBOX[0]
+            try:
+                await home_call("/internal/settleHand", entry)
+            except Exception:
+                traceback.print_exc()
+                return
+            # Only appends happen while we hold the lock, so this is entry
+            SETTLE_OUTBOX.pop(0)
+
+
+async def retry_settlements(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        await send_settlements()
 
 
 class ItemJoinTable(BaseModel):
@@ -225,36 +767,39 @@ class ItemDeposit(BaseModel):
 
 @app.post("/joinTable")
 async def join_table(item: ItemJoinTable):
+    return await run_on_table(item.tableId, _join_table, item)
+
+
+async def _join_table(item: ItemJoinTable):
     table_id = item.tableId
-    player_id = Web3.to_checksum_address(item.address)
+    player_id = to_checksum_address(item.address)
     deposit_amount = int(item.depositAmount)
+    # Check before moving funds, the table may have been collected while queued
+    if table_id not in TABLE_STORE:
+        return {"success": False, "error": "Table not found!"}
 
     # Need to move balance to temp funds
-    bal_db = await read_balance_one(player_id)
-    assert bal_db["localBal"] >= deposit_amount
-
-    local_bal = bal_db["localBal"] - deposit_amount
-    in_play = bal_db["inPlay"] + deposit_amount
-
-    print("JOINING TABLE")
-    # update_balance(on_chain_bal_new, local_bal_new, inPlay, address)
-    await update_balance(bal_db["onChainBal"], local_bal, in_play, player_id)
+    await adjust_balance(player_id, local_bal=-deposit_amount, in_play=deposit_amount)
 
     seat_i = item.seatI
-    if table_id not in TABLE_STORE:
-        return {"success": False, "error": "Table not found!"}
     poker_table_obj = TABLE_STORE[table_id]
     # Not using seat_i for now
     # poker_table_obj.join_table(seat_i, deposit_amount, player_id)
     poker_table_obj.join_table_next_seat_i(deposit_amount, player_id)
-    await ws_emit_actions(table_id, poker_table_obj)
-    return {"success": True}
+    TABLE_REGISTRY.touch(table_id)
+    await lobby_upsert(table_id, poker_table_obj)
+    seq = await ws_emit_actions(table_id, poker_table_obj)
+    return {"success": True, "seq": seq}
 
 
 @app.post("/leaveTable")
 async def leave_table(item: ItemLeaveTable):
+    return await run_on_table(item.tableId, _leave_table, item)
+
+
+async def _leave_table(item: ItemLeaveTable):
     table_id = item.tableId
-    player_id = Web3.to_checksum_address(item.address)
+    player_id = to_checksum_address(item.address)
     seat_i = item.seatI
     if table_id not in TABLE_STORE:
         return {"success": False, "error": "Table not found!"}
@@ -262,65 +807,102 @@ async def leave_table(item: ItemLeaveTable):
     poker_table_obj = TABLE_STORE[table_id]
     seat_i = poker_table_obj.player_to_seat[player_id]
     table_stack = poker_table_obj.seats[seat_i]["stack"]
+    # inPlay holds what they brought into this hand - anything already in the
+    # pot is lost, leaving players aren't part of the hand's settlement
+    in_play = poker_table_obj.hand_start_stacks.get(player_id, table_stack)
     # poker_table_obj.leave_table(seat_i, player_id)
     # try:
     poker_table_obj.leave_table_no_seat_i(player_id)
+    TABLE_REGISTRY.touch(table_id)
+    await lobby_upsert(table_id, poker_table_obj)
+    # Whoever sits here next shouldn't have their cards sent to the old player
+    await sio.close_room(seat_room(table_id, seat_i))
     # except:
     #     err = traceback.format_exc()
     #     return {"success": False, "error": err}
-    bal_db = await read_balance_one(player_id)
+    await adjust_balance(player_id, local_bal=table_stack, in_play=-in_play)
 
-    local_bal = bal_db["localBal"] + table_stack
-    # TODO - this assumes they're only ever at one table at a time...
-    in_play = 0
-
-    # update_balance(on_chain_bal_new, local_bal_new, inPlay, address)
-    await update_balance(bal_db["onChainBal"], local_bal, in_play, player_id)
-
-    await ws_emit_actions(table_id, poker_table_obj)
-    return {"success": True}
+    seq = await ws_emit_actions(table_id, poker_table_obj)
+    return {"success": True, "seq": seq}
 
 
 @app.post("/rebuy")
 async def rebuy(item: ItemRebuy):
+    return await run_on_table(item.tableId, _rebuy, item)
+
+
+async def _rebuy(item: ItemRebuy):
     table_id = item.tableId
-    player_id = Web3.to_checksum_address(item.address)
-    rebuy_amount = item.rebuyAmount
+    player_id = to_checksum_address(item.address)
+    rebuy_amount = int(item.rebuyAmount)
     seat_i = item.seatI
 
     if table_id not in TABLE_STORE:
         return {"success": False, "error": "Table not found!"}
+    if rebuy_amount <= 0:
+        return {"success": False, "error": "Invalid rebuy amount"}
     poker_table_obj = TABLE_STORE[table_id]
 
     seat_i = poker_table_obj.player_to_seat[player_id]
-    table_stack = poker_table_obj.seats[seat_i]["stack"]
-    bal_db = await read_balance_one(player_id)
-    # TODO - this assumes they're only ever at one table at a time...
-    in_play = table_stack + rebuy_amount
-
-    # update_balance(on_chain_bal_new, local_bal_new, inPlay, address)
-    await update_balance(bal_db["onChainBal"], bal_db["localBal"], in_play, player_id)
+    # Chips come out of their balance, same as joining
+    await adjust_balance(player_id, local_bal=-rebuy_amount, in_play=rebuy_amount)
 
     # poker_table_obj.rebuy(seat_i, rebuy_amount, player_id)
-    # try:
-    poker_table_obj.rebuy_no_seat_i(rebuy_amount, player_id)
-    # except:
-    #     err = traceback.format_exc()
-    #     return {"success": False, "error": err}
+    try:
+        poker_table_obj.rebuy_no_seat_i(rebuy_amount, player_id)
+    except AssertionError as e:
+        # Over the max buyin - they keep their tokens
+        await adjust_balance(player_id, local_bal=rebuy_amount, in_play=-rebuy_amount)
+        return {"success": False, "error": str(e)}
 
-    await ws_emit_actions(table_id, poker_table_obj)
-    return {"success": True}
+    seq = await ws_emit_actions(table_id, poker_table_obj)
+    return {"success": True, "seq": seq}
 
 
 @app.post("/takeAction")
 async def take_action(item: ItemTakeAction):
-    table_id = item.tableId
-    player_id = Web3.to_checksum_address(item.address)
-    seat_i = item.seatI
-    action_type = int(item.actionType)
-    amount = int(item.amount)
+    return await run_on_table(item.tableId, _take_action, item)
+
+
+async def _take_action(item: ItemTakeAction):
+    player_id = to_checksum_address(item.address)
+    return await _apply_action(
+        item.tableId, player_id, int(item.actionType), int(item.amount)
+    )
+
+
+@sio.event
+async def takeAction(sid, data):
+    """
+    Same as POST /takeAction but over the open socket, acting as the address
+    the client authenticated with: {"tableId", "actionType", "amount"}
+    The ack carries the resulting event seq
+    """
+    session = await sio.get_session(sid)
+    player_id = session.get("address")
+    if player_id is None:
+        return {"success": False, "error": "Not authenticated!"}
+    table_id = str(data["tableId"])
+    try:
+        return await run_on_table(
+            table_id,
+            _apply_action,
+            table_id,
+            player_id,
+            int(data["actionType"]),
+            int(data["amount"]),
+        )
+    except (AssertionError, KeyError, ValueError) as e:
+        return {"success": False, "error": str(e)}
+    except HTTPException as e:
+        return {"success": False, "error": e.detail}
+
+
+async def _apply_action(table_id, player_id, action_type, amount):
     if table_id not in TABLE_STORE:
         return {"success": False, "error": "Table not found!"}
+    # Any action can end the hand in a showdown, which needs the hand rankings
+    await phase_ready("lookupTables")
     poker_table_obj = TABLE_STORE[table_id]
     start_hand_stage = poker_table_obj.hand_stage
 
@@ -330,7 +912,8 @@ async def take_action(item: ItemTakeAction):
     #     err = traceback.format_exc()
     #     return {"success": False, "error": err}
 
-    await ws_emit_actions(table_id, poker_table_obj)
+    await settle_hands(table_id, poker_table_obj)
+    seq = await ws_emit_actions(table_id, poker_table_obj)
 
     # Only cache if we completed a hand!
     """
@@ -344,15 +927,7 @@ async def take_action(item: ItemTakeAction):
             print("Intitial instantiation failed!", err)
             return False, {}
     """
-    return {"success": True}
-
-
-def gen_new_table_id():
-    table_id = None
-    random.seed(int(time.time()))
-    while not table_id or table_id in TABLE_STORE:
-        table_id = 10000 + int(random.random() * 990000)
-    return str(table_id)
+    return {"success": True, "seq": seq}
 
 
 @app.post("/createNewTable")
@@ -375,8 +950,8 @@ async def create_new_table(item: ItemCreateTable):
     poker_table_obj = poker.PokerTable(
         small_blind, big_blind, min_buyin, max_buyin, num_seats
     )
-    table_id = gen_new_table_id()
-    TABLE_STORE[table_id] = poker_table_obj
+    table_id = TABLE_REGISTRY.add(poker_table_obj)
+    await lobby_upsert(table_id, poker_table_obj)
     # except:
     #     err = traceback.format_exc()
     #     return {"tableId": None, "success": False, "error": err}
@@ -388,8 +963,58 @@ async def create_new_table(item: ItemCreateTable):
     return {"success": True, "tableId": table_id}
 
 
+async def lobby_upsert(table_id, poker_table_obj):
+    entry = LOBBY.upsert(table_id, poker_table_obj)
+    if BUS is not None and not SHARD.is_home:
+        await BUS.publish("lobby", {"op": "upsert", "entry": entry})
+
+
+async def lobby_remove(table_id):
+    LOBBY.remove(table_id)
+    if BUS is not None and not SHARD.is_home:
+        await BUS.publish("lobby", {"op": "remove", "tableId": table_id})
+
+
+async def sync_lobby(interval: float):
+    """
+    Table shards resend their whole lobby every so often, so the home shard
+    catches up after a dropped message or its own restart
+    """
+    while True:
+        await BUS.connected.wait()
+        entries = list(LOBBY.tables.values())
+        await BUS.publish(
+            "lobby", {"op": "sync", "shard": SHARD.shard_index, "entries": entries}
+        )
+        await asyncio.sleep(interval)
+
+
+async def on_lobby_message(msg):
+    """
+    Home shard keeps every shard's tables in its LOBBY, so /getTables and
+    /getLobbySummary cover the whole deployment
+    """
+    if msg["op"] == "upsert":
+        LOBBY.upsert_entry(msg["entry"])
+    elif msg["op"] == "remove":
+        LOBBY.remove(msg["tableId"])
+    elif msg["op"] == "sync":
+        shard = msg["shard"]
+        LOBBY.replace_where(
+            lambda t: sharding.shard_for(t, SHARD.num_shards) == shard, msg["entries"]
+        )
+
+
 @app.get("/getTables")
-async def get_tables():
+async def get_tables(
+    smallBlind: int = None,
+    bigBlind: int = None,
+    numSeats: int = None,
+    minOpenSeats: int = None,
+    sort: str = "stakes",
+    cursor: str = None,
+    limit: int = None,
+):
     # Example element...
     # {
     #     "tableId": 456,
@@ -400,32 +1025,96 @@ async def get_tables():
     #     "maxBuyin": 400,
     #     "numPlayers": 2,
     # },
-    tables = []
-    for table_id, table_obj in TABLE_STORE.items():
-        num_players = len([seat for seat in table_obj.seats if seat is not None])
-        table_info = {
-            "tableId": table_id,
-            "numSeats": table_obj.num_seats,
-            "smallBlind": table_obj.small_blind,
-            "bigBlind": table_obj.big_blind,
-            "minBuyin": table_obj.min_buyin,
-            "maxBuyin": table_obj.max_buyin,
-            "numPlayers": num_players,
-        }
-        tables.append(table_info)
-        print(table_id, table_obj)
+    # No limit returns every matching table, same as before pagination
+    if sort not in lobby.SORT_KEYS:
+        raise HTTPException(status_code=400, detail="Invalid sort!")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="Invalid limit!")
+    try:
+        tables, next_cursor = LOBBY.query(
+            small_blind=smallBlind,
+            big_blind=bigBlind,
+            num_seats=numSeats,
+            min_open_seats=minOpenSeats,
+            sort=sort,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor!") from e
+    return {"tables": tables, "nextCursor": next_cursor}
+
 
-    return {"tables": tables}
+@app.get("/getLobbySummary")
+async def get_lobby_summary():
+    """
+    Table, player and open seat counts per stakes/seat count
+    """
+    return {"groups": LOBBY.summary(), "totalTables": len(LOBBY)}
+
+
+def cached_response(request, key, version, build):
+    """
+    Serve an encoded snapshot from SNAPSHOT_CACHE, 304 if the client
+    already has this version
+    """
+    etag, body = SNAPSHOT_CACHE.get(key, version, build)
+    headers = {"ETag": etag}
+    if snapshotcache.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.get("/getTable")
-async def get_table(table_id: str):
+async def get_table(
+    request: Request,
+    table_id: str,
+    address: str = None,
+    timestamp: int = None,
+    signature: str = None,
+):
+    """
+    Spectator view, or the player's own view with their holecards if they
+    pass the same signed login the socket takes (address/timestamp/signature)
+    """
     if table_id not in TABLE_STORE:
         return {"success": False, "error": "Table not found!"}
 
     poker_table_obj = TABLE_STORE[table_id]
 
+    # Only show holecards to the player they belong to
+    seat_i = None
+    if address is not None and signature is not None:
+        # eth_account comes in with the chain phase
+        await phase_ready("chain")
+        auth = {"address": address, "timestamp": timestamp, "signature": signature}
+        signed_in = recover_auth_address(auth)
+        if signed_in is None:
+            return {"success": False, "error": "Invalid signature!"}
+        seat_i = poker_table_obj.player_to_seat.get(signed_in)
+
+    def build():
+        table_info = build_table_info(table_id, poker_table_obj, seat_i)
+        return json.dumps({"table_info": table_info})
+
+    key = ("table", table_id, seat_i)
+    return cached_response(request, key, poker_table_obj.version, build)
+
+
+@app.get("/getEvents")
+async def get_events(tableId: str, since: int):
+    """
+    Polling version of the socket 'resume' - spectator view of everything
+    after seq `since`, or a keyframe if that's too far back
+    """
+    if tableId not in TABLE_STORE:
+        return {"success": False, "error": "Table not found!"}
+    return {"data": build_catchup(tableId, since)}
+
+
+def build_table_info(table_id, poker_table_obj, seat_i=None):
     players = [pokerutils.build_player_data(seat) for seat in poker_table_obj.seats]
+    players = views.redact_players(players, seat_i)
     table_info = {
         "tableId": table_id,
         "numSeats": poker_table_obj.num_seats,
@@ -448,7 +1137,7 @@ async def get_table(table_id: str):
             "amount": poker_table_obj.hand_stage,
         },
     }
-    return {"table_info": table_info}
+    return table_info
 
 
 @app.get("/getHandHistory")
@@ -460,77 +1149,121 @@ async def get_hand_history(tableId: str, handId: int):
     if handId == -1:
         handIds = sorted(list(poker_table_obj.hand_histories.keys()))
         handId = handIds[-1]
-    return {"hh": poker_table_obj.hand_histories[handId]}
+    hand_history = poker_table_obj.hand_histories[handId]
+    if handId == poker_table_obj.hand_id:
+        # Still being played, nobody gets to see holecards yet
+        hand_history = views.redact_hand(hand_history)
+    return {"hh": hand_history}
+
+
+@app.get("/getDbStats")
+async def get_db_stats():
+    await phase_ready("ledger")
+    return {
+        "data": DB_POOL.stats(),
+        "ledger": LEDGER.stats(),
+        "snapshots": SNAPSHOT_CACHE.stats(),
+        "nfts": NFT_INDEXER.stats(),
+        "earnings": EARNINGS.stats(),
+        "nftStore": NFT_STORE.stats(),
+        "accrual": ACCRUAL_JOB.progress() if ACCRUAL_JOB is not None else None,
+        "txQueue": TX_QUEUE.stats() if TX_QUEUE is not None else None,
+        "vaultBalance": VAULT_BALANCE.stats(),
+        "rpcBatch": RPC_BATCHER.stats() if RPC_BATCHER is not None else None,
+    }
 
 
-def get_nft_holders():
-    # Fine for this to be non-async, only runs on startup
-    w3 = Web3(Web3.HTTPProvider(alchemy_url)) # if alchemy_url else Web3(Web3.HTTPProvider(infura_url))
-    print(w3)
-    # Create a contract instance
-    nft_contract = w3.eth.contract(address=nft_contract_address, abi=nft_contract_abi)
-
-    # Cache previous one to save on calls...
-    # fmt: off
-    holders = {'0xD9F8bf1F266E50Bb4dE528007f28c14bb7edaff7': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36, 37, 38, 39, 40, 42, 43, 44, 45, 46, 49, 50, 51, 52, 53, 54, 55, 56, 57, 58, 59, 60, 61, 62, 63, 64, 65, 66, 67, 68, 69, 70, 71, 72, 73, 74, 75, 76, 77, 78, 79, 80, 81, 82, 83, 84, 85, 86, 87, 88, 89, 90, 91, 92, 93, 94, 95, 101, 102, 103, 104, 105, 107], '0xC52178a1b28AbF7734b259c27956acBFd67d4636': [41, 47, 96, 97, 98, 99, 100, 106], '0x534631Bcf33BDb069fB20A93d2fdb9e4D4dD42CF': [48], '0x459e213D8B5E79d706aB22b945e3aF983d51BC4C': [108]}
-    # fmt: on
-    holders = {Web3.to_checksum_address(x): holders[x] for x in holders}
-    print(holders)
-    token_id = 0
-    for addr in holders:
-        max_token_id = max(holders[addr])
-        token_id = max(token_id, max_token_id)
-
-    fails = 0
-    while True:
-        try:
-            token_id += 1
-            owner = nft_contract.functions.ownerOf(token_id).call()
-            owner = Web3.to_checksum_address(owner)
-            if owner in holders:
-                holders[owner].append(token_id)
-            else:
-                holders[owner] = [token_id]
-            # time.sleep(0.25)
-        except Exception as e:
-            print("FAILED", e)
-            fails += 1
-            # time.sleep(5)
-            if fails >= 10:
-                print("CRASHED ON", token_id, owner)
-                break
-    global TOTAL_TOKENS
-    TOTAL_TOKENS += token_id * 1000
-    print("CURRENT HOLDERS")
-    print(holders)
+@app.get("/getTableMetrics")
+async def get_table_metrics(tableId: str = None):
+    """
+    Queue depth and wait times for the per-table actors
+    """
+    if tableId is not None:
+        if tableId not in TABLE_ACTORS:
+            return {"success": False, "error": "Table not found!"}
+        return {"data": [TABLE_ACTORS[tableId].metrics()]}
+    return {
+        "data": [actor.metrics() for actor in TABLE_ACTORS.values()],
+        "tables": TABLE_REGISTRY.metrics(),
+    }
+
+
+# Block the contract was deployed in, nothing to read before that
+if WEB3_PROVIDER == "tester":
+    NFT_START_BLOCK = int(os.environ.get("NFT_START_BLOCK", 0))
+else:
+    # Required - a first boot would otherwise read logs from genesis
+    NFT_START_BLOCK = int(os.environ["NFT_START_BLOCK"])
+
+# nft_owners is filled in the background from a checkpoint + the contract's
+# Transfer logs, startup doesn't wait on the chain (connect_chain attaches
+# the log source)
+NFT_INDEXER = nftindexer.TransferIndexer(
+    source=None,
+    checkpoint_path=os.environ.get("NFT_CHECKPOINT", "nft_index.json"),
+    start_block=NFT_START_BLOCK,
+    confirmations=int(os.environ.get("NFT_CONFIRMATIONS", 12)),
+    batch_blocks=int(os.environ.get("NFT_LOG_BATCH", 2000)),
+)
+NFT_INDEX_INTERVAL = float(os.environ.get("NFT_INDEX_INTERVAL", 15))
+nft_owners = NFT_INDEXER.owners
+# Earning rate per address and what it has earned since its last payout,
+# updated as nft_owners changes - checkpointed so earnings survive restarts
+EARNINGS = earnings.EarningsIndex(
+    NFT_STORE.rarity_of,
+    checkpoint_path=os.environ.get("EARNINGS_CHECKPOINT", "earnings.json"),
+)
+EARNINGS_SAVE_INTERVAL = float(os.environ.get("EARNINGS_SAVE_INTERVAL", 30))
+# Last /updateTokenBalances run, progress shows up in /getDbStats
+ACCRUAL_JOB = None
+ACCRUAL_CHUNK_SIZE = int(os.environ.get("ACCRUAL_CHUNK_SIZE", 10000))
+NFT_INDEXER.listeners.append(EARNINGS.on_owner_change)
 
-    return holders
 
+# Kept up to date as balances and nft_owners change
+LEADERBOARD = leaderboard.Leaderboard()
 
-# Hardcode this?  Figure out clean way to get it...
-# nft_owners = {"0xC52178a1b28AbF7734b259c27956acBFd67d4636": [0]}
-# TODO - reenable this...
-# print("SKIPPING NFT_OWNERS...")
-# nft_owners = {}
-nft_owners = get_nft_holders()
+
+def update_leaderboard_balance(address, row):
+    if len(address) == 42:
+        LEADERBOARD.update_balance(address, row["localBal"] + row["inPlay"])
+
+
+def update_leaderboard_earning_rate(address):
+    LEADERBOARD.update_earning_rate(address, EARNINGS.rate(address))
+
+
+def on_nft_owner_change(token_id, old_owner, new_owner):
+    global TOTAL_TOKENS
+    # Each NFT adds 1000 to the pool, burns (or mints that never landed) take it back
+    if old_owner is None:
+        TOTAL_TOKENS += 1000
+    else:
+        update_leaderboard_earning_rate(old_owner)
+    if new_owner is None:
+        TOTAL_TOKENS -= 1000
+    else:
+        update_leaderboard_earning_rate(new_owner)
+
+
+NFT_INDEXER.listeners.append(on_nft_owner_change)
 
 
 @app.get("/getUserNFTs")
 async def get_user_nfts(address: str):
     # Get a list of tokenIds of NFTs this user owns
-    address = Web3.to_checksum_address(address)
+    address = to_checksum_address(address)
     user_nfts = nft_owners.get(address, [])
-    ret_data = {tokenId: nft_map[tokenId] for tokenId in user_nfts}
-    for tokenId in user_nfts:
-        ret_data[tokenId]["forSale"] = tokenId in nft_listings_map
-    return ret_data
+    return NFT_STORE.many(user_nfts)
 
 
 @app.get("/getNFTMetadata")
 async def get_nft_metadata(tokenId: int):
     # {'cardNumber': 12, 'rarity': 73}
-    nft_map[tokenId]["forSale"] = tokenId in nft_listings_map
-    return nft_map[tokenId]
+    try:
+        return NFT_STORE.metadata(tokenId)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="NFT not found")
 
 
 @app.post("/createNewNFT")
@@ -546,51 +1279,29 @@ async def create_new_nft(item: CreateNftItem):
     #     for token_id in nft_owners[owner]:
     #         next_token_id = max(next_token_id, token_id + 1)
     token_id = item.tokenId
-
-    owner = Web3.to_checksum_address(item.address)
-    if owner in nft_owners:
-        nft_owners[owner].append(token_id)
-    else:
-        nft_owners[owner] = [token_id]
-
-    global TOTAL_TOKENS
-    TOTAL_TOKENS += 1000
     try:
-        bal_db = await read_balance_one(owner)
-        local_bal_new = bal_db["localBal"] + 500
-        await update_balance(
-            bal_db["onChainBal"], local_bal_new, bal_db["inPlay"], owner
-        )
-    except:
-        # {"address":"0x123","onChainBal":115,"localBal":21,"inPlay":456}
-        local_bal_new = 1000
-        await create_user(owner, 0, local_bal_new, 0)
+        NFT_STORE.ensure(token_id)
+    except KeyError:
+        raise HTTPException(status_code=400, detail="Invalid tokenId")
+
+    owner = to_checksum_address(item.address)
+    # Pending until the mint's Transfer log is confirmed, also adds it to
+    # TOTAL_TOKENS and the leaderboard
+    NFT_INDEXER.set_owner(token_id, owner)
+    # New users start with 1000
+    await credit_balance(owner, 500, new_user_bal=1000)
 
     # {'cardNumber': 12, 'rarity': 73}
     # "tokenId": next_token_id,
-    return nft_map[token_id]
-
-
-async def get_db_connection():
-    connection = await aiomysql.connect(
-        host="localhost",
-        port=3306,
-        user=os.environ["SQL_USER"],
-        password=os.environ["SQL_PASS"],
-        db="users",
-    )
-    return connection
+    return NFT_STORE.metadata(token_id)
 
 
 # Keep this call for debugging...
 @app.get("/users")
 async def read_users():
     global TOTAL_TOKENS
-    connection = await get_db_connection()
-    async with connection.cursor(aiomysql.DictCursor) as cursor:
-        await cursor.execute("SELECT * FROM user_balances")
-        users = await cursor.fetchall()
-    connection.close()
+    await phase_ready("ledger")
+    users = LEDGER.rows()
     # [{"address":"0x123","onChainBal":115,"localBal":21,"inPlay":456}]
     print("GOT USERS", users)
     return users
@@ -606,74 +1317,112 @@ class User(BaseModel):
 # @app.post("/users")
 # async def create_user(user: User):
 async def create_user(address, on_chain_bal, local_bal, in_play):
-    address = Web3.to_checksum_address(address)
-    connection = await get_db_connection()
-    async with connection.cursor() as cursor:
-        try:
-            await cursor.execute(
-                """
-                INSERT INTO user_balances (address, onChainBal, localBal, inPlay) 
-                VALUES (%s, %s, %s, %s)
-            """,
-                (address, str(on_chain_bal), str(local_bal), str(in_play)),
-            )
-            await connection.commit()
-        except Exception as e:
-            await connection.rollback()
-            raise HTTPException(status_code=400, detail="Error creating user") from e
-    connection.close()
+    address = to_checksum_address(address)
+    await phase_ready("ledger")
+    try:
+        LEDGER.create(address, on_chain_bal, local_bal, in_play)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Error creating user") from e
+    await LEDGER.sync()
     return {"message": "User created successfully"}
 
 
-class UserBalance(BaseModel):
+# @app.get("/balance_one")
+async def read_balance_one(address: str):
+    """
+    Served from the in-memory ledger, never waits on mysql
+    """
+    address = to_checksum_address(address)
+    await phase_ready("ledger")
+    try:
+        return LEDGER.get(address)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="User not found")
+
+
+async def adjust_balance(address, local_bal=0, in_play=0):
+    """
+    Apply balance deltas in one step on the home shard's ledger - table
+    shards call this over http, so there's no read-then-write to race
+    """
+    address = to_checksum_address(address)
+    if not SHARD.is_home:
+        data = {"address": address, "localBal": local_bal, "inPlay": in_play}
+        return await home_call("/internal/adjustBalance", data)
+    await phase_ready("ledger")
+    if not LEDGER.exists(address):
+        raise HTTPException(status_code=404, detail="User not found")
+    try:
+        LEDGER.adjust(address, local_bal=local_bal, in_play=in_play)
+    except AssertionError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    row = LEDGER.get(address)
+    await LEDGER.sync()
+    return row
+
+
+async def credit_balance(address, local_bal, on_chain_bal=0, new_user_bal=None):
+    """
+    Add to a user's balances, or create them with it (new_user_bal instead
+    of local_bal if given) - nothing awaits between the check and the write,
+    so a change landing meanwhile can't be overwritten
+    """
+    address = to_checksum_address(address)
+    await phase_ready("ledger")
+    if LEDGER.exists(address):
+        LEDGER.adjust(address, on_chain_bal=on_chain_bal, local_bal=local_bal)
+    else:
+        if new_user_bal is not None:
+            local_bal = new_user_bal
+        print("CREATING NEW USER...", address, on_chain_bal, local_bal, 0)
+        LEDGER.create(address, on_chain_bal, local_bal, 0)
+    await LEDGER.sync()
+
+
+async def home_call(path, data):
+    headers = {"X-Shard-Secret": SHARD.secret}
+    url = SHARD.home_url + path
+    async with HOME_SESSION.post(url, json=data, headers=headers) as resp:
+        body = await resp.json()
+        if resp.status != 200:
+            raise HTTPException(status_code=resp.status, detail=body.get("detail"))
+        return body
+
+
+def check_shard_secret(secret):
+    if not SHARD.is_home or not SHARD.secret or secret != SHARD.secret:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+class ItemAdjustBalance(BaseModel):
     address: str
-    onChainBal: int
     localBal: int
     inPlay: int
 
 
-# @app.put("/balances")
-# async def update_balance(balance: UserBalance):
-async def update_balance(on_chain_bal_new, local_bal_new, inPlay, address):
-    # (balance.onChainBal, balance.localBal, balance.inPlay, balance.address),
-    address = Web3.to_checksum_address(address)
-    connection = await get_db_connection()
-    print("ACTUALLY SETTING FOR ADDR", address)
-    async with connection.cursor() as cursor:
-        try:
-            await cursor.execute(
-                """
-                UPDATE user_balances 
-                SET onChainBal = %s, localBal = %s, inPlay = %s 
-                WHERE address = %s
-            """,
-                (str(on_chain_bal_new), str(local_bal_new), str(inPlay), address),
-            )
-            await connection.commit()
-        except Exception as e:
-            await connection.rollback()
-            raise HTTPException(status_code=400, detail="Error updating balance") from e
-    connection.close()
-    return {"message": "Balance updated successfully"}
+@app.post("/internal/adjustBalance")
+async def internal_adjust_balance(
+    item: ItemAdjustBalance, x_shard_secret: str = Header(None)
+):
+    check_shard_secret(x_shard_secret)
+    return await adjust_balance(item.address, item.localBal, item.inPlay)
 
 
-# @app.get("/balance_one")
-async def read_balance_one(address: str):
-    connection = await get_db_connection()
-    address = Web3.to_checksum_address(address)
-    async with connection.cursor(aiomysql.DictCursor) as cursor:
-        await cursor.execute(
-            "SELECT * FROM user_balances WHERE address = %s", (address,)
-        )
-        balance = await cursor.fetchone()
-        if balance is None:
-            raise HTTPException(status_code=404, detail="User not found")
-        # db entries are now strings
-        balance["onChainBal"] = int(float(balance["onChainBal"]))
-        balance["localBal"] = int(float(balance["localBal"]))
-        balance["inPlay"] = int(float(balance["inPlay"]))
-    connection.close()
-    return balance
+class ItemSettleHand(BaseModel):
+    hand: str
+    deltas: dict
+
+
+@app.post("/internal/settleHand")
+async def internal_settle_hand(
+    item: ItemSettleHand, x_shard_secret: str = Header(None)
+):
+    check_shard_secret(x_shard_secret)
+    await phase_ready("ledger")
+    settled = LEDGER.settle_hand(item.hand, item.deltas)
+    # The other shard drops it from its outbox once we answer
+    await LEDGER.sync()
+    return {"settled": settled}
 
 
 class WithdrawItem(BaseModel):
@@ -692,63 +1441,58 @@ async def withdraw(item: WithdrawItem):
     # 4. Update total supply
     # 5. Call the withdraw function on the TokenVault contract
 
-    address = Web3.to_checksum_address(item.address)
+    address = to_checksum_address(item.address)
     amount = item.amount
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Invalid amount!")
+    # Nothing to pay them out with otherwise
+    await phase_ready("signer")
+    await phase_ready("ledger")
+
+    # 1. + 3. Take the tokens before anything else awaits, so two withdrawals
+    # can't both spend the same balance
+    if not LEDGER.exists(address):
+        raise HTTPException(status_code=404, detail="User not found")
+    try:
+        LEDGER.adjust(address, local_bal=-amount)
+    except AssertionError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
 
-    # They should not be able to withdraw if they don't have a balance, so
-    # let this one fail
-    bal_db = await read_balance_one(address)
-    assert bal_db["localBal"] >= amount
-
-    # {"address":"0x123","onChainBal":115,"localBal":21,"inPlay":456}
+    global TOTAL_TOKENS
 
-    # plypkr = web3.eth.contract(address=plypkr_address, abi=plypkr_abi)
+    def refund(job):
+        # Never paid out, give them their tokens back
+        global TOTAL_TOKENS
+        LEDGER.adjust(address, local_bal=amount)
+        TOTAL_TOKENS += amount
 
     # 2. seeing how much they should get
-    total_eth = await web3.eth.get_balance(token_vault_address)
-    
-    global TOTAL_TOKENS
+    try:
+        await LEDGER.sync()
+        total_eth = await VAULT_BALANCE.get()
+    except Exception:
+        LEDGER.adjust(address, local_bal=amount)
+        raise
+    # Priced and counted with no await in between
     their_pct = amount / TOTAL_TOKENS
     # This will be in gwei
     cashout_amount_eth = int(their_pct * total_eth)
 
-    # 3. Update their balance in the database - (only localBal?)
-    local_bal_new = bal_db["localBal"] - amount
-    await update_balance(bal_db["onChainBal"], local_bal_new, bal_db["inPlay"], address)
-
     # 4. Update total supply
     TOTAL_TOKENS -= amount
 
     # 5. Call the withdraw function on the TokenVault contract
-    private_key = os.environ["PRIVATE_KEY"]
-    account = Account.from_key(private_key)
-    # account = web3.eth.account.privateKeyToAccount(private_key)
-    account_address = account.address
-    # bal = await plypkr.functions.balanceOf(account_address).call()
-    # Step 4: Call the withdraw function on the TokenVault contract
     print("CASHING OUT...", address, cashout_amount_eth)
-
-    nonce = await web3.eth.get_transaction_count(account_address)
-    address = Web3.to_checksum_address(address)
-    withdraw_txn = await token_vault.functions.withdraw(
-        address, cashout_amount_eth
-    ).build_transaction(
-        {
-            "from": account_address,
-            "nonce": nonce,
-            # "gas": 2000000,
-            # "gasPrice": web3.to_wei("50", "gwei"),
-        }
+    job_id = TX_QUEUE.submit(
+        "withdraw",
+        token_vault.functions.withdraw(address, cashout_amount_eth),
+        on_failed=refund,
     )
-    signed_withdraw_txn = web3.eth.account.sign_transaction(
-        withdraw_txn, private_key=private_key
-    )
-    withdraw_txn_hash = await web3.eth.send_raw_transaction(
-        signed_withdraw_txn.rawTransaction
-    )
-    print(f"Deposit transaction hash: {withdraw_txn_hash.hex()}")
-    # await web3.eth.wait_for_transaction_receipt(withdraw_txn_hash)
-    return {"success": True}
+    # Counted straight away so the next withdrawal isn't priced off the old
+    # balance, and on every refresh until on_tx_finished
+    VAULT_BALANCE.hold(job_id, -cashout_amount_eth)
+    # Poll /getJob for the transaction
+    return {"success": True, "jobId": job_id}
 
 
 @app.post("/deposited")
@@ -756,15 +1500,17 @@ async def post_deposited(item: ItemDeposit):
     """
     After user deposits to contract, update their balance in the database
     """
-    address = Web3.to_checksum_address(item.address)
+    address = to_checksum_address(item.address)
     deposit_amount = item.depositAmount
     deposit_amount = int(deposit_amount)
     # So get the DIFF between what they have and what we've tracked
 
     global TOTAL_TOKENS
 
-    # Get the balance in Wei
-    total_eth = await web3.eth.get_balance(token_vault_address)
+    # Get the balance in Wei - fetched again, it has to include their deposit
+    await phase_ready("chain")
+    VAULT_BALANCE.invalidate()
+    total_eth = await VAULT_BALANCE.get()
     deposit_share = deposit_amount / total_eth
     token_amount = int(deposit_share * TOTAL_TOKENS)
     TOTAL_TOKENS += token_amount
@@ -772,17 +1518,7 @@ async def post_deposited(item: ItemDeposit):
     print(deposit_amount, total_eth, deposit_share, token_amount)
 
     # {"address":"0x123","onChainBal":115,"localBal":21,"inPlay":456}
-    try:
-        bal_db = await read_balance_one(address)
-        on_chain_bal_new = bal_db["onChainBal"] + deposit_amount
-        local_bal_new = bal_db["localBal"] + token_amount
-        await update_balance(on_chain_bal_new, local_bal_new, bal_db["inPlay"], address)
-    except:
-        # {"address":"0x123","onChainBal":115,"localBal":21,"inPlay":456}
-        on_chain_bal_new = deposit_amount
-        local_bal_new = token_amount
-        print("CREATING NEW USER...", address, on_chain_bal_new, local_bal_new, 0)
-        await create_user(address, on_chain_bal_new, local_bal_new, 0)
+    await credit_balance(address, token_amount, on_chain_bal=deposit_amount)
 
     # Update local state tally...
     TOTAL_TOKENS += deposit_amount
@@ -793,7 +1529,7 @@ async def post_deposited(item: ItemDeposit):
 async def get_token_balance(address: str):
     # {"address":"0x123","onChainBal":115,"localBal":21,"inPlay":456}
     try:
-        address = Web3.to_checksum_address(address)
+        address = to_checksum_address(address)
     except:
         pass
     try:
@@ -803,13 +1539,12 @@ async def get_token_balance(address: str):
     print("GOT TOKEN BALANCE", bal)
     user_bal = bal.get("localBal", 0)
     user_bal = 0 if not user_bal else user_bal
-    time_elapsed = time.time() - START_TIME
+    time_elapsed = EARNINGS.elapsed(address)
 
     # """
-    user_nfts = nft_owners.get(address, [])
-    earning_rate = sum([nft_map[tokenId]["rarity"] for tokenId in user_nfts]) / 100
+    earning_rate = EARNINGS.rate(address)
     # Annualized rate - compare to total token supply
-    earnings_pct = (time_elapsed / (60 * 60 * 24 * 365)) * earning_rate
+    earnings_pct = EARNINGS.earned(address)
     print("ADDRESS, EARNINGS PCT", address, earnings_pct)
     bonus_earnings = int(earnings_pct * TOTAL_TOKENS)
     # Set a minimum rate of 1 token every 30 seconds?
@@ -830,10 +1565,8 @@ async def get_token_balance(address: str):
 @app.get("/getEarningRate")
 async def get_earning_rate(address: str):
     # Get their NFTs - sum up the rarity values and divide by 100?  Or normalize?
-    address = Web3.to_checksum_address(address)
-    user_nfts = nft_owners.get(address, [])
-    earning_rate = sum([nft_map[tokenId]["rarity"] for tokenId in user_nfts]) / 100
-    return {"data": earning_rate}
+    address = to_checksum_address(address)
+    return {"data": EARNINGS.rate(address)}
 
 
 @app.get("/getRealTimeConversion")
@@ -843,7 +1576,8 @@ async def get_real_time_conversion():
     total_tokens = TOTAL_TOKENS
 
     # Get the balance in Wei
-    total_eth = await web3.eth.get_balance(token_vault_address)
+    await phase_ready("chain")
+    total_eth = await VAULT_BALANCE.get()
     total_eth = total_eth / 10**18
 
     if total_eth > 0:
@@ -854,31 +1588,21 @@ async def get_real_time_conversion():
 
 
 @app.get("/getLeaderboard")
-async def get_leaderboard():
-    global TOTAL_TOKENS
-    connection = await get_db_connection()
-    async with connection.cursor(aiomysql.DictCursor) as cursor:
-        await cursor.execute("SELECT * FROM user_balances")
-        users = await cursor.fetchall()
-    connection.close()
-    # [{"address":"0x123","onChainBal":115,"localBal":21,"inPlay":456}]
-    leaders = []
-    for user in users:
-        if len(user["address"]) == 42:
-            user_nfts = nft_owners.get(user["address"], [])
-            earning_rate = (
-                sum([nft_map[tokenId]["rarity"] for tokenId in user_nfts]) / 100
-            )
-            bal_tot = int(float(user["localBal"])) + int(float(user["inPlay"]))
-            leaders.append(
-                {
-                    "address": user["address"],
-                    "balance": bal_tot,
-                    "earningRate": earning_rate,
-                }
-            )
-    print("GOT USERS", users)
-    return {"leaderboard": leaders}
+async def get_leaderboard(offset: int = 0, limit: int = None, top: int = None):
+    """
+    Sorted by balance, biggest first - use top=K or offset/limit to page
+    """
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid offset!")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="Invalid limit!")
+    if top is not None and top < 1:
+        raise HTTPException(status_code=400, detail="Invalid top!")
+    if top is not None:
+        leaders = LEADERBOARD.top(top)
+    else:
+        leaders = LEADERBOARD.page(offset, limit)
+    return {"leaderboard": leaders, "total": len(LEADERBOARD)}
 
 
 @app.post("/updateTokenBalances")
@@ -886,28 +1610,18 @@ async def update_token_balances():
     """
     Before shutting down - call this ONCE so we track updated balances
     """
-    connection = await get_db_connection()
-    async with connection.cursor(aiomysql.DictCursor) as cursor:
-        await cursor.execute("SELECT * FROM user_balances")
-        users = await cursor.fetchall()
-    connection.close()
-
-    for bal_db in users:
-        user_bal = bal_db.get("localBal", 0)
-        user_bal = 0 if not user_bal else user_bal
-        time_elapsed = time.time() - START_TIME
-
-        user_nfts = nft_owners.get(bal_db["address"], [])
-        earning_rate = sum([nft_map[tokenId]["rarity"] for tokenId in user_nfts]) / 100
-        # Annualized rate
-        earnings_pct = (time_elapsed / (60 * 60 * 24 * 365)) * earning_rate
-        user_bal += int(earnings_pct * TOTAL_TOKENS)
-        local_bal_new = user_bal
-
-        await update_balance(
-            bal_db["onChainBal"], local_bal_new, bal_db["inPlay"], bal_db["address"]
-        )
-    return {"success": True}
+    global ACCRUAL_JOB
+    await phase_ready("ledger")
+    if ACCRUAL_JOB is not None and ACCRUAL_JOB.running:
+        return {"success": False, "error": "Already running", **ACCRUAL_JOB.progress()}
+    ACCRUAL_JOB = accrual.AccrualJob(
+        LEDGER, EARNINGS, TOTAL_TOKENS, chunk_size=ACCRUAL_CHUNK_SIZE
+    )
+    await ACCRUAL_JOB.run()
+    # Paid out now, so it isn't paid again after a restart
+    EARNINGS.save_checkpoint()
+    print("TOKEN BALANCES UPDATED", ACCRUAL_JOB.progress())
+    return {"success": True, **ACCRUAL_JOB.progress()}
 
 
 class ItemTransferNFT(BaseModel):
@@ -918,46 +1632,22 @@ class ItemTransferNFT(BaseModel):
 
 # @app.post("/transferNFT")
 # async def transfer_nft(item: ItemTransferNFT):
-async def transfer_nft(from_, to_, tokenId):
+async def transfer_nft(from_, to_, tokenId, on_failed=None):
+    """
+    Queues the transfer and returns its job id
+    """
     # Endpoint (plus many others) need to be secured so users can't directly call this endpoint
     # from_ = item.from_
-    from_ = Web3.to_checksum_address(from_)
+    from_ = to_checksum_address(from_)
     # to_ = item.to_
-    to_ = Web3.to_checksum_address(to_)
+    to_ = to_checksum_address(to_)
     # tokenId = item.tokenId
 
     # Our call...
     # nft_contract.transferFrom(from_, to_, tokenId)
-
-    # 5. Call the withdraw function on the TokenVault contract
-    private_key = os.environ["PRIVATE_KEY"]
-    account = Account.from_key(private_key)
-    # account = web3.eth.account.privateKeyToAccount(private_key)
-    account_address = account.address
-    # bal = await plypkr.functions.balanceOf(account_address).call()
-    # Step 4: Call the withdraw function on the TokenVault contract
-    nonce = await web3.eth.get_transaction_count(account_address)
-
-    transfer_txn = await nft_contract_async.functions.transferFrom(
-        from_, to_, tokenId
-    ).build_transaction(
-        {
-            "from": account_address,
-            "nonce": nonce,
-            # "gas": 2000000,
-            # "gasPrice": web3.to_wei("50", "gwei"),
-        }
-    )
-
-    signed_withdraw_txn = web3.eth.account.sign_transaction(
-        transfer_txn, private_key=private_key
-    )
-    withdraw_txn_hash = await web3.eth.send_raw_transaction(
-        signed_withdraw_txn.rawTransaction
-    )
-    print(f"Deposit transaction hash: {withdraw_txn_hash.hex()}")
-    # await web3.eth.wait_for_transaction_receipt(withdraw_txn_hash)
-    return {"success": True}
+    await phase_ready("signer")
+    transfer_call = nft_contract_async.functions.transferFrom(from_, to_, tokenId)
+    return TX_QUEUE.submit("transferNFT", transfer_call, on_failed=on_failed)
 
 
 class ItemListNFT(BaseModel):
@@ -973,11 +1663,17 @@ async def list_nft(item: ItemListNFT):
     Need to secure this endpoint too...
     """
     # Ensure user owns this nft before listing it
-    address = Web3.to_checksum_address(item.address)
+    address = to_checksum_address(item.address)
     user_nfts = nft_owners.get(address, [])
     assert item.tokenId in user_nfts, "User does not own nft!"
-    nft_listings_map[item.tokenId] = {"seller": address, "amount": item.amount}
-    nft_map[item.tokenId]["forSale"] = True
+    NFT_LISTINGS.add(
+        item.tokenId,
+        address,
+        item.amount,
+        NFT_STORE.card_of(item.tokenId),
+        NFT_STORE.rarity_of(item.tokenId),
+    )
+    NFT_STORE.set_for_sale(item.tokenId, True)
     return {"success": True}
 
 
@@ -993,69 +1689,100 @@ class ItemCancelNFT(BaseModel):
 
 @app.post("/cancelListing")
 async def cancel_listing(item: ItemCancelNFT):
-    nft_map[item.tokenId]["forSale"] = False
-    try:
-        nft_listings_map.pop(item.tokenId)
-    except:
-        pass
+    NFT_STORE.set_for_sale(item.tokenId, False)
+    NFT_LISTINGS.remove(item.tokenId)
     return {"success": True}
 
 
 @app.post("/buyNFT")
 async def buy_nft(item: ItemBuyNFT):
     # Completes a trade...
-    nft_data = nft_listings_map[item.tokenId]
-    # nft_data["seller"]
-    # nft_data["amount"]
-
-    # In DB - change token balances of each user involved
-    bal_db_seller = await read_balance_one(item.addressBuyer)
-    bal_db_buyer = await read_balance_one(nft_data["seller"])
-
+    buyer = to_checksum_address(item.addressBuyer)
+    await phase_ready("ledger")
+    await phase_ready("signer")
+
+    # Listing check, both balances and delisting with no await in between,
+    # so two buyers can't both get the same token
+    nft_data = NFT_LISTINGS.get(item.tokenId)
+    if nft_data is None:
+        raise HTTPException(status_code=400, detail="NFT is not listed!")
+    seller = nft_data["seller"]
+    amount = nft_data["amount"]
+    if not LEDGER.exists(buyer) or not LEDGER.exists(seller):
+        raise HTTPException(status_code=404, detail="User not found")
     # Buyer MUST have enough funds to buy it...
-    # [{"address":"0x123","onChainBal":115,"localBal":21,"inPlay":456}]
-    assert bal_db_buyer["localBal"] >= nft_data["amount"]
-
-    # Do this first, since they might not have called 'approve' on the nft
-    await transfer_nft(nft_data["seller"], item.addressBuyer, item.tokenId)
-
-    await update_balance(
-        bal_db_buyer["onChainBal"],
-        bal_db_buyer["localBal"] - nft_data["amount"],
-        bal_db_buyer["inPlay"],
-        bal_db_buyer["address"],
-    )
-    await update_balance(
-        bal_db_seller["onChainBal"],
-        bal_db_seller["localBal"] + nft_data["amount"],
-        bal_db_seller["inPlay"],
-        bal_db_seller["address"],
-    )
+    try:
+        LEDGER.adjust(buyer, local_bal=-amount)
+    except AssertionError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    LEDGER.adjust(seller, local_bal=amount)
+    NFT_LISTINGS.remove(item.tokenId)
+    NFT_STORE.set_for_sale(item.tokenId, False)
+    # Shown straight away, the indexer settles it once the transfer is confirmed
+    NFT_INDEXER.set_owner(item.tokenId, buyer)
+
+    def undo_trade(job):
+        # They might not have called 'approve' on the nft - put everything back
+        LEDGER.adjust(buyer, local_bal=amount)
+        LEDGER.adjust(seller, local_bal=-amount)
+        NFT_INDEXER.set_owner(item.tokenId, seller)
+        NFT_LISTINGS.add(
+            item.tokenId,
+            seller,
+            amount,
+            nft_data["cardNumber"],
+            nft_data["rarity"],
+        )
+        NFT_STORE.set_for_sale(item.tokenId, True)
 
-    # And need to update our local mapping too
-    if item.addressBuyer not in nft_owners:
-        nft_owners[item.addressBuyer] = []
-    nft_owners[item.addressBuyer].append(item.tokenId)
-    nft_owners[nft_data["seller"]].remove(item.tokenId)
-    nft_map[item.tokenId]["forSale"] = False
-    nft_listings_map.pop(item.tokenId)
+    try:
+        job_id = await transfer_nft(seller, buyer, item.tokenId, on_failed=undo_trade)
+    except Exception:
+        undo_trade(None)
+        raise
+    await LEDGER.sync()
+    return {"success": True, "jobId": job_id}
 
 
 @app.get("/getListings")
-async def get_listings():
-    ret_data = []
-    # {"seller": item.address, "amount": item.amount}
-    for tokenId in nft_listings_map:
-        nft_listings_map[tokenId]
-        ret_data.append(
-            {
-                "tokenId": tokenId,
-                "seller": nft_listings_map[tokenId]["seller"],
-                "amount": nft_listings_map[tokenId]["amount"],
-                "metadata": nft_map[tokenId],
-            }
+async def get_listings(
+    cardNumber: int = None,
+    minRarity: int = None,
+    maxRarity: int = None,
+    order: str = "asc",
+    cursor: str = None,
+    limit: int = None,
+):
+    """
+    Sorted by price (order=asc/desc), optionally filtered by cardNumber and
+    a rarity range - pass limit, then nextCursor as cursor, to page
+    """
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Invalid order!")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="Invalid limit!")
+    try:
+        page, next_cursor = NFT_LISTINGS.query(
+            card_number=cardNumber,
+            min_rarity=minRarity,
+            max_rarity=maxRarity,
+            order=order,
+            cursor=cursor,
+            limit=limit,
         )
-    return {"data": ret_data}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor!") from e
+    metadata = NFT_STORE.many([listing["tokenId"] for listing in page])
+    ret_data = [
+        {
+            "tokenId": listing["tokenId"],
+            "seller": listing["seller"],
+            "amount": listing["amount"],
+            "metadata": metadata[listing["tokenId"]],
+        }
+        for listing in page
+    ]
+    return {"data": ret_data, "nextCursor": next_cursor, "total": len(NFT_LISTINGS)}
 
 
 class ItemAirdrop(BaseModel):
@@ -1064,42 +1791,50 @@ class ItemAirdrop(BaseModel):
 
 @app.post("/airdrop")
 async def do_airdrop(item: ItemAirdrop):
-    address = Web3.to_checksum_address(item.address)
+    address = to_checksum_address(item.address)
 
     # Hardcode the amount we'll send to them...
     # .001 eth =
     amount_wei = 10**15
 
-    # 5. Call the withdraw function on the TokenVault contract
-    private_key = os.environ["PRIVATE_KEY"]
-    account = Account.from_key(private_key)
-    account_address = account.address
-    nonce = await web3.eth.get_transaction_count(account_address)
-    gas_price = await web3.eth.gas_price
-
-    # Build the transaction
-    tx = {
-        "nonce": nonce,
-        "to": address,
-        "value": amount_wei,
-        "gas": 21000,
-        "gasPrice": gas_price,
-        "from": account_address,
-        "chainId": 84532,
-    }
+    await phase_ready("signer")
+    # Nonce, fees and chain id are filled in by the queue
+    tx = {"to": address, "value": amount_wei, "gas": 21000}
+    job_id = TX_QUEUE.submit("airdrop", tx)
+    return {"success": True, "jobId": job_id}
 
-    signed_tx = web3.eth.account.sign_transaction(tx, private_key)
-    tx_hash = await web3.eth.send_raw_transaction(signed_tx.rawTransaction)
-    print("DONE", tx_hash)
-    return {"success": True}
+
+def on_tx_finished(job):
+    if job.kind == "withdraw":
+        # Mined or given up on, either way the chain has the real balance
+        VAULT_BALANCE.release(job.id)
+
+
+@app.get("/getJob")
+async def get_job(jobId: str):
+    """
+    Progress of a queued transaction - queued, sent, confirmed or failed
+    """
+    await phase_ready("signer")
+    job = TX_QUEUE.get(jobId)
+    if job is None:
+        return {"success": False, "error": "Job not found!"}
+    return {"data": job}
 
 
 @app.get("/getGamestate")
-async def get_gamestate(tableId: str):
+async def get_gamestate(request: Request, tableId: str):
     if tableId not in TABLE_STORE:
         return {"success": False, "error": "Table not found!"}
     poker_table_obj = TABLE_STORE[tableId]
-    return {"data": poker_table_obj.serialize()}
+
+    def build():
+        # Same shape as serialize(), minus the deck and everyone's holecards
+        state = views.redact_gamestate(poker_table_obj.__dict__)
+        return json.dumps({"data": json.dumps(state)})
+
+    key = ("gamestate", tableId, None)
+    return cached_response(request, key, poker_table_obj.version, build)
 
 
 class ItemSetTokens(BaseModel):
@@ -1115,20 +1850,12 @@ async def set_tokens(item: ItemSetTokens):
     # So get the DIFF between what they have and what we've tracked
 
     # {"address":"0x123","onChainBal":115,"localBal":21,"inPlay":456}
-    try:
-        bal_db = await read_balance_one(address)
-        on_chain_bal_new = 0
-        local_bal_new = bal_db["localBal"] + deposit_amount
-        await update_balance(on_chain_bal_new, local_bal_new, bal_db["inPlay"], address)
-    except:
-        # {"address":"0x123","onChainBal":115,"localBal":21,"inPlay":456}
-        on_chain_bal_new = 0
-        local_bal_new = deposit_amount
-        print("CREATING NEW USER...", address, on_chain_bal_new, local_bal_new, 0)
-        await create_user(address, on_chain_bal_new, local_bal_new, 0)
+    await credit_balance(address, deposit_amount)
 
     return {"success": True}
 
 
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
 # RUN:
 # uvicorn fastapp:socket_app --host 127.0.0.1 --port 8000
@@ -0,0 +1,136 @@
+"""
+Front door for a sharded deployment - forwards every request to the api
+worker that owns its table, everything else goes to the home shard (0)
+
+    python -m vanillapoker.bus --port 8765
+    export NUM_SHARDS=2 SHARD_SECRET=... BUS_URL=127.0.0.1:8765
+    export SHARD_URLS=http://127.0.0.1:8001,http://127.0.0.1:8002
+    SHARD_INDEX=0 uvicorn fastapp:socket_app --port 8001
+    SHARD_INDEX=1 uvicorn fastapp:socket_app --port 8002
+    python router.py --port 8000
+
+Table requests are routed by tableId (query string or json body), new tables
+are spread round robin. Socket.IO clients connect with ?tableId=... so they
+stick to the worker running that table - watching tables on two shards means
+two connections.
+"""
+import sys
+import json
+import asyncio
+import argparse
+import itertools
+import aiohttp
+from aiohttp import web
+
+sys.path.append("../")
+from vanillapoker import sharding
+
+# Not forwarded in either direction
+HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+    "content-length",
+}
+
+SHARD = sharding.config_from_env()
+SESSION = None
+NEXT_SHARD = itertools.cycle(range(SHARD.num_shards))
+
+
+def table_id_for(request, body):
+    table_id = request.query.get("tableId") or request.query.get("table_id")
+    if table_id is None and body:
+        try:
+            table_id = json.loads(body).get("tableId")
+        except (ValueError, AttributeError):
+            pass
+    return table_id
+
+
+def pick_shard(request, body):
+    if request.path == "/createNewTable":
+        return next(NEXT_SHARD)
+    table_id = table_id_for(request, body)
+    if table_id is None:
+        return 0
+    return sharding.shard_for(str(table_id), SHARD.num_shards)
+
+
+async def handle(request):
+    # Only other shards get to call these, and never through the router
+    if request.path.startswith("/internal/"):
+        raise web.HTTPNotFound()
+    body = await request.read()
+    base_url = SHARD.urls[pick_shard(request, body)]
+    if request.headers.get("Upgrade", "").lower() == "websocket":
+        return await proxy_ws(request, base_url)
+    return await proxy_http(request, base_url, body)
+
+
+async def proxy_http(request, base_url, body):
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+    async with SESSION.request(
+        request.method, base_url + request.path_qs, headers=headers, data=body
+    ) as resp:
+        data = await resp.read()
+        headers = {
+            k: v for k, v in resp.headers.items() if k.lower() not in HOP_HEADERS
+        }
+        return web.Response(status=resp.status, body=data, headers=headers)
+
+
+async def proxy_ws(request, base_url):
+    client_ws = web.WebSocketResponse()
+    await client_ws.prepare(request)
+    url = "ws" + base_url[len("http") :] + request.path_qs
+    async with SESSION.ws_connect(url) as upstream_ws:
+
+        async def pump(src, dst):
+            async for msg in src:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    await dst.send_str(msg.data)
+                elif msg.type == aiohttp.WSMsgType.BINARY:
+                    await dst.send_bytes(msg.data)
+                else:
+                    break
+
+        tasks = [
+            asyncio.create_task(pump(client_ws, upstream_ws)),
+            asyncio.create_task(pump(upstream_ws, client_ws)),
+        ]
+        # Either side hanging up ends the session
+        _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+    await client_ws.close()
+    return client_ws
+
+
+async def on_startup(app):
+    global SESSION
+    # Pass compressed bodies through untouched
+    SESSION = aiohttp.ClientSession(auto_decompress=False)
+
+
+async def on_cleanup(app):
+    await SESSION.close()
+
+
+def make_app():
+    assert len(SHARD.urls) == SHARD.num_shards, "Need one SHARD_URLS entry per shard"
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handle)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    web.run_app(make_app(), host=args.host, port=args.port)
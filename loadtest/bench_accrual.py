@@ -0,0 +1,75 @@
+"""
+Compare the old /updateTokenBalances loop (one ledger write per user) against
+AccrualJob, on an in-memory user_balances table with the journal on disk
+
+Every user holds an NFT, the worst case:
+    python bench_accrual.py --users 1000000 --loop-users 20000
+"""
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.append("../")
+from vanillapoker import accrual, earnings, ledger, memorydb
+
+
+def bench_address(i):
+    return f"0x{i:040x}"
+
+
+async def setup(num_users, journal_path, fsync):
+    bl = ledger.BalanceLedger(memorydb.MemoryPool(), journal_path, fsync=fsync)
+    await bl.load()
+    bl.set_many(
+        [
+            {"address": bench_address(i), "onChainBal": 0, "localBal": 1000, "inPlay": 0}
+            for i in range(num_users)
+        ]
+    )
+    await bl.flush()
+    clock_start = time.time() - 60 * 60 * 24
+    index = earnings.EarningsIndex(lambda i: 1 + i % 100, clock=lambda: clock_start)
+    for i in range(num_users):
+        index.on_owner_change(i, None, bench_address(i))
+    index.clock = time.time
+    return bl, index
+
+
+async def run_loop(bl, index, total_tokens):
+    # Same as the endpoint used to do, minus the HTTP-side overhead
+    t0 = time.perf_counter()
+    for row in bl.rows():
+        earnings_pct = index.earned(row["address"])
+        bl.set(
+            row["address"],
+            row["onChainBal"],
+            row["localBal"] + int(earnings_pct * total_tokens),
+            row["inPlay"],
+        )
+        # Each one was its own acknowledged write
+        await bl.sync()
+    await bl.flush()
+    elapsed = time.perf_counter() - t0
+    return {"rows": len(bl.balances), "seconds": elapsed, "rowsPerSec": len(bl.balances) / elapsed}
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        bl, index = await setup(args.loop_users, f"{tmp}/loop.log", fsync=True)
+        print("ledger write per user:", await run_loop(bl, index, args.total_tokens))
+
+        bl, index = await setup(args.users, f"{tmp}/job.log", fsync=True)
+        job = accrual.AccrualJob(bl, index, args.total_tokens, chunk_size=args.chunk_size)
+        await job.run()
+        print("accrual job:          ", job.progress())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--loop-users", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--total-tokens", type=int, default=10**9)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,132 @@
+"""
+Compare a fresh aiomysql connection per query against the shared pool
+
+Simulates concurrent /joinTable calls, each one is a balance read followed by
+a balance write (two connect/teardown cycles without the pool)
+
+Run against a local MySQL (or MariaDB) with a user_balances table:
+    SQL_USER=... SQL_PASS=... SQL_DB=users_bench python bench_db_pool.py --joins 2000 --concurrency 50
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import aiomysql
+
+sys.path.append("../")
+from vanillapoker import dbpool
+
+ADDRESS_PREFIX = "0xbe9c"
+
+
+def bench_address(i):
+    return ADDRESS_PREFIX + f"{i:038x}"
+
+
+def conn_kwargs():
+    return {
+        "host": os.environ.get("SQL_HOST", "localhost"),
+        "port": int(os.environ.get("SQL_PORT", 3306)),
+        "user": os.environ["SQL_USER"],
+        "password": os.environ["SQL_PASS"],
+        "db": os.environ.get("SQL_DB", "users"),
+    }
+
+
+async def join_unpooled(address):
+    # Same pattern the api used before: connect, query, close - twice
+    connection = await aiomysql.connect(**conn_kwargs())
+    async with connection.cursor(aiomysql.DictCursor) as cursor:
+        await cursor.execute(dbpool.SQL_SELECT_BALANCE, (address,))
+        bal = await cursor.fetchone()
+    connection.close()
+
+    connection = await aiomysql.connect(**conn_kwargs())
+    async with connection.cursor() as cursor:
+        await cursor.execute(
+            dbpool.SQL_UPDATE_BALANCE,
+            (bal["onChainBal"], bal["localBal"], bal["inPlay"], address),
+        )
+        await connection.commit()
+    connection.close()
+
+
+async def join_pooled(pool, address):
+    async with pool.connection() as connection:
+        async with connection.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(dbpool.SQL_SELECT_BALANCE, (address,))
+            bal = await cursor.fetchone()
+
+    async with pool.connection() as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute(
+                dbpool.SQL_UPDATE_BALANCE,
+                (bal["onChainBal"], bal["localBal"], bal["inPlay"], address),
+            )
+            await connection.commit()
+
+
+async def run(fn, num_joins, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with sem:
+            t0 = time.perf_counter()
+            await fn(bench_address(i % concurrency))
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(num_joins)])
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "joins/s": num_joins / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+async def main(args):
+    pool = dbpool.DBPool(
+        minsize=args.pool_size, maxsize=args.pool_size, **conn_kwargs()
+    )
+    await pool.open()
+
+    # Seed one row per concurrent worker
+    async with pool.connection() as connection:
+        async with connection.cursor() as cursor:
+            for i in range(args.concurrency):
+                await cursor.execute(
+                    "DELETE FROM user_balances WHERE address = %s", (bench_address(i),)
+                )
+                await cursor.execute(
+                    dbpool.SQL_INSERT_USER, (bench_address(i), "0", "1000", "0")
+                )
+        await connection.commit()
+
+    try:
+        unpooled = await run(join_unpooled, args.joins, args.concurrency)
+        print("connect per query:", unpooled)
+        pooled = await run(lambda a: join_pooled(pool, a), args.joins, args.concurrency)
+        print("pooled:           ", pooled)
+        print("pool stats:", pool.stats())
+        print("speedup: %.1fx" % (pooled["joins/s"] / unpooled["joins/s"]))
+    finally:
+        async with pool.connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(
+                    "DELETE FROM user_balances WHERE address LIKE %s",
+                    (ADDRESS_PREFIX + "%",),
+                )
+            await connection.commit()
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--joins", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pool-size", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
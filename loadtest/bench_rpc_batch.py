@@ -0,0 +1,94 @@
+"""
+Compare plain AsyncHTTPProvider calls against BatchingProvider
+
+Simulates bursts of balance and ownerOf lookups against a local JSON-RPC node
+with a fixed latency per HTTP request, the way a hosted provider behaves:
+    python bench_rpc_batch.py --calls 2000 --concurrency 100 --latency 0.05
+"""
+import sys
+import time
+import asyncio
+import argparse
+from web3 import AsyncWeb3
+from eth_utils import to_checksum_address
+
+sys.path.append("../")
+from vanillapoker import localrpc, rpcbatch
+
+NFT_ADDRESS = to_checksum_address("0x" + "ab" * 20)
+OWNER_OF_ABI = [
+    {
+        "name": "ownerOf",
+        "type": "function",
+        "stateMutability": "view",
+        "inputs": [{"name": "tokenId", "type": "uint256"}],
+        "outputs": [{"name": "", "type": "address"}],
+    }
+]
+
+
+def bench_address(i):
+    return to_checksum_address(f"0x{i + 1:040x}")
+
+
+async def run(w3, num_calls, concurrency):
+    contract = w3.eth.contract(address=NFT_ADDRESS, abi=OWNER_OF_ABI)
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with sem:
+            t0 = time.perf_counter()
+            if i % 2:
+                await w3.eth.get_balance(bench_address(i % concurrency))
+            else:
+                await contract.functions.ownerOf(i % concurrency).call()
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(num_calls)])
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "calls/s": num_calls / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+async def main(args):
+    server = localrpc.LocalRpcServer(latency=args.latency)
+    for i in range(args.concurrency):
+        server.balances[bench_address(i).lower()] = i
+        server.owners[i] = bench_address(i)
+    await server.start()
+
+    try:
+        plain = await run(
+            AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(server.url)),
+            args.calls,
+            args.concurrency,
+        )
+        plain_requests = server.http_requests
+        print("one request per call:", plain, f"http requests: {plain_requests}")
+
+        server.http_requests = 0
+        provider = rpcbatch.BatchingProvider(
+            server.url, window=args.window, max_batch=args.max_batch
+        )
+        batched = await run(AsyncWeb3(provider), args.calls, args.concurrency)
+        print("batched:             ", batched, f"http requests: {server.http_requests}")
+        print("provider stats:", provider.stats())
+        print("speedup: %.1fx" % (batched["calls/s"] / plain["calls/s"]))
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--window", type=float, default=0.005)
+    parser.add_argument("--max-batch", type=int, default=100)
+    asyncio.run(main(parser.parse_args()))
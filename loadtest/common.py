@@ -0,0 +1,25 @@
+import random
+
+
+def random_address():
+    return "0x" + "".join(random.choice("0123456789abcdef") for _ in range(40))
+
+
+def summarize(latencies):
+    """
+    latencies in seconds -> counts and percentiles in ms
+    """
+    if not latencies:
+        return {"n": 0}
+    vals = sorted(latencies)
+
+    def pct(p):
+        return vals[min(int(len(vals) * p), len(vals) - 1)] * 1000
+
+    return {
+        "n": len(vals),
+        "p50_ms": round(pct(0.50), 2),
+        "p95_ms": round(pct(0.95), 2),
+        "p99_ms": round(pct(0.99), 2),
+        "max_ms": round(vals[-1] * 1000, 2),
+    }
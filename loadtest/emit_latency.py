@@ -0,0 +1,124 @@
+"""
+End-to-end latency from POST /takeAction to the last subscribed client
+receiving the events it produced
+
+Start the api with EMIT_MODE=event (default) or EMIT_MODE=batch and run:
+    python emit_latency.py --url http://127.0.0.1:8000 --spectators 50 --actions 500
+"""
+import time
+import asyncio
+import argparse
+import aiohttp
+import socketio
+from common import random_address, summarize
+
+ACT_CALL = 4
+ACT_CHECK = 5
+
+
+class Watcher:
+    """
+    Socket.IO client recording when each event seq arrived
+    """
+
+    def __init__(self, url, table_id):
+        self.url = url
+        self.table_id = table_id
+        self.arrivals = {}
+        self.client = socketio.AsyncClient()
+        self.client.on("tableEvents", self.on_frame)
+        # Per-event mode uses the table id as the event name
+        self.client.on(table_id, self.on_event)
+
+    async def on_frame(self, frame):
+        now = time.perf_counter()
+        for item in frame["events"]:
+            self.arrivals[item["seq"]] = now
+
+    async def on_event(self, event):
+        self.arrivals[event["seq"]] = time.perf_counter()
+
+    async def start(self):
+        await self.client.connect(self.url)
+        await self.client.call("subscribe", {"tableId": self.table_id})
+
+    async def wait_for(self, seq, timeout=5.0):
+        deadline = time.perf_counter() + timeout
+        while seq not in self.arrivals:
+            if time.perf_counter() > deadline:
+                return None
+            await asyncio.sleep(0.001)
+        return self.arrivals[seq]
+
+
+async def post(session, url, path, data):
+    async with session.post(url + path, json=data) as resp:
+        return await resp.json()
+
+
+async def main(args):
+    async with aiohttp.ClientSession() as session:
+        table_params = {
+            "smallBlind": 1,
+            "bigBlind": 2,
+            "minBuyin": 40,
+            "maxBuyin": 400,
+            "numSeats": 2,
+        }
+        res = await post(session, args.url, "/createNewTable", table_params)
+        table_id = res["tableId"]
+
+        watchers = [Watcher(args.url, table_id) for _ in range(args.spectators)]
+        await asyncio.gather(*[w.start() for w in watchers])
+
+        for seat_i in range(2):
+            address = random_address()
+            funding = {"address": address, "depositAmount": 10**9}
+            await post(session, args.url, "/setTokens", funding)
+            join = {
+                "tableId": table_id,
+                "address": address,
+                "depositAmount": 400,
+                "seatI": seat_i,
+            }
+            await post(session, args.url, "/joinTable", join)
+
+        latencies = []
+        missed = 0
+        for _ in range(args.actions):
+            params = {"table_id": table_id}
+            async with session.get(args.url + "/getTable", params=params) as resp:
+                table_info = (await resp.json())["table_info"]
+            player = table_info["players"][table_info["whoseTurn"]]
+            facing = table_info["facingBet"] > player["betStreet"]
+            t0 = time.perf_counter()
+            res = await post(
+                session,
+                args.url,
+                "/takeAction",
+                {
+                    "tableId": table_id,
+                    "address": player["address"],
+                    "seatI": table_info["whoseTurn"],
+                    "actionType": ACT_CALL if facing else ACT_CHECK,
+                    "amount": 0,
+                },
+            )
+            waits = [w.wait_for(res["seq"]) for w in watchers]
+            arrivals = await asyncio.gather(*waits)
+            if any(a is None for a in arrivals):
+                missed += 1
+                continue
+            latencies.append(max(arrivals) - t0)
+
+        print("POST -> last client:", summarize(latencies))
+        print("actions with missing events:", missed)
+        await asyncio.gather(*[w.client.disconnect() for w in watchers])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spectators", type=int, default=50)
+    parser.add_argument("--actions", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,86 @@
+"""
+Per-event fanout cost of a table event: broadcast to everyone vs table rooms
+
+Runs entirely in-process against a real socketio.AsyncServer - clients are
+registered straight with its manager and the engine.io send is replaced with
+a counter, so this measures the server side work per event, not the network
+
+    python fanout.py --clients 10000 --tables 1000 --events 200
+"""
+import time
+import random
+import asyncio
+import inspect
+import argparse
+import socketio
+
+
+def table_room(table_id):
+    # Same naming as api/fastapp.py
+    return f"table-{table_id}"
+
+
+async def maybe_await(res):
+    if inspect.isawaitable(res):
+        return await res
+    return res
+
+
+async def setup_server(num_clients, num_tables):
+    sio = socketio.AsyncServer(async_mode="asgi")
+    counts = {"packets": 0, "bytes": 0}
+
+    async def fake_send(eio_sid, pkt):
+        counts["packets"] += 1
+        counts["bytes"] += len(pkt.data) if pkt.data else 0
+
+    sio._send_eio_packet = fake_send
+
+    for i in range(num_clients):
+        sid = await maybe_await(sio.manager.connect(f"eio-{i}", "/"))
+        table_id = str(10000 + i % num_tables)
+        await maybe_await(sio.manager.enter_room(sid, "/", table_room(table_id)))
+    return sio, counts
+
+
+async def run(sio, counts, num_tables, num_events, use_rooms):
+    counts["packets"] = 0
+    counts["bytes"] = 0
+    event = {"tag": "gameState", "pot": 12, "board": [1, 2, 3], "whoseTurn": 1}
+    t0 = time.perf_counter()
+    for _ in range(num_events):
+        table_id = str(10000 + random.randrange(num_tables))
+        if use_rooms:
+            await sio.emit(table_id, event, room=table_room(table_id))
+        else:
+            await sio.emit(table_id, event)
+    elapsed = time.perf_counter() - t0
+    return {
+        "us/event": elapsed / num_events * 1e6,
+        "packets/event": counts["packets"] / num_events,
+        "bytes/event": counts["bytes"] / num_events,
+    }
+
+
+async def main(args):
+    sio, counts = await setup_server(args.clients, args.tables)
+    print(f"{args.clients} clients over {args.tables} tables")
+    broadcast = await run(sio, counts, args.tables, args.events, use_rooms=False)
+    print("broadcast:  ", broadcast)
+    rooms = await run(sio, counts, args.tables, args.events, use_rooms=True)
+    print("table rooms:", rooms)
+    print(
+        "fanout reduced %.0fx, emit time reduced %.0fx"
+        % (
+            broadcast["packets/event"] / max(rooms["packets/event"], 1),
+            broadcast["us/event"] / rooms["us/event"],
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--tables", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
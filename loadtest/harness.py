@@ -0,0 +1,222 @@
+"""
+Capacity test for the api: creates tables, seats players, plays hands and
+watches every table over Socket.IO, then reports p50/p95/p99 per endpoint
+and how long events took to reach the watchers
+
+With --spawn the api is started locally with the in-memory balance store
+and an in-process test chain, so neither mysql nor an RPC key is needed:
+    python harness.py --spawn --tables 20 --players 6 --spectators 5 --seconds 30
+or point it at something already running:
+    python harness.py --url http://127.0.0.1:8000 --tables 20
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import argparse
+import aiohttp
+from common import random_address, summarize
+from emit_latency import Watcher
+
+ACT_BET = 2
+ACT_FOLD = 3
+ACT_CALL = 4
+ACT_CHECK = 5
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+
+class Recorder:
+    """
+    Wall-clock latency of every call, per endpoint
+    """
+
+    def __init__(self, session, url):
+        self.session = session
+        self.url = url
+        self.latencies = {}
+        self.errors = {}
+
+    async def call(self, method, path, **kwargs):
+        t0 = time.perf_counter()
+        async with self.session.request(method, self.url + path, **kwargs) as resp:
+            try:
+                body = await resp.json(content_type=None)
+            except ValueError:
+                # Plain text 500 from an assert in the engine
+                body = {"success": False}
+        self.latencies.setdefault(path, []).append(time.perf_counter() - t0)
+        if resp.status != 200 or body.get("success") is False:
+            self.errors[path] = self.errors.get(path, 0) + 1
+        return body
+
+    async def post(self, path, data):
+        return await self.call("POST", path, json=data)
+
+    async def get(self, path, params):
+        return await self.call("GET", path, params=params)
+
+
+async def spawn_api(port):
+    journal_dir = tempfile.mkdtemp(prefix="harness-")
+    env = {
+        **os.environ,
+        "BALANCE_STORE": "memory",
+        "BALANCE_JOURNAL": os.path.join(journal_dir, "balance_journal.log"),
+        "WEB3_PROVIDER": "tester",
+        # Read at import, never used with the tester provider
+        "INFURA_KEY": os.environ.get("INFURA_KEY", "unused"),
+        "ALCHEMY_KEY": os.environ.get("ALCHEMY_KEY", "unused"),
+    }
+    cmd = [sys.executable, "-m", "uvicorn", "fastapp:socket_app", "--port", str(port)]
+    return await asyncio.create_subprocess_exec(
+        *cmd,
+        env=env,
+        cwd=API_DIR,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(session, url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url + "/health/ready") as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} never came up")
+
+
+async def setup_table(rec, num_players, num_seats):
+    table_params = {
+        "smallBlind": 1,
+        "bigBlind": 2,
+        "minBuyin": 40,
+        "maxBuyin": 400,
+        "numSeats": num_seats,
+    }
+    table_id = (await rec.post("/createNewTable", table_params))["tableId"]
+    for seat_i in range(num_players):
+        address = random_address()
+        await rec.post("/setTokens", {"address": address, "depositAmount": 10**9})
+        join = {
+            "tableId": table_id,
+            "address": address,
+            "depositAmount": 400,
+            "seatI": seat_i,
+        }
+        await rec.post("/joinTable", join)
+    return table_id
+
+
+def pick_action(table_info, player):
+    """
+    Mostly passive so hands run to showdown, with some bets and folds mixed in
+    """
+    facing = table_info["facingBet"] > player["betStreet"]
+    roll = random.random()
+    if facing:
+        return (ACT_FOLD, 0) if roll < 0.1 else (ACT_CALL, 0)
+    if roll < 0.15 and player["stack"] > table_info["bigBlind"] * 2:
+        # amount is the player's total bet for the street
+        return ACT_BET, table_info["facingBet"] + table_info["bigBlind"] * 2
+    return ACT_CHECK, 0
+
+
+async def play_table(rec, table_id, watchers, deadline, delivery, missed):
+    actions = 0
+    while time.monotonic() < deadline:
+        table_info = (await rec.get("/getTable", {"table_id": table_id}))["table_info"]
+        seat_i = table_info["whoseTurn"]
+        player = table_info["players"][seat_i] if seat_i is not None else None
+        if player is None:
+            # Between hands, give the table a moment
+            await asyncio.sleep(0.01)
+            continue
+        action_type, amount = pick_action(table_info, player)
+        t0 = time.perf_counter()
+        res = await rec.post(
+            "/takeAction",
+            {
+                "tableId": table_id,
+                "address": player["address"],
+                "seatI": seat_i,
+                "actionType": action_type,
+                "amount": amount,
+            },
+        )
+        if not res.get("success") or res.get("seq") is None:
+            continue
+        actions += 1
+        arrivals = await asyncio.gather(*[w.wait_for(res["seq"]) for w in watchers])
+        for arrival in arrivals:
+            if arrival is None:
+                missed[0] += 1
+            else:
+                delivery.append(arrival - t0)
+    return actions
+
+
+async def main(args):
+    proc = None
+    url = args.url
+    if args.spawn:
+        url = f"http://127.0.0.1:{args.port}"
+        proc = await spawn_api(args.port)
+    try:
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_ready(session, url)
+            rec = Recorder(session, url)
+            tables = await asyncio.gather(
+                *[
+                    setup_table(rec, args.players, args.seats)
+                    for _ in range(args.tables)
+                ]
+            )
+            watchers = {
+                t: [Watcher(url, t) for _ in range(args.spectators)] for t in tables
+            }
+            await asyncio.gather(*[w.start() for ws in watchers.values() for w in ws])
+
+            delivery = []
+            missed = [0]
+            deadline = time.monotonic() + args.seconds
+            counts = await asyncio.gather(
+                *[
+                    play_table(rec, t, watchers[t], deadline, delivery, missed)
+                    for t in tables
+                ]
+            )
+
+            rate = sum(counts) / args.seconds
+            print(f"tables={args.tables} actions={sum(counts)} actions/s={rate:.0f}")
+            for path, latencies in sorted(rec.latencies.items()):
+                errors = rec.errors.get(path, 0)
+                print(f"{path}: {summarize(latencies)} errors={errors}")
+            print(f"event delivery: {summarize(delivery)} missed={missed[0]}")
+            await asyncio.gather(
+                *[w.client.disconnect() for ws in watchers.values() for w in ws]
+            )
+    finally:
+        if proc is not None:
+            proc.terminate()
+            await proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--tables", type=int, default=20)
+    parser.add_argument("--seats", type=int, default=6, choices=[2, 6, 9])
+    parser.add_argument("--players", type=int, default=6)
+    parser.add_argument("--spectators", type=int, default=5)
+    parser.add_argument("--seconds", type=float, default=30)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,161 @@
+"""
+Action throughput as table shards are added
+
+For each shard count this starts the bus, one api worker per shard and the
+router as local processes, spreads --tables heads-up tables across them and
+has every table play check/call as fast as it can for --seconds
+
+Needs the same environment the api does (SQL_*, keys in api/.env), run from
+the loadtest directory:
+    python shard_scaling.py --shards 1 2 4 --tables 64 --seconds 20
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import aiohttp
+from common import random_address, summarize
+
+ACT_CALL = 4
+ACT_CHECK = 5
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+
+async def spawn(args, env, cwd=API_DIR):
+    return await asyncio.create_subprocess_exec(
+        *args,
+        env={**os.environ, **env},
+        cwd=cwd,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+
+
+async def start_cluster(num_shards, base_port):
+    bus_port = base_port
+    router_port = base_port + 1
+    urls = [f"http://127.0.0.1:{base_port + 2 + i}" for i in range(num_shards)]
+    env = {
+        "NUM_SHARDS": str(num_shards),
+        "SHARD_URLS": ",".join(urls),
+        "BUS_URL": f"127.0.0.1:{bus_port}",
+        "SHARD_SECRET": "shard-scaling",
+    }
+    bus_cmd = [sys.executable, "-m", "vanillapoker.bus", "--port", str(bus_port)]
+    procs = [await spawn(bus_cmd, env, cwd=os.path.join(API_DIR, ".."))]
+    for i, url in enumerate(urls):
+        port = url.rsplit(":", 1)[1]
+        cmd = [sys.executable, "-m", "uvicorn", "fastapp:socket_app", "--port", port]
+        procs.append(await spawn(cmd, {**env, "SHARD_INDEX": str(i)}))
+    router_cmd = [sys.executable, "router.py", "--port", str(router_port)]
+    procs.append(await spawn(router_cmd, env))
+    return procs, f"http://127.0.0.1:{router_port}", urls
+
+
+async def wait_ready(session, urls, timeout=60):
+    deadline = time.monotonic() + timeout
+    for url in urls:
+        while True:
+            try:
+                async with session.get(url + "/getTables") as resp:
+                    if resp.status == 200:
+                        break
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} never came up")
+            await asyncio.sleep(0.2)
+
+
+async def post(session, url, path, data):
+    async with session.post(url + path, json=data) as resp:
+        return await resp.json()
+
+
+async def setup_table(session, url):
+    table_params = {
+        "smallBlind": 1,
+        "bigBlind": 2,
+        "minBuyin": 40,
+        "maxBuyin": 400,
+        "numSeats": 2,
+    }
+    table_id = (await post(session, url, "/createNewTable", table_params))["tableId"]
+    for seat_i in range(2):
+        address = random_address()
+        funding = {"address": address, "depositAmount": 10**9}
+        await post(session, url, "/setTokens", funding)
+        join = {
+            "tableId": table_id,
+            "address": address,
+            "depositAmount": 400,
+            "seatI": seat_i,
+        }
+        await post(session, url, "/joinTable", join)
+    return table_id
+
+
+async def play(session, url, table_id, deadline, latencies):
+    actions = 0
+    while time.monotonic() < deadline:
+        params = {"table_id": table_id}
+        async with session.get(url + "/getTable", params=params) as resp:
+            table_info = (await resp.json())["table_info"]
+        player = table_info["players"][table_info["whoseTurn"]]
+        facing = table_info["facingBet"] > player["betStreet"]
+        action = {
+            "tableId": table_id,
+            "address": player["address"],
+            "seatI": table_info["whoseTurn"],
+            "actionType": ACT_CALL if facing else ACT_CHECK,
+            "amount": 0,
+        }
+        t0 = time.perf_counter()
+        res = await post(session, url, "/takeAction", action)
+        latencies.append(time.perf_counter() - t0)
+        if res.get("success"):
+            actions += 1
+    return actions
+
+
+async def run(num_shards, args):
+    procs, url, shard_urls = await start_cluster(num_shards, args.base_port)
+    try:
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_ready(session, shard_urls + [url])
+            tables = await asyncio.gather(
+                *[setup_table(session, url) for _ in range(args.tables)]
+            )
+            latencies = []
+            deadline = time.monotonic() + args.seconds
+            counts = await asyncio.gather(
+                *[play(session, url, t, deadline, latencies) for t in tables]
+            )
+        return sum(counts) / args.seconds, summarize(latencies)
+    finally:
+        for proc in procs:
+            proc.terminate()
+        await asyncio.gather(*[proc.wait() for proc in procs])
+
+
+async def main(args):
+    baseline = None
+    for num_shards in args.shards:
+        rate, stats = await run(num_shards, args)
+        baseline = baseline or rate / num_shards
+        print(
+            f"shards={num_shards} actions/s={rate:.0f} "
+            f"per-shard={rate / num_shards:.0f} "
+            f"linear={rate / (baseline * num_shards):.2f} takeAction={stats}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--tables", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--base-port", type=int, default=8100)
+    asyncio.run(main(parser.parse_args()))
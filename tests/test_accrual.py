@@ -0,0 +1,129 @@
+import asyncio
+from vanillapoker import accrual, earnings, ledger, memorydb
+
+YEAR = earnings.SECONDS_PER_YEAR
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def ledger_with_users(tmp_path, count):
+    pool = memorydb.MemoryPool()
+    bl = ledger.BalanceLedger(pool, str(tmp_path / "journal.log"), fsync=False)
+    await bl.load()
+    bl.set_many(
+        [
+            {"address": f"0x{i:040x}", "onChainBal": 0, "localBal": 100, "inPlay": 5}
+            for i in range(count)
+        ]
+    )
+    await bl.flush()
+    return pool, bl
+
+
+def test_pays_earnings_in_chunks(tmp_path):
+    async def main():
+        pool, bl = await ledger_with_users(tmp_path, 25)
+        clock = FakeClock()
+        index = earnings.EarningsIndex({0: 50, 1: 100}.get, clock=clock)
+        index.on_owner_change(0, None, "0x" + "0" * 40)
+        index.on_owner_change(1, None, f"0x{7:040x}")
+        clock.now += YEAR / 10
+
+        job = accrual.AccrualJob(bl, index, total_tokens=2000, chunk_size=10)
+        await job.run()
+        progress = job.progress()
+        assert progress["status"] == accrual.DONE
+        assert progress["processed"] == 25
+        assert progress["chunks"] == 3
+        assert progress["updated"] == 2
+        assert progress["tokensPaid"] == 100 + 200
+
+        assert bl.get("0x" + "0" * 40)["localBal"] == 200
+        assert bl.get(f"0x{7:040x}")["localBal"] == 300
+        assert bl.get(f"0x{8:040x}")["localBal"] == 100
+        assert pool.rows[f"0x{7:040x}"]["localBal"] == "300"
+        # Paid out, nothing left until more time passes
+        assert index.earned(f"0x{7:040x}") == 0
+
+    asyncio.run(main())
+
+
+def test_flush_failure_keeps_going(tmp_path):
+    async def main():
+        pool, bl = await ledger_with_users(tmp_path, 5)
+        clock = FakeClock()
+        index = earnings.EarningsIndex({0: 100}.get, clock=clock)
+        index.on_owner_change(0, None, f"0x{1:040x}")
+        clock.now += YEAR
+
+        async def broken_flush():
+            raise ConnectionError("mysql down")
+
+        bl.flush = broken_flush
+        job = accrual.AccrualJob(bl, index, total_tokens=10, chunk_size=2)
+        await job.run()
+        assert job.progress()["flushErrors"] == 3
+        # In the journal and the ledger, mysql catches up later
+        assert bl.get(f"0x{1:040x}")["localBal"] == 110
+        assert f"0x{1:040x}" in bl.dirty
+
+    asyncio.run(main())
+
+
+def test_earnings_saved_before_each_credit(tmp_path):
+    async def main():
+        pool, bl = await ledger_with_users(tmp_path, 4)
+        clock = FakeClock()
+        checkpoint = str(tmp_path / "earnings.json")
+        index = earnings.EarningsIndex({0: 100}.get, checkpoint, clock=clock)
+        index.on_owner_change(0, None, f"0x{3:040x}")
+        clock.now += YEAR
+
+        set_many = bl.set_many
+        saved = []
+
+        def checked_set_many(rows):
+            # The payout is already settled on disk when the credit is written
+            reloaded = earnings.EarningsIndex({}.get, checkpoint, clock=clock)
+            reloaded.load_checkpoint()
+            saved.append(reloaded.earned(f"0x{3:040x}"))
+            set_many(rows)
+
+        bl.set_many = checked_set_many
+        job = accrual.AccrualJob(bl, index, total_tokens=10, chunk_size=2)
+        await job.run()
+        assert saved == [0]
+        assert bl.get(f"0x{3:040x}")["localBal"] == 110
+
+    asyncio.run(main())
+
+
+def test_checkpoint_failure_credits_nothing(tmp_path):
+    async def main():
+        pool, bl = await ledger_with_users(tmp_path, 2)
+        clock = FakeClock()
+        index = earnings.EarningsIndex({0: 100}.get, str(tmp_path / "e.json"), clock=clock)
+        index.on_owner_change(0, None, f"0x{1:040x}")
+        clock.now += YEAR
+
+        def broken_save():
+            raise OSError("disk full")
+
+        index.save_checkpoint = broken_save
+        job = accrual.AccrualJob(bl, index, total_tokens=10, chunk_size=2)
+        try:
+            await job.run()
+        except OSError:
+            pass
+        assert job.progress()["status"] == accrual.FAILED
+        assert bl.get(f"0x{1:040x}")["localBal"] == 100
+        # Still owed, paid by the next run
+        assert index.earned(f"0x{1:040x}") == 1.0
+
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+import asyncio
+from vanillapoker import bus, sharding
+
+
+def test_pub_sub_between_clients():
+    async def main():
+        server = bus.BusServer(port=0)
+        await server.start()
+        a = bus.BusClient(port=server.port)
+        b = bus.BusClient(port=server.port)
+        received = []
+
+        async def on_lobby(data):
+            received.append(data)
+
+        b.subscribe("lobby", on_lobby)
+        a.start()
+        b.start()
+        await a.connected.wait()
+        await b.connected.wait()
+        # Give the broker a moment to register b's subscription
+        await asyncio.sleep(0.05)
+
+        await a.publish("lobby", {"op": "upsert", "tableId": "1"})
+        await a.publish("other", {"ignored": True})
+        await asyncio.sleep(0.05)
+
+        await a.stop()
+        await b.stop()
+        await server.stop()
+        return received, server.published
+
+    received, published = asyncio.run(main())
+    assert received == [{"op": "upsert", "tableId": "1"}]
+    assert published == 2
+
+
+def test_publish_while_disconnected_is_dropped():
+    async def main():
+        client = bus.BusClient(port=1)
+        await client.publish("lobby", {})
+        return client.dropped
+
+    assert asyncio.run(main()) == 1
+
+
+def test_shard_for():
+    config = sharding.ShardConfig(shard_index=1, num_shards=3)
+    assert sharding.shard_for("10000", 3) == 1
+    assert config.owns("10000")
+    assert not config.owns("10001")
+    assert not config.is_home
+    # Junk ids go to the home shard
+    assert sharding.shard_for("abc", 3) == 0
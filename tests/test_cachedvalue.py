@@ -0,0 +1,123 @@
+import asyncio
+import pytest
+from vanillapoker import cachedvalue
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRpc:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+        self.fail = False
+
+    async def get_balance(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise ConnectionError("rpc down")
+        return self.value
+
+
+def test_concurrent_callers_share_one_fetch():
+    async def main():
+        rpc = FakeRpc(100)
+        cache = cachedvalue.CachedValue(rpc.get_balance, ttl=5, clock=FakeClock())
+        values = await asyncio.gather(*[cache.get() for _ in range(10)])
+        assert values == [100] * 10
+        assert rpc.calls == 1
+        assert cache.shared == 9
+        assert await cache.get() == 100
+        assert rpc.calls == 1
+
+    asyncio.run(main())
+
+
+def test_stale_value_served_while_refreshing():
+    async def main():
+        rpc = FakeRpc(100)
+        clock = FakeClock()
+        cache = cachedvalue.CachedValue(rpc.get_balance, ttl=5, clock=clock)
+        await cache.get()
+        rpc.value = 200
+        clock.now = 6
+        # Expired - old value straight away, one refresh behind it
+        assert await asyncio.gather(cache.get(), cache.get()) == [100, 100]
+        await asyncio.sleep(0.02)
+        assert rpc.calls == 2
+        assert await cache.get() == 200
+
+        # A failed background refresh keeps the old value
+        rpc.fail = True
+        clock.now = 12
+        assert await cache.get() == 200
+        await asyncio.sleep(0.02)
+        assert cache.errors == 1
+        assert await cache.get() == 200
+
+    asyncio.run(main())
+
+
+def test_invalidate_waits_for_a_new_fetch():
+    async def main():
+        rpc = FakeRpc(100)
+        clock = FakeClock()
+        cache = cachedvalue.CachedValue(rpc.get_balance, ttl=5, clock=clock)
+        await cache.get()
+
+        # A fetch already running when the deposit lands doesn't count
+        clock.now = 6
+        await cache.get()
+        rpc.value = 150
+        cache.invalidate()
+        assert await cache.get() == 150
+        await asyncio.sleep(0.02)
+        assert await cache.get() == 150
+
+        cache.invalidate()
+        rpc.fail = True
+        with pytest.raises(ConnectionError):
+            await cache.get()
+
+    asyncio.run(main())
+
+
+def test_held_change_survives_refreshes():
+    async def main():
+        rpc = FakeRpc(100)
+        clock = FakeClock()
+        cache = cachedvalue.CachedValue(rpc.get_balance, ttl=5, clock=clock)
+        await cache.get()
+        # Refresh already running when the payout is sent
+        clock.now = 6
+        await cache.get()
+        cache.hold("job1", -30)
+        assert await cache.get() == 70
+        await asyncio.sleep(0.02)
+        assert rpc.calls == 2
+        assert await cache.get() == 70
+
+        # And after the next ttl refresh, until the payout is mined
+        clock.now = 12
+        assert await cache.get() == 70
+        await asyncio.sleep(0.02)
+        assert await cache.get() == 70
+
+        # Mined - fetched again, and nothing held any more
+        rpc.value = 70
+        cache.release("job1")
+        assert await cache.get() == 70
+        assert rpc.calls == 4
+        assert cache.stats()["pending"] == 0
+        # Releasing twice (or a job we never held) changes nothing
+        cache.release("job1")
+        assert await cache.get() == 70
+        assert rpc.calls == 4
+
+    asyncio.run(main())
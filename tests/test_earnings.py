@@ -0,0 +1,78 @@
+import pytest
+from vanillapoker import earnings, nftindexer
+
+YEAR = earnings.SECONDS_PER_YEAR
+ALICE = "0x" + "a" * 40
+BOB = "0x" + "b" * 40
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def indexed(clock, path=None):
+    index = earnings.EarningsIndex({0: 50, 1: 30, 2: 100}.get, path, clock=clock)
+    indexer = nftindexer.TransferIndexer(source=None, checkpoint_path=None)
+    indexer.listeners.append(index.on_owner_change)
+    return index, indexer
+
+
+def test_rate_follows_ownership():
+    clock = FakeClock()
+    index, indexer = indexed(clock)
+    indexer.set_owner(0, ALICE)
+    indexer.set_owner(1, ALICE)
+    assert index.rate(ALICE) == 0.8
+    indexer.set_owner(1, BOB)
+    assert index.rate(ALICE) == 0.5
+    assert index.rate(BOB) == 0.3
+    indexer.set_owner(0, None)
+    assert index.rate(ALICE) == 0
+    assert index.stats()["earners"] == 1
+
+
+def test_earned_is_closed_form_across_rate_changes():
+    clock = FakeClock()
+    index, indexer = indexed(clock)
+    indexer.set_owner(0, ALICE)
+    clock.now += YEAR / 2
+    assert index.earned(ALICE) == pytest.approx(0.25)
+    # Twice the rate for the next quarter
+    indexer.set_owner(2, ALICE)
+    clock.now += YEAR / 4
+    assert index.earned(ALICE) == pytest.approx(0.25 + 1.5 / 4)
+    assert index.elapsed(ALICE) == YEAR * 3 / 4
+
+    paid = index.earned(ALICE)
+    clock.now += 100
+    index.settle(ALICE, paid)
+    assert index.earned(ALICE) == pytest.approx(1.5 * 100 / YEAR)
+    assert index.elapsed(ALICE) == 0
+    assert index.earned(BOB) == 0
+
+
+def test_checkpoint_survives_restart(tmp_path):
+    path = str(tmp_path / "earnings.json")
+    clock = FakeClock()
+    index, indexer = indexed(clock, path)
+    indexer.set_owner(0, ALICE)
+    indexer.set_owner(1, BOB)
+    clock.now += YEAR / 2
+    index.save_checkpoint()
+    owners = dict(indexer.token_owner)
+
+    # Down for a quarter of a year, BOB's NFT moved meanwhile
+    clock.now += YEAR / 4
+    index, indexer = indexed(clock, path)
+    index.load_checkpoint()
+    indexer.set_owner(0, owners[0])
+    index.reconcile()
+    assert index.earned(ALICE) == pytest.approx(0.5 * 0.75)
+    assert index.earned(BOB) == pytest.approx(0.3 * 0.75)
+    clock.now += YEAR / 4
+    assert index.earned(BOB) == pytest.approx(0.3 * 0.75)
+    assert index.rate(BOB) == 0
@@ -0,0 +1,26 @@
+from vanillapoker import eventstream
+
+
+def test_sequence_numbers():
+    stream = eventstream.EventStream()
+    assert stream.publish(["a", "b"]) == [(1, "a"), (2, "b")]
+    assert stream.publish(["c"]) == [(3, "c")]
+    assert stream.seq == 3
+
+
+def test_since():
+    stream = eventstream.EventStream()
+    stream.publish(["a", "b", "c"])
+    assert stream.since(0) == [(1, "a"), (2, "b"), (3, "c")]
+    assert stream.since(2) == [(3, "c")]
+    assert stream.since(3) == []
+    # Client claims to have seen more than we ever sent - server restarted?
+    assert stream.since(4) is None
+
+
+def test_since_gap_too_old():
+    stream = eventstream.EventStream(max_events=2)
+    stream.publish(["a", "b", "c", "d"])
+    assert stream.oldest_seq == 3
+    assert stream.since(2) == [(3, "c"), (4, "d")]
+    assert stream.since(1) is None
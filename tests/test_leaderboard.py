@@ -0,0 +1,37 @@
+from vanillapoker import leaderboard
+
+
+def test_ordering_and_paging():
+    lb = leaderboard.Leaderboard()
+    lb.update_balance("0xa", 10)
+    lb.update_balance("0xb", 30)
+    lb.update_balance("0xc", 20)
+    lb.update_earning_rate("0xb", 1.5)
+
+    assert [x["address"] for x in lb.top(3)] == ["0xb", "0xc", "0xa"]
+    assert lb.top(1) == [{"address": "0xb", "balance": 30, "earningRate": 1.5}]
+    assert [x["address"] for x in lb.page(1, 1)] == ["0xc"]
+    assert [x["address"] for x in lb.page(1)] == ["0xc", "0xa"]
+    assert len(lb) == 3
+
+
+def test_balance_updates_reorder():
+    lb = leaderboard.Leaderboard()
+    lb.update_balance("0xa", 10)
+    lb.update_balance("0xb", 30)
+    lb.update_balance("0xa", 50)
+    assert lb.rank("0xa") == 0
+    assert lb.rank("0xb") == 1
+    assert len(lb.ranking) == 2
+
+    lb.remove("0xa")
+    assert lb.rank("0xa") is None
+    assert [x["address"] for x in lb.top(10)] == ["0xb"]
+
+
+def test_earning_rate_without_balance_not_ranked():
+    lb = leaderboard.Leaderboard()
+    lb.update_earning_rate("0xa", 2.0)
+    assert len(lb) == 0
+    lb.update_balance("0xa", 5)
+    assert lb.top(1)[0]["earningRate"] == 2.0
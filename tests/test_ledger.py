@@ -0,0 +1,259 @@
+import asyncio
+import pytest
+from contextlib import asynccontextmanager
+from vanillapoker import ledger
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def execute(self, sql, args=None):
+        if "settled_hands" in sql:
+            self.result = [(h,) for h in reversed(self.db.hands)][: args[0]]
+            return
+        self.result = [
+            (a, str(r["onChainBal"]), str(r["localBal"]), str(r["inPlay"]))
+            for a, r in self.db.rows.items()
+        ]
+
+    async def fetchall(self):
+        return self.result
+
+    async def executemany(self, sql, rows):
+        if self.db.fail:
+            raise Exception("db down")
+        if "settled_hands" in sql:
+            self.db.hands.extend(h for (h,) in rows)
+            return
+        self.db.batches.append(len(rows))
+        for address, on_chain_bal, local_bal, in_play in rows:
+            self.db.rows[address] = {
+                "onChainBal": on_chain_bal,
+                "localBal": local_bal,
+                "inPlay": in_play,
+            }
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class FakePool:
+    def __init__(self):
+        self.rows = {}
+        self.hands = []
+        self.batches = []
+        self.fail = False
+
+    @asynccontextmanager
+    async def connection(self):
+        yield FakeConnection(self)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return str(tmp_path / "journal.log")
+
+
+def test_batched_flush(journal):
+    pool = FakePool()
+    pool.rows["0xabc"] = {"onChainBal": "0", "localBal": "100", "inPlay": "0"}
+
+    async def main():
+        bl = ledger.BalanceLedger(pool, journal, fsync=False)
+        await bl.load()
+        assert bl.get("0xabc")["localBal"] == 100
+        bl.adjust("0xabc", local_bal=-40, in_play=40)
+        bl.create("0xdef", 0, 500, 0)
+        # Nothing hits the db until we flush
+        assert pool.rows["0xabc"]["localBal"] == "100"
+        assert await bl.flush() == 2
+        await bl.close()
+
+    asyncio.run(main())
+    assert pool.batches == [2]
+    assert pool.rows["0xabc"]["localBal"] == "60"
+    assert pool.rows["0xabc"]["inPlay"] == "40"
+    assert pool.rows["0xdef"]["localBal"] == "500"
+
+
+def test_no_overdraw(journal):
+    async def main():
+        bl = ledger.BalanceLedger(FakePool(), journal, fsync=False)
+        await bl.load()
+        bl.create("0xabc", 0, 10, 0)
+        with pytest.raises(AssertionError):
+            bl.adjust("0xabc", local_bal=-11)
+        assert bl.get("0xabc")["localBal"] == 10
+
+    asyncio.run(main())
+
+
+def test_journal_replayed_after_crash(journal):
+    pool = FakePool()
+
+    async def crash():
+        bl = ledger.BalanceLedger(pool, journal, fsync=False)
+        await bl.load()
+        bl.create("0xabc", 0, 100, 0)
+        pool.fail = True
+        # Flush fails, then the process dies without closing
+        with pytest.raises(Exception):
+            await bl.flush()
+        bl.adjust("0xabc", local_bal=-30, in_play=30)
+
+    async def restart():
+        pool.fail = False
+        bl = ledger.BalanceLedger(pool, journal, fsync=False)
+        await bl.load()
+        return bl.get("0xabc")
+
+    asyncio.run(crash())
+    assert "0xabc" not in pool.rows
+    row = asyncio.run(restart())
+    assert row["localBal"] == 70
+    assert row["inPlay"] == 30
+    assert pool.rows["0xabc"]["localBal"] == "70"
+
+
+def test_settle_hand_single_record(journal):
+    pool = FakePool()
+
+    async def main():
+        bl = ledger.BalanceLedger(pool, journal, fsync=False)
+        await bl.load()
+        bl.create("0xabc", 0, 0, 100)
+        bl.create("0xdef", 0, 0, 100)
+        await bl.flush()
+        assert bl.settle_hand("123-1", {"0xabc": -10, "0xdef": 10, "0x999": 5}) == 2
+        # A retried settlement for the same hand is a no-op
+        assert bl.settle_hand("123-1", {"0xabc": -10, "0xdef": 10}) == 0
+        # Simulate a crash before the next flush
+
+    asyncio.run(main())
+    with open(journal) as f:
+        assert len(f.readlines()) == 1
+
+    async def restart():
+        bl = ledger.BalanceLedger(pool, journal, fsync=False)
+        await bl.load()
+        return bl.settle_hand("123-1", {"0xabc": -10})
+
+    assert asyncio.run(restart()) == 0
+    assert pool.batches[-1] == 2
+    assert pool.rows["0xabc"]["inPlay"] == "90"
+    assert pool.rows["0xdef"]["inPlay"] == "110"
+
+
+def test_settled_hands_outlive_the_journal(journal):
+    pool = FakePool()
+
+    async def main():
+        bl = ledger.BalanceLedger(pool, journal, fsync=False)
+        await bl.load()
+        bl.create("0xabc", 0, 0, 100)
+        bl.settle_hand("123-1", {"0xabc": -10})
+        pool.fail = True
+        with pytest.raises(Exception):
+            await bl.flush()
+        pool.fail = False
+        # Retried with the rows, then the journal is deleted
+        await bl.flush()
+        await bl.close()
+
+    async def restart():
+        bl = ledger.BalanceLedger(pool, journal, fsync=False)
+        await bl.load()
+        # Resent from another shard's outbox after the restart
+        settled = bl.settle_hand("123-1", {"0xabc": -10})
+        return settled, bl.get("0xabc")["inPlay"]
+
+    asyncio.run(main())
+    assert pool.hands == ["123-1"]
+    assert asyncio.run(restart()) == (0, 90)
+
+
+def test_fractional_delta_refused(journal):
+    async def main():
+        bl = ledger.BalanceLedger(FakePool(), journal, fsync=False)
+        await bl.load()
+        bl.create("0xabc", 0, 0, 100)
+        with pytest.raises(AssertionError):
+            bl.settle_hand("123-1", {"0xabc": 2.5})
+        assert bl.get("0xabc")["inPlay"] == 100
+        # Not remembered, so a corrected settlement still goes through
+        assert bl.settle_hand("123-1", {"0xabc": 3.0}) == 1
+        assert bl.get("0xabc")["inPlay"] == 103
+
+    asyncio.run(main())
+
+
+def test_set_many_single_record(journal):
+    pool = FakePool()
+
+    async def main():
+        bl = ledger.BalanceLedger(pool, journal, fsync=False)
+        await bl.load()
+        bl.set_many(
+            [
+                {"address": a, "onChainBal": 0, "localBal": i, "inPlay": 0}
+                for i, a in enumerate(["0xabc", "0xdef", "0x123"])
+            ]
+        )
+        assert bl.get("0x123")["localBal"] == 2
+
+    asyncio.run(main())
+    with open(journal) as f:
+        assert len(f.readlines()) == 1
+
+    async def restart():
+        bl = ledger.BalanceLedger(pool, journal, fsync=False)
+        await bl.load()
+
+    asyncio.run(restart())
+    assert pool.batches[-1] == 3
+    assert pool.rows["0xdef"]["localBal"] == "1"
+
+
+def test_group_commit(journal):
+    pool = FakePool()
+
+    async def main():
+        bl = ledger.BalanceLedger(pool, journal, fsync=True)
+        await bl.load()
+
+        async def write(i):
+            bl.create(f"0x{i:03x}", 0, i, 0)
+            await bl.sync()
+
+        # Every write made while an fsync runs shares the next one
+        await asyncio.gather(*[write(i) for i in range(50)])
+        assert bl.synced_seq == bl.write_seq == 50
+        assert bl.stats()["fsyncs"] <= 2
+        # Rotating the journal syncs and closes the old file in the background
+        bl.adjust("0x001", local_bal=1)
+        assert await bl.flush() == 50
+        await bl.sync()
+        assert bl.synced_seq == 51
+        await bl.close()
+
+    asyncio.run(main())
+    assert pool.rows["0x001"]["localBal"] == "2"
@@ -0,0 +1,98 @@
+import pytest
+from vanillapoker import listings
+from vanillapoker.lobby import encode_cursor
+
+
+def filled_index():
+    index = listings.ListingIndex()
+    for token_id in range(40):
+        index.add(
+            token_id,
+            seller=f"0x{token_id % 3:040x}",
+            amount=1000 - token_id * 10 if token_id % 2 else 100 + token_id,
+            card_number=token_id % 4,
+            rarity=1 + token_id * 2,
+        )
+    return index
+
+
+def page_through(index, limit, **filters):
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = index.query(cursor=cursor, limit=limit, **filters)
+        seen.extend(page)
+        if cursor is None:
+            return seen
+
+
+def test_sorted_by_price_both_ways():
+    index = filled_index()
+    everything, cursor = index.query()
+    assert cursor is None
+    assert len(everything) == 40
+    prices = [listing["amount"] for listing in everything]
+    assert prices == sorted(prices)
+
+    desc = page_through(index, 7, order="desc")
+    assert [listing["tokenId"] for listing in desc] == [
+        listing["tokenId"] for listing in reversed(everything)
+    ]
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_filters_match_a_full_scan(order):
+    index = filled_index()
+    everything = sorted(
+        index.listings.values(),
+        key=lambda l: (l["amount"], l["tokenId"]),
+        reverse=order == "desc",
+    )
+    cases = [
+        {"card_number": 1},
+        {"min_rarity": 20, "max_rarity": 50},
+        {"card_number": 2, "min_rarity": 30},
+        {"max_rarity": 10},
+        {"card_number": 9},
+    ]
+    for filters in cases:
+        expected = [
+            l["tokenId"]
+            for l in everything
+            if l["cardNumber"] == filters.get("card_number", l["cardNumber"])
+            and filters.get("min_rarity", 1) <= l["rarity"] <= filters.get("max_rarity", 100)
+        ]
+        got = page_through(index, 3, order=order, **filters)
+        assert [l["tokenId"] for l in got] == expected, filters
+
+
+def test_add_remove_and_relist():
+    index = filled_index()
+    assert index.remove(5)["tokenId"] == 5
+    assert index.remove(5) is None
+    assert 5 not in index
+    # Relisting at a new price moves it
+    index.add(6, "0xabc", 1, card_number=2, rarity=13)
+    cheapest, _ = index.query(limit=1)
+    assert cheapest[0]["tokenId"] == 6
+    assert len(index) == 39
+    assert len(index.by_price) == 39
+
+    for token_id in list(index.listings):
+        index.remove(token_id)
+    assert index.stats() == {"listings": 0, "cards": 0, "rarities": 0}
+
+
+def test_bad_cursors_rejected():
+    index = filled_index()
+    for bad in [
+        "junk",
+        encode_cursor(None),
+        encode_cursor({"amount": 1}),
+        encode_cursor([100]),
+        encode_cursor([100, "x"]),
+    ]:
+        with pytest.raises(ValueError):
+            index.query(cursor=bad)
+    with pytest.raises(AssertionError):
+        index.query(limit=0)
@@ -0,0 +1,109 @@
+import pytest
+from vanillapoker import poker, lobby
+
+
+def _table(small_blind, num_seats, num_players):
+    t = poker.PokerTable(small_blind, small_blind * 2, small_blind * 20, small_blind * 200, num_seats)
+    for i in range(num_players):
+        t.join_table(i, small_blind * 20, f"0x{i}")
+    return t
+
+
+def _ids(entries):
+    return [e["tableId"] for e in entries]
+
+
+def test_sorting_and_filters():
+    li = lobby.LobbyIndex()
+    li.upsert("a", _table(1, 6, 2))
+    li.upsert("b", _table(5, 6, 1))
+    li.upsert("c", _table(1, 2, 0))
+    li.upsert("d", _table(1, 6, 0))
+
+    entries, cursor = li.query()
+    assert _ids(entries) == ["c", "a", "d", "b"]
+    assert cursor is None
+
+    entries, _ = li.query(big_blind=2, num_seats=6)
+    assert _ids(entries) == ["a", "d"]
+    entries, _ = li.query(big_blind=10)
+    assert _ids(entries) == ["b"]
+    entries, _ = li.query(min_open_seats=5)
+    assert _ids(entries) == ["d", "b"]
+
+    entries, _ = li.query(sort="players")
+    assert _ids(entries)[0] == "a"
+    entries, _ = li.query(sort="openSeats")
+    assert _ids(entries)[0] == "d"
+
+
+def test_cursor_pagination():
+    li = lobby.LobbyIndex()
+    for i in range(5):
+        li.upsert(f"t{i}", _table(1, 6, 0))
+
+    seen = []
+    cursor = None
+    while True:
+        entries, cursor = li.query(limit=2, cursor=cursor)
+        seen += _ids(entries)
+        if cursor is None:
+            break
+    assert seen == ["t0", "t1", "t2", "t3", "t4"]
+
+
+def test_bad_cursors_rejected():
+    li = lobby.LobbyIndex()
+    li.upsert("a", _table(1, 6, 0))
+    for bad in [
+        "junk",
+        lobby.encode_cursor(None),
+        lobby.encode_cursor({"a": 1}),
+        lobby.encode_cursor([2, 1, 6]),
+        lobby.encode_cursor([2, 1, 6, 7]),
+        lobby.encode_cursor([True, 1, 6, "a"]),
+    ]:
+        with pytest.raises(ValueError):
+            li.query(cursor=bad)
+    with pytest.raises(AssertionError):
+        li.query(limit=0)
+    # A real cursor is only valid for the sort it came from
+    with pytest.raises(ValueError):
+        li.query(sort="players", cursor=lobby.encode_cursor([2, 1, 6, "a"]))
+
+
+def test_updates_and_summary():
+    li = lobby.LobbyIndex()
+    t = _table(1, 6, 1)
+    li.upsert("a", t)
+    t.join_table(1, 20, "0x999")
+    li.upsert("a", t)
+    assert li.tables["a"]["numPlayers"] == 2
+    assert len(li.sorted["players"]) == 1
+    assert li.summary() == [
+        {
+            "smallBlind": 1,
+            "bigBlind": 2,
+            "numSeats": 6,
+            "tables": 1,
+            "players": 2,
+            "openSeats": 4,
+        }
+    ]
+
+    li.remove("a")
+    assert len(li) == 0
+    assert li.summary() == []
+
+
+def test_replace_where():
+    li = lobby.LobbyIndex()
+    li.upsert("10", _table(1, 6, 0))
+    li.upsert("11", _table(1, 6, 0))
+    li.upsert("13", _table(1, 6, 0))
+    snapshot = li.tables["11"]
+
+    # Shard 1 of 2 now only has table 11, with a player
+    li.replace_where(lambda t: int(t) % 2 == 1, [{**snapshot, "numPlayers": 1}])
+    assert sorted(li.tables) == ["10", "11"]
+    assert li.tables["11"]["numPlayers"] == 1
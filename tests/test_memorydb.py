@@ -0,0 +1,26 @@
+import asyncio
+from vanillapoker import ledger, memorydb
+
+
+def test_ledger_round_trip(tmp_path):
+    pool = memorydb.MemoryPool()
+    journal = str(tmp_path / "balance_journal.log")
+
+    async def first():
+        bl = ledger.BalanceLedger(pool, journal, fsync=False)
+        await bl.load()
+        bl.create("0xabc", 0, 100, 0)
+        bl.adjust("0xabc", local_bal=-40, in_play=40)
+        await bl.close()
+
+    async def second():
+        bl = ledger.BalanceLedger(pool, journal, fsync=False)
+        await bl.load()
+        return bl.get("0xabc")
+
+    asyncio.run(first())
+    assert pool.rows["0xabc"] == {"onChainBal": "0", "localBal": "60", "inPlay": "40"}
+    row = asyncio.run(second())
+    assert row["localBal"] == 60
+    assert row["inPlay"] == 40
+    assert pool.stats()["rows"] == 1
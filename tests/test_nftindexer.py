@@ -0,0 +1,172 @@
+import asyncio
+import pytest
+from vanillapoker import nftindexer
+from vanillapoker.nftindexer import ZERO_ADDRESS
+
+
+class FakeSource:
+    """
+    blocks[n] is (hash, [(from, to, token_id)]), block 0 is genesis
+    """
+
+    def __init__(self):
+        self.blocks = [("h0", [])]
+        self.max_range = None
+        self.ranges = []
+
+    def mine(self, *transfers, tag="a"):
+        self.blocks.append((f"h{len(self.blocks)}{tag}", list(transfers)))
+
+    def reorg(self, depth):
+        # Drop the last depth blocks, callers mine the new branch
+        del self.blocks[len(self.blocks) - depth :]
+
+    async def head(self):
+        return len(self.blocks) - 1
+
+    async def block_hash(self, number):
+        if number >= len(self.blocks):
+            return None
+        return self.blocks[number][0]
+
+    async def transfers(self, from_block, to_block):
+        if self.max_range and to_block - from_block + 1 > self.max_range:
+            raise ValueError("query returned more than 10000 results")
+        self.ranges.append((from_block, to_block))
+        return [
+            {
+                "block": n,
+                "blockHash": self.blocks[n][0],
+                "logIndex": i,
+                "from": from_,
+                "to": to,
+                "tokenId": token_id,
+            }
+            for n in range(from_block, to_block + 1)
+            for i, (from_, to, token_id) in enumerate(self.blocks[n][1])
+        ]
+
+
+def test_index_from_cursor_with_confirmations(tmp_path):
+    source = FakeSource()
+    source.mine((ZERO_ADDRESS, "0xa", 1), (ZERO_ADDRESS, "0xa", 2))
+    source.mine(("0xa", "0xb", 1))
+    source.mine()
+    checkpoint = str(tmp_path / "nft_index.json")
+    indexer = nftindexer.TransferIndexer(
+        source, checkpoint, confirmations=1, batch_blocks=2
+    )
+    changes = []
+    indexer.listeners.append(lambda *args: changes.append(args))
+
+    assert asyncio.run(indexer.refresh()) == 3
+    assert indexer.block == 2
+    assert indexer.owners == {"0xa": [2], "0xb": [1]}
+    assert indexer.token_owner == {1: "0xb", 2: "0xa"}
+    assert changes[-1] == (1, "0xa", "0xb")
+
+    # A burn in a block that isn't deep enough yet
+    source.mine(("0xa", ZERO_ADDRESS, 2))
+    assert asyncio.run(indexer.refresh()) == 0
+    source.mine()
+    assert asyncio.run(indexer.refresh()) == 1
+    assert indexer.owners == {"0xb": [1]}
+
+    # Restart only reads blocks past the checkpoint
+    restarted = nftindexer.TransferIndexer(source, checkpoint, confirmations=1)
+    restarted.load_checkpoint()
+    assert restarted.owners == {"0xb": [1]}
+    source.mine(("0xb", "0xc", 1))
+    source.mine()
+    source.ranges.clear()
+    assert asyncio.run(restarted.refresh()) == 1
+    assert source.ranges == [(5, 6)]
+    assert restarted.token_owner == {1: "0xc"}
+
+
+def test_reorg_rolls_back():
+    source = FakeSource()
+    source.mine((ZERO_ADDRESS, "0xa", 1))
+    source.mine(("0xa", "0xb", 1))
+    source.mine((ZERO_ADDRESS, "0xb", 2))
+    indexer = nftindexer.TransferIndexer(source, confirmations=0)
+    asyncio.run(indexer.refresh())
+    assert indexer.owners == {"0xb": [1, 2]}
+
+    # Blocks 2 and 3 replaced, token 1 went to 0xc instead and 2 never minted
+    source.reorg(2)
+    source.mine(("0xa", "0xc", 1), tag="b")
+    source.mine(tag="b")
+    source.mine(tag="b")
+    asyncio.run(indexer.refresh())
+    assert indexer.reorgs == 1
+    assert indexer.owners == {"0xc": [1]}
+    assert indexer.block == 4
+
+
+def test_splits_ranges_the_provider_refuses():
+    source = FakeSource()
+    for token_id in range(1, 9):
+        source.mine((ZERO_ADDRESS, "0xa", token_id))
+    source.max_range = 3
+    indexer = nftindexer.TransferIndexer(source, confirmations=0, batch_blocks=100)
+    assert asyncio.run(indexer.refresh()) == 8
+    assert all(to - fr < 3 for fr, to in source.ranges)
+    assert sorted(indexer.owners["0xa"]) == list(range(1, 9))
+
+
+def test_pending_owner_until_confirmed_or_expired():
+    source = FakeSource()
+    source.mine((ZERO_ADDRESS, "0xa", 1))
+    indexer = nftindexer.TransferIndexer(source, confirmations=0, pending_ttl=60)
+    asyncio.run(indexer.refresh())
+
+    # Sold through the app, shows up before the chain has it
+    assert indexer.set_owner(1, "0xb")
+    assert indexer.owners == {"0xb": [1]}
+    source.mine(("0xa", "0xb", 1))
+    asyncio.run(indexer.refresh())
+    assert indexer.pending == {}
+    assert indexer.owners == {"0xb": [1]}
+
+    # A mint that never lands goes away once it expires
+    indexer.set_owner(2, "0xc")
+    assert indexer.token_owner[2] == "0xc"
+    indexer.expire_pending(now=indexer.pending[2][1])
+    assert 2 not in indexer.token_owner
+    assert indexer.owners == {"0xb": [1]}
+
+
+def test_index_against_eth_tester():
+    pytest.importorskip("eth_tester")
+    from web3 import AsyncWeb3
+    from web3.providers.eth_tester import AsyncEthereumTesterProvider
+    from tests import evmtoken
+
+    async def main():
+        w3 = AsyncWeb3(AsyncEthereumTesterProvider())
+        tester = w3.provider.ethereum_tester
+        contract = await evmtoken.deploy(w3)
+        accounts = await w3.eth.accounts
+        for token_id in range(1, 6):
+            await evmtoken.mint(w3, contract, accounts[token_id % 2], token_id)
+        source = nftindexer.Web3LogSource(w3, contract.address)
+        indexer = nftindexer.TransferIndexer(source, confirmations=0)
+        assert await indexer.refresh() == 5
+        assert sorted(indexer.owners[accounts[1]]) == [1, 3, 5]
+        assert sorted(indexer.owners[accounts[0]]) == [2, 4]
+
+        # Transfer token 1 on a branch that gets reorged out
+        snapshot = tester.take_snapshot()
+        await evmtoken.mint(w3, contract, accounts[2], 1)
+        assert await indexer.refresh() == 1
+        assert indexer.token_owner[1] == accounts[2]
+        tester.revert_to_snapshot(snapshot)
+        await evmtoken.mint(w3, contract, accounts[3], 2)
+        tester.mine_blocks(2)
+        assert await indexer.refresh() == 1
+        assert indexer.reorgs == 1
+        assert indexer.token_owner[1] == accounts[1]
+        assert indexer.token_owner[2] == accounts[3]
+
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+import random
+import pytest
+from vanillapoker import nftstore
+
+
+def test_same_cards_as_the_seeded_dict():
+    store = nftstore.NFTStore(count=1000)
+    random.seed(0)
+    for i in range(1000):
+        card, rarity = random.randint(0, 51), random.randint(1, 100)
+        assert store.metadata(i) == {"cardNumber": card, "rarity": rarity, "forSale": False}
+
+
+def test_grows_past_the_initial_supply():
+    store = nftstore.NFTStore(count=10, max_tokens=100)
+    bigger = nftstore.NFTStore(count=50)
+    assert store.rarity_of(42) == bigger.rarity_of(42)
+    assert len(store) == 43
+    assert store.card_of(3) == bigger.card_of(3)
+    with pytest.raises(KeyError):
+        store.ensure(100)
+    for bad in (-1, 43):
+        with pytest.raises(KeyError):
+            store.metadata(bad)
+    with pytest.raises(KeyError):
+        store.many([1, -1])
+
+
+def test_for_sale_and_aggregates():
+    store = nftstore.NFTStore(count=20)
+    store.set_for_sale(4, True)
+    assert store.many([4, 5]) == {4: store.metadata(4), 5: store.metadata(5)}
+    assert store.metadata(4)["forSale"] is True
+    assert store.stats()["forSale"] == 1
+
+    owners = {"0xa": [1, 2, 3], "0xb": [7], "0xc": []}
+    sums = store.rarity_sums(owners)
+    assert sums == {
+        "0xa": sum(store.rarity_of(t) for t in [1, 2, 3]),
+        "0xb": store.rarity_of(7),
+    }
+    counts = store.card_counts()
+    assert len(counts) == nftstore.NUM_CARDS
+    assert sum(counts) == 20
+    assert counts[store.card_of(7)] >= 1
+    assert sum(store.card_counts([1, 2, 3])) == 3
@@ -449,3 +449,61 @@ def test_integration_3p_open_fold(t2, t6):
     assert t.hand_stage == poker.HS_TURN_BETTING
     assert len(t.board) == 4
     assert t.whose_turn == 1
+
+
+def test_settlement_deltas(t6):
+    t = t6
+    t._get_showdown_val = lambda x: 10
+    p0 = "0x123"
+    p1 = "0x456"
+    t.join_table(0, 100, p0, False)
+    t.join_table(1, 100, p1, False)
+
+    t.take_action(poker.ACT_SB_POST, p0, 1)
+    t.take_action(poker.ACT_BB_POST, p1, 2)
+    t.take_action(poker.ACT_FOLD, p0, 0)
+    assert t.settlements_pop == [{"handId": 1, "deltas": {p0: -1, p1: 1}}]
+
+    # Rebuys between hands shouldn't show up as winnings
+    t.settlements_pop = []
+    t.rebuy(0, 50, p0)
+    t.take_action(poker.ACT_SB_POST, p1, 1)
+    t.take_action(poker.ACT_BB_POST, p0, 2)
+    t.take_action(poker.ACT_FOLD, p1, 0)
+    assert t.settlements_pop == [{"handId": 2, "deltas": {p0: 1, p1: -1}}]
+
+
+def test_split_pot_odd_chips(t6):
+    t = t6
+    for seat_i, address in [(0, "0x123"), (2, "0x456"), (4, "0x789")]:
+        t.join_table(seat_i, 100, address, False)
+        t.seats[seat_i]["showdown_val"] = 10
+    t.seats[0]["stack"] = 90
+    t.seats[2]["stack"] = 90
+    t.seats[4]["stack"] = 90
+    t.button = 2
+    t.pots_complete = [{"amount": 31, "players": [0, 2, 4]}]
+    t._settle()
+
+    # Whole chips only, the odd one to the first winner left of the button
+    assert [t.seats[i]["stack"] for i in (0, 2, 4)] == [100, 100, 101]
+    assert t.events[-1]["pots"][0]["winners"] == {0: 10, 2: 10, 4: 11}
+    deltas = t.settlements_pop[-1]["deltas"]
+    assert deltas == {"0x123": 0, "0x456": 0, "0x789": 1}
+    assert all(isinstance(delta, int) for delta in deltas.values())
+
+
+def test_version_bumped_on_mutation(t2):
+    v0 = t2.version
+    t2.join_table(0, 100, "0x123")
+    v1 = t2.version
+    assert v1 > v0
+    # Reads leave it alone
+    t2.pot_total
+    t2.serialize()
+    assert t2.version == v1
+    t2.join_table(1, 100, "0x456")
+    assert t2.version > v1
+    v2 = t2.version
+    t2.take_action(poker.ACT_FOLD, t2.seats[t2.whose_turn]["address"], 0)
+    assert t2.version > v2
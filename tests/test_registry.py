@@ -0,0 +1,76 @@
+from vanillapoker import poker, registry
+
+
+def _table():
+    return poker.PokerTable(1, 2, 20, 200, 6)
+
+
+def test_allocator_is_unique_and_sharded():
+    allocator = registry.TableIdAllocator()
+    ids = [allocator.allocate() for _ in range(1000)]
+    assert len(set(ids)) == 1000
+    assert ids[:2] == ["10000", "10001"]
+
+    shards = [registry.TableIdAllocator(shard_index=i, num_shards=3) for i in range(3)]
+    for i, allocator in enumerate(shards):
+        for _ in range(10):
+            assert int(allocator.allocate()) % 3 == i
+    assert shards[1].issued(str(shards[1].first_id))
+    assert not shards[1].issued(str(shards[0].first_id))
+    assert not shards[1].issued("abc")
+
+
+def test_table_ids_not_reused_after_restart(tmp_path):
+    path = str(tmp_path / "table_ids.json")
+    allocator = registry.TableIdAllocator(
+        shard_index=1, num_shards=2, state_path=path, reserve=10
+    )
+    before = [allocator.allocate() for _ in range(15)]
+    # Crash without any shutdown hook - a new process starts from the file
+    allocator = registry.TableIdAllocator(
+        shard_index=1, num_shards=2, state_path=path, reserve=10
+    )
+    after = [allocator.allocate() for _ in range(5)]
+    assert not set(before) & set(after)
+    assert all(int(table_id) % 2 == 1 for table_id in after)
+    assert allocator.issued(before[0])
+    assert allocator.issued(after[-1])
+
+
+def test_lifecycle_and_collection():
+    reg = registry.TableRegistry(idle_ttl=10)
+    table_id = reg.add(_table())
+    assert reg.state(table_id) == registry.OPEN
+
+    t = reg[table_id]
+    t.join_table(0, 20, "0x1")
+    reg.touch(table_id)
+    assert reg.state(table_id) == registry.ACTIVE
+    # Seated tables never get collected, however old
+    assert reg.collectable(now=10**9) == []
+    assert not reg.collect(table_id, now=10**9)
+
+    t.leave_table(0, "0x1")
+    reg.touch(table_id)
+    assert reg.state(table_id) == registry.IDLE
+    since = reg.empty_since[table_id]
+    assert reg.collectable(now=since + 5) == []
+    assert reg.collectable(now=since + 10) == [table_id]
+
+    assert reg.collect(table_id, now=since + 10)
+    assert table_id not in reg
+    assert reg.state(table_id) == registry.CLOSED
+    assert reg.state("999999") is None
+    metrics = reg.metrics()
+    assert metrics["live"] == 0
+    assert metrics["created"] == 1
+    assert metrics["collected"] == 1
+
+
+def test_collect_rechecks_seats():
+    reg = registry.TableRegistry(idle_ttl=0)
+    table_id = reg.add(_table())
+    # Join landed after the table was picked for collection
+    reg[table_id].join_table(0, 20, "0x1")
+    assert not reg.collect(table_id)
+    assert table_id in reg
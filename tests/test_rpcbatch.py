@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+
+pytest.importorskip("aiohttp")
+from eth_utils import to_checksum_address
+from web3 import AsyncWeb3
+from vanillapoker import localrpc, rpcbatch
+
+ADDRESSES = [to_checksum_address(f"0x{i:040x}") for i in range(1, 21)]
+TOKEN = to_checksum_address("0x" + "ab" * 20)
+OWNER_OF_ABI = [
+    {
+        "name": "ownerOf",
+        "type": "function",
+        "stateMutability": "view",
+        "inputs": [{"name": "tokenId", "type": "uint256"}],
+        "outputs": [{"name": "", "type": "address"}],
+    }
+]
+
+
+async def started_server(**kwargs):
+    server = localrpc.LocalRpcServer(**kwargs)
+    for i, address in enumerate(ADDRESSES):
+        server.balances[address.lower()] = i * 10**18
+    server.owners[7] = ADDRESSES[3]
+    await server.start()
+    return server
+
+
+def test_concurrent_calls_share_one_request():
+    async def main():
+        server = await started_server()
+        provider = rpcbatch.BatchingProvider(server.url, window=0.01)
+        w3 = AsyncWeb3(provider)
+        balances = await asyncio.gather(
+            *[w3.eth.get_balance(address) for address in ADDRESSES],
+            w3.eth.block_number,
+        )
+        assert balances[:-1] == [i * 10**18 for i in range(20)]
+        assert balances[-1] == 1
+        assert server.http_requests == 1
+        assert server.calls == 21
+        assert provider.stats()["largestBatch"] == 21
+        await server.stop()
+
+    asyncio.run(main())
+
+
+def test_revert_only_fails_its_own_call():
+    async def main():
+        server = await started_server()
+        w3 = AsyncWeb3(rpcbatch.BatchingProvider(server.url, window=0.01))
+        contract = w3.eth.contract(address=TOKEN, abi=OWNER_OF_ABI)
+        results = await asyncio.gather(
+            contract.functions.ownerOf(7).call(),
+            contract.functions.ownerOf(8).call(),
+            w3.eth.get_balance(ADDRESSES[2]),
+            return_exceptions=True,
+        )
+        assert results[0] == ADDRESSES[3]
+        assert "revert" in str(results[1]).lower()
+        assert results[2] == 2 * 10**18
+        # Contract calls look up eth_chainId first, that's its own round
+        assert server.http_requests == 2
+        assert server.calls == 5
+        await server.stop()
+
+    asyncio.run(main())
+
+
+def test_max_batch_splits_requests():
+    async def main():
+        server = await started_server()
+        provider = rpcbatch.BatchingProvider(server.url, window=0.01, max_batch=8)
+        w3 = AsyncWeb3(provider)
+        await asyncio.gather(*[w3.eth.get_balance(address) for address in ADDRESSES])
+        assert server.http_requests == 3
+        assert server.largest_batch == 8
+        await server.stop()
+
+        # Node gone - every waiting call gets the error
+        with pytest.raises(Exception):
+            await asyncio.gather(*[w3.eth.get_balance(a) for a in ADDRESSES[:3]])
+        assert provider.errors >= 1
+
+    asyncio.run(main())
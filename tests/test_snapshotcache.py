@@ -0,0 +1,40 @@
+from vanillapoker import snapshotcache
+
+
+def test_rebuilt_only_on_new_version():
+    cache = snapshotcache.SnapshotCache()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return f"body{len(builds)}"
+
+    etag1, body1 = cache.get(("table", "123", None), 1, build)
+    etag2, body2 = cache.get(("table", "123", None), 1, build)
+    assert (etag1, body1) == (etag2, body2)
+    assert len(builds) == 1
+
+    etag3, body3 = cache.get(("table", "123", None), 2, build)
+    assert etag3 != etag1
+    assert body3 == "body2"
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 2}
+
+
+def test_views_cached_separately():
+    cache = snapshotcache.SnapshotCache()
+    etag_a, _ = cache.get(("table", "123", None), 1, lambda: "spectator")
+    etag_b, body = cache.get(("table", "123", 0), 1, lambda: "seat0")
+    assert etag_a != etag_b
+    assert body == "seat0"
+
+    cache.drop_table("123")
+    assert cache.entries == {}
+
+
+def test_etag_matches():
+    etag = '"abc-v1"'
+    assert snapshotcache.etag_matches('"abc-v1"', etag)
+    assert snapshotcache.etag_matches('"x", "abc-v1"', etag)
+    assert snapshotcache.etag_matches("*", etag)
+    assert not snapshotcache.etag_matches('"abc-v2"', etag)
+    assert not snapshotcache.etag_matches(None, etag)
@@ -0,0 +1,58 @@
+import time
+import asyncio
+import pytest
+from vanillapoker import startup
+
+
+def test_phases_and_readiness():
+    async def main():
+        boot = startup.Startup()
+        boot.record("import", 0.5)
+        gate = asyncio.Event()
+
+        async def ledger():
+            await gate.wait()
+
+        def lookup_tables():
+            # Blocking work runs in a thread
+            time.sleep(0.01)
+
+        boot.start("ledger", ledger)
+        boot.start("lookupTables", lookup_tables)
+        boot.start("chain", lambda: 1 / 0, required=False)
+        await boot.wait("lookupTables")
+        assert not boot.ready
+        with pytest.raises(asyncio.TimeoutError):
+            await boot.wait("ledger", timeout=0.01)
+
+        gate.set()
+        await boot.wait("ledger")
+        assert boot.ready
+        with pytest.raises(RuntimeError):
+            await boot.wait("chain")
+        # Optional phases failing don't take the app down
+        assert not boot.failed
+
+        report = boot.report()
+        assert report["phases"]["import"]["seconds"] == 0.5
+        assert report["phases"]["lookupTables"]["seconds"] >= 0.01
+        assert report["phases"]["chain"]["status"] == startup.FAILED
+        assert "ZeroDivisionError" in report["phases"]["chain"]["error"]
+
+    asyncio.run(main())
+
+
+def test_required_failure():
+    async def main():
+        boot = startup.Startup()
+
+        async def ledger():
+            raise ConnectionError("mysql down")
+
+        boot.start("ledger", ledger)
+        with pytest.raises(RuntimeError):
+            await boot.wait("ledger")
+        assert boot.failed
+        assert not boot.ready
+
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from vanillapoker import tableactor
+
+
+def test_actions_are_serialized():
+    order = []
+
+    async def mutate(tag):
+        order.append(f"start-{tag}")
+        # Yielding here would let another request interleave without the actor
+        await asyncio.sleep(0.01)
+        order.append(f"end-{tag}")
+        return tag
+
+    async def main():
+        actor = tableactor.TableActor("123")
+        res = await asyncio.gather(*[actor.submit(mutate, i) for i in range(3)])
+        await actor.stop()
+        return res, actor.metrics()
+
+    res, metrics = asyncio.run(main())
+    assert res == [0, 1, 2]
+    assert order == ["start-0", "end-0", "start-1", "end-1", "start-2", "end-2"]
+    assert metrics["processed"] == 3
+    assert metrics["queueDepth"] == 0
+    assert metrics["waitMsMax"] > 0
+
+
+def test_full_queue_is_rejected():
+    async def slow():
+        await asyncio.sleep(0.01)
+
+    async def main():
+        actor = tableactor.TableActor("123", max_queue=1)
+        first = asyncio.ensure_future(actor.submit(slow))
+        # Let the worker pick up the first job, second one fills the queue
+        await asyncio.sleep(0.001)
+        second = asyncio.ensure_future(actor.submit(slow))
+        await asyncio.sleep(0)
+        with pytest.raises(tableactor.TableBusyError):
+            await actor.submit(slow)
+        await asyncio.gather(first, second)
+        await actor.stop()
+        return actor.metrics()
+
+    metrics = asyncio.run(main())
+    assert metrics["rejected"] == 1
+    assert metrics["processed"] == 2
+
+
+def test_exceptions_reach_caller():
+    async def bad():
+        assert False, "Not player's turn!"
+
+    async def good():
+        return "ok"
+
+    async def main():
+        actor = tableactor.TableActor("123")
+        with pytest.raises(AssertionError):
+            await actor.submit(bad)
+        # Worker should survive a failed action
+        res = await actor.submit(good)
+        await actor.stop()
+        return res
+
+    assert asyncio.run(main()) == "ok"
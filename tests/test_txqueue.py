@@ -0,0 +1,199 @@
+import asyncio
+import pytest
+
+pytest.importorskip("eth_tester")
+from eth_account import Account
+from web3 import AsyncWeb3
+from web3.providers.eth_tester import AsyncEthereumTesterProvider
+from vanillapoker import txqueue
+from tests import evmtoken
+
+
+async def funded_queue(**kwargs):
+    w3 = AsyncWeb3(AsyncEthereumTesterProvider())
+    account = Account.create()
+    accounts = await w3.eth.accounts
+    await w3.eth.send_transaction(
+        {"from": accounts[0], "to": account.address, "value": 10**20}
+    )
+    queue = txqueue.TxQueue(w3, account, poll_interval=0.01, **kwargs)
+    queue.chain_id = await w3.eth.chain_id
+    return w3, queue, accounts
+
+
+def test_concurrent_jobs_get_their_own_nonce():
+    async def main():
+        w3, queue, accounts = await funded_queue()
+        before = await w3.eth.get_balance(accounts[1])
+        job_ids = [
+            queue.submit("airdrop", {"to": accounts[1], "value": 10**15, "gas": 21000})
+            for _ in range(5)
+        ]
+        assert queue.get(job_ids[0])["status"] == txqueue.QUEUED
+        await queue.send_queued()
+        await queue.check_receipts()
+
+        jobs = [queue.get(job_id) for job_id in job_ids]
+        assert [job["nonce"] for job in jobs] == [0, 1, 2, 3, 4]
+        assert all(job["status"] == txqueue.CONFIRMED for job in jobs)
+        assert await w3.eth.get_balance(accounts[1]) == before + 5 * 10**15
+        assert queue.stats()["batches"] == 1
+
+    asyncio.run(main())
+
+
+def test_stuck_tx_is_bumped():
+    async def main():
+        w3, queue, accounts = await funded_queue(bump_after=0)
+        tester = w3.provider.ethereum_tester
+        tester.disable_auto_mine_transactions()
+        job_id = queue.submit("airdrop", {"to": accounts[1], "value": 1})
+        await queue.send_queued()
+        await queue.check_receipts()
+        job = queue.get(job_id)
+        assert job["status"] == txqueue.SENT
+        assert job["bumps"] == 1
+        assert len(job["txHashes"]) == 2
+
+        tester.mine_blocks(1)
+        await queue.check_receipts()
+        assert queue.get(job_id)["status"] == txqueue.CONFIRMED
+
+    asyncio.run(main())
+
+
+def test_reverting_call_fails_the_job():
+    async def main():
+        w3, queue, accounts = await funded_queue()
+        contract = await evmtoken.deploy(w3)
+        failed = []
+        # ownerOf reverts for tokens that were never minted
+        job_id = queue.submit(
+            "transferNFT", contract.functions.ownerOf(99), on_failed=failed.append
+        )
+        await queue.send_queued()
+        job = queue.get(job_id)
+        assert job["status"] == txqueue.FAILED
+        assert job["error"].startswith("Reverted")
+        assert [j.id for j in failed] == [job_id]
+        # The nonce wasn't used, the next job gets it
+        next_id = queue.submit("airdrop", {"to": accounts[1], "value": 1})
+        await queue.send_queued()
+        assert queue.get(next_id)["nonce"] == 0
+
+    asyncio.run(main())
+
+
+def test_nonce_resync_after_outside_send():
+    async def main():
+        w3, queue, accounts = await funded_queue()
+        first = queue.submit("airdrop", {"to": accounts[1], "value": 1, "gas": 21000})
+        await queue.send_queued()
+        # Same key used somewhere else, our local nonce is now stale
+        signed = queue.account.sign_transaction(
+            {
+                "to": accounts[1],
+                "value": 1,
+                "gas": 21000,
+                "nonce": 1,
+                "chainId": queue.chain_id,
+                "maxFeePerGas": 10**10,
+                "maxPriorityFeePerGas": 10**9,
+            }
+        )
+        await w3.eth.send_raw_transaction(signed.rawTransaction)
+        second = queue.submit("airdrop", {"to": accounts[1], "value": 1, "gas": 21000})
+        await queue.send_queued()
+        await queue.check_receipts()
+        assert queue.get(first)["nonce"] == 0
+        assert queue.get(second)["nonce"] == 2
+        assert queue.get(second)["attempts"] == 2
+        assert queue.get(second)["status"] == txqueue.CONFIRMED
+
+    asyncio.run(main())
+
+
+def test_dropped_tx_fails_after_deadline():
+    async def main():
+        w3, queue, accounts = await funded_queue(bump_after=0, give_up_after=0)
+        w3.provider.ethereum_tester.disable_auto_mine_transactions()
+        failed = []
+        job_id = queue.submit(
+            "airdrop", {"to": accounts[1], "value": 1}, on_failed=failed.append
+        )
+        await queue.send_queued()
+
+        async def dropped(tx_hash):
+            return False
+
+        queue._known = dropped
+        await queue.check_receipts()
+        job = queue.get(job_id)
+        assert job["status"] == txqueue.FAILED
+        assert [j.id for j in failed] == [job_id]
+        assert queue.stats()["inFlight"] == 0
+        # Resynced from the chain for the next job
+        assert queue.nonce is None
+
+    asyncio.run(main())
+
+
+def test_pending_tx_is_cancelled_before_failing():
+    async def main():
+        w3, queue, accounts = await funded_queue(bump_after=0, give_up_after=0)
+        tester = w3.provider.ethereum_tester
+        tester.disable_auto_mine_transactions()
+        before = await w3.eth.get_balance(accounts[1])
+        job_id = queue.submit("airdrop", {"to": accounts[1], "value": 10**15})
+        await queue.send_queued()
+        await queue.check_receipts()
+        job = queue.get(job_id)
+        # Still at the node, so take the nonce back instead of failing
+        assert job["status"] == txqueue.SENT
+        assert job["cancelled"]
+
+        tester.mine_blocks(1)
+        await queue.check_receipts()
+        job = queue.get(job_id)
+        assert job["status"] == txqueue.FAILED
+        assert job["error"].startswith("Cancelled")
+        assert await w3.eth.get_balance(accounts[1]) == before
+
+    asyncio.run(main())
+
+
+def test_errored_send_that_reached_node_is_not_failed():
+    async def main():
+        w3, queue, accounts = await funded_queue(max_attempts=1)
+        send = queue._send
+
+        async def timed_out(tx):
+            await send(tx)
+            raise TimeoutError("read timed out")
+
+        queue._send = timed_out
+        failed = []
+        job_id = queue.submit(
+            "airdrop", {"to": accounts[1], "value": 1}, on_failed=failed.append
+        )
+        await queue.send_queued()
+        await queue.check_receipts()
+        assert queue.get(job_id)["status"] == txqueue.CONFIRMED
+        assert failed == []
+
+    asyncio.run(main())
+
+
+def test_run_loop():
+    async def main():
+        w3, queue, accounts = await funded_queue()
+        task = asyncio.create_task(queue.run())
+        job_id = queue.submit("airdrop", {"to": accounts[1], "value": 1})
+        for _ in range(200):
+            if queue.get(job_id)["status"] == txqueue.CONFIRMED:
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+        assert queue.get(job_id)["status"] == txqueue.CONFIRMED
+
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+from vanillapoker import views
+
+
+def _game_state():
+    return {
+        "tag": "gameState",
+        "players": [
+            {"address": "0x123", "holecards": [1, 2]},
+            None,
+            {"address": "0x456", "holecards": [3, 4]},
+        ],
+    }
+
+
+def test_holecards_only_to_own_seat():
+    event = {"tag": "cards", "cardType": "p2", "cards": [3, 4]}
+    groups = views.project_event(event, 3)
+    assert len(groups) == 2
+    for audiences, view in groups:
+        if 2 in audiences:
+            assert audiences == [2]
+            assert view["cards"] == [3, 4]
+        else:
+            assert audiences == [None, 0, 1]
+            assert view["cards"] == []
+
+
+def test_game_state_views():
+    groups = views.project_event(_game_state(), 3)
+    by_audience = {a: view for audiences, view in groups for a in audiences}
+    # Spectators and the empty seat see the same thing, so share one view
+    assert len(groups) == 3
+    assert by_audience[None] is by_audience[1]
+    assert [p and p["holecards"] for p in by_audience[None]["players"]] == [
+        [],
+        None,
+        [],
+    ]
+    assert by_audience[0]["players"][0]["holecards"] == [1, 2]
+    assert by_audience[0]["players"][2]["holecards"] == []
+    assert by_audience[2]["players"][2]["holecards"] == [3, 4]
+
+
+def test_public_events_not_copied():
+    event = {"tag": "settle", "pots": []}
+    groups = views.project_event(event, 6)
+    assert len(groups) == 1
+    assert groups[0][1] is event
+    assert groups[0][0] == [None, 0, 1, 2, 3, 4, 5]
+
+
+def test_redact_gamestate():
+    current = [
+        {"tag": "cards", "cardType": "p0", "cards": [1, 2]},
+        _game_state(),
+    ]
+    finished = [{"tag": "cards", "cardType": "p0", "cards": [7, 8]}]
+    state = {
+        "hand_id": 2,
+        "deck": list(range(52)),
+        "seats": _game_state()["players"],
+        "events": current,
+        "events_pop": [],
+        "hand_histories": {1: finished, 2: current},
+    }
+    redacted = views.redact_gamestate(state)
+    assert "deck" not in redacted
+    assert [p and p["holecards"] for p in redacted["seats"]] == [[], None, []]
+    assert redacted["events"][0]["cards"] == []
+    assert redacted["hand_histories"][2][0]["cards"] == []
+    assert redacted["hand_histories"][2][1]["players"][0]["holecards"] == []
+    # Finished hands are history already
+    assert redacted["hand_histories"][1] is finished
+    # The engine's own state is untouched
+    assert state["seats"][0]["holecards"] == [1, 2]
+    assert current[0]["cards"] == [1, 2]
+
+
+def test_batch_frame_private_if_any_event_is():
+    events = [
+        {"tag": "settle", "pots": []},
+        {"tag": "cards", "cardType": "p1", "cards": [5, 6]},
+    ]
+    built = []
+
+    def build(seat_i):
+        built.append(seat_i)
+        return [views.view_for(event, seat_i) for event in events]
+
+    groups = views.project(
+        build, lambda seat_i: any(views.sees_private(e, seat_i) for e in events), 4
+    )
+    assert [a for a, _ in groups] == [[None, 0, 2, 3], [1]]
+    # One view per group, not per audience
+    assert built == [None, 1]
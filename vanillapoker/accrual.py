@@ -0,0 +1,122 @@
+import time
+import asyncio
+import numpy as np
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class AccrualJob:
+    """
+    Pays every user's NFT earnings into localBal. Users are taken chunk_size
+    at a time: payouts for the chunk are computed as arrays, the earnings
+    checkpoint is saved with them settled, the changed rows go to the journal
+    as one record and to mysql as one flush, and the event loop gets a turn
+    before the next chunk - so a million users takes seconds and other
+    requests keep being served meanwhile.
+    """
+
+    def __init__(
+        self,
+        ledger,
+        earnings,
+        total_tokens: int,
+        chunk_size: int = 10000,
+        clock=time.monotonic,
+    ):
+        self.ledger = ledger
+        self.earnings = earnings
+        self.total_tokens = total_tokens
+        self.chunk_size = chunk_size
+        self.clock = clock
+        self.status = PENDING
+        self.error = None
+        self.total = 0
+        self.processed = 0
+        # Rows whose balance actually changed
+        self.updated = 0
+        self.tokens_paid = 0
+        self.chunks = 0
+        self.flush_errors = 0
+        self.started = None
+        self.finished = None
+
+    def _pay_chunk(self, addresses):
+        pct = self.earnings.earned_many(addresses)
+        bonus = np.floor(pct * self.total_tokens).astype(np.int64)
+        paid = np.flatnonzero(bonus > 0)
+        paid_addresses = [addresses[i] for i in paid.tolist()]
+        if not paid_addresses:
+            return
+        # Settle and save the earnings before crediting, so a crash between
+        # the two can only leave a chunk unpaid - never paid again on restart
+        before = {
+            address: dict(self.earnings.accounts[address])
+            for address in paid_addresses
+            if address in self.earnings.accounts
+        }
+        self.earnings.settle_many(paid_addresses, pct[paid])
+        try:
+            self.earnings.save_checkpoint()
+        except Exception:
+            self.earnings.accounts.update(before)
+            raise
+        rows = []
+        for address, amount in zip(paid_addresses, bonus[paid].tolist()):
+            row = dict(self.ledger.balances[address])
+            row["localBal"] += amount
+            rows.append(row)
+        self.ledger.set_many(rows)
+        self.updated += len(rows)
+        self.tokens_paid += int(bonus[paid].sum())
+
+    async def run(self):
+        self.status = RUNNING
+        self.started = self.clock()
+        # Users created while this runs start earning from now on anyway
+        addresses = list(self.ledger.balances)
+        self.total = len(addresses)
+        try:
+            for start in range(0, len(addresses), self.chunk_size):
+                chunk = addresses[start : start + self.chunk_size]
+                self._pay_chunk(chunk)
+                try:
+                    await self.ledger.flush()
+                except Exception as e:
+                    # Already in the journal, the ledger's flusher retries it
+                    self.flush_errors += 1
+                    print("ACCRUAL FLUSH FAILED", e)
+                self.processed += len(chunk)
+                self.chunks += 1
+                await asyncio.sleep(0)
+        except Exception as e:
+            self.status = FAILED
+            self.error = str(e)
+            raise
+        finally:
+            self.finished = self.clock()
+        self.status = DONE
+
+    @property
+    def running(self) -> bool:
+        return self.status == RUNNING
+
+    def progress(self):
+        if self.started is None:
+            elapsed = 0
+        else:
+            elapsed = (self.finished or self.clock()) - self.started
+        return {
+            "status": self.status,
+            "error": self.error,
+            "total": self.total,
+            "processed": self.processed,
+            "updated": self.updated,
+            "tokensPaid": self.tokens_paid,
+            "chunks": self.chunks,
+            "flushErrors": self.flush_errors,
+            "seconds": elapsed,
+            "rowsPerSec": self.processed / elapsed if elapsed else None,
+        }
@@ -0,0 +1,156 @@
+"""
+Tiny local pub/sub broker so worker processes can tell each other things
+Newline-delimited JSON over TCP:
+    {"op": "sub", "channel": "lobby"}
+    {"op": "pub", "channel": "lobby", "data": {...}}
+Delivery is best effort - anything that has to survive a dropped connection
+should also be resent periodically (see the lobby "sync" messages)
+
+Run the broker with:
+    python -m vanillapoker.bus --port 8765
+"""
+import json
+import asyncio
+import argparse
+import traceback
+
+
+class BusServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765):
+        self.host = host
+        self.port = port
+        self.server = None
+        # channel -> set of StreamWriters
+        self.subscribers = {}
+        self.published = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        # Port 0 picks a free one, report what we got
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writers in self.subscribers.values():
+            for writer in writers:
+                writer.close()
+        self.subscribers = {}
+
+    async def _handle(self, reader, writer):
+        channels = set()
+        try:
+            async for line in reader:
+                msg = json.loads(line)
+                if msg["op"] == "sub":
+                    channels.add(msg["channel"])
+                    self.subscribers.setdefault(msg["channel"], set()).add(writer)
+                elif msg["op"] == "pub":
+                    self.published += 1
+                    for sub in list(self.subscribers.get(msg["channel"], ())):
+                        # Publisher doesn't get its own messages back
+                        if sub is not writer:
+                            sub.write(line)
+        except (ConnectionError, json.JSONDecodeError):
+            pass
+        finally:
+            for channel in channels:
+                self.subscribers.get(channel, set()).discard(writer)
+            writer.close()
+
+
+class BusClient:
+    """
+    Keeps a connection to the broker open, reconnecting (and resubscribing)
+    whenever it drops - publishes while disconnected are dropped
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765):
+        self.host = host
+        self.port = port
+        # channel -> [async fn(data)]
+        self.handlers = {}
+        self.writer = None
+        self.connected = asyncio.Event()
+        self.task = None
+        self.dropped = 0
+
+    def subscribe(self, channel: str, handler):
+        self.handlers.setdefault(channel, []).append(handler)
+        if self.writer is not None:
+            self._send({"op": "sub", "channel": channel})
+
+    async def publish(self, channel: str, data):
+        if self.writer is None:
+            self.dropped += 1
+            return
+        self._send({"op": "pub", "channel": channel, "data": data})
+        await self.writer.drain()
+
+    def _send(self, msg):
+        self.writer.write((json.dumps(msg) + "\n").encode())
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self, retry_delay: float = 1.0):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                await asyncio.sleep(retry_delay)
+                continue
+            self.writer = writer
+            for channel in self.handlers:
+                self._send({"op": "sub", "channel": channel})
+            self.connected.set()
+            try:
+                async for line in reader:
+                    msg = json.loads(line)
+                    for handler in self.handlers.get(msg["channel"], []):
+                        try:
+                            await handler(msg["data"])
+                        except Exception:
+                            # One bad message shouldn't take the subscription down
+                            traceback.print_exc()
+            except ConnectionError:
+                pass
+            finally:
+                self.connected.clear()
+                self.writer = None
+                writer.close()
+            await asyncio.sleep(retry_delay)
+
+
+def client_for(bus_url: str):
+    """
+    "host:port" -> BusClient
+    """
+    host, port = bus_url.rsplit(":", 1)
+    return BusClient(host, int(port))
+
+
+async def serve(host, port):
+    server = BusServer(host, port)
+    await server.start()
+    print(f"Bus listening on {server.host}:{server.port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
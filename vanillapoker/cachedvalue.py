@@ -0,0 +1,110 @@
+import time
+import asyncio
+
+
+class CachedValue:
+    """
+    One value from an async fetch, shared by every caller for ttl seconds.
+    Once it's older than that callers still get it straight away while a
+    single refresh runs in the background - only the very first read and
+    reads after invalidate() wait, and they all wait on the same fetch.
+
+    Changes we know about before the source shows them (e.g. a payout still
+    being mined) are held separately and applied to every value read, so a
+    refresh doesn't drop them.
+    """
+
+    def __init__(self, fetch, ttl: float, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.clock = clock
+        self.value = None
+        self.fetched_at = None
+        # False until the first fetch, and after invalidate()
+        self.valid = False
+        # Bumped by invalidate(), so a fetch that started before it is ignored
+        self.generation = 0
+        self.refreshing = None
+        # key -> delta not in the fetched value yet
+        self.pending = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.fetches = 0
+        self.shared = 0
+        self.errors = 0
+
+    def fresh(self) -> bool:
+        return self.valid and self.clock() - self.fetched_at < self.ttl
+
+    async def _refresh(self, generation):
+        self.fetches += 1
+        try:
+            value = await self.fetch()
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            if self.generation == generation:
+                self.refreshing = None
+        if self.generation == generation:
+            self.value = value
+            self.fetched_at = self.clock()
+            self.valid = True
+        return value
+
+    def _start_refresh(self):
+        if self.refreshing is not None:
+            self.shared += 1
+            return self.refreshing
+        task = asyncio.ensure_future(self._refresh(self.generation))
+        # Background refreshes have nobody awaiting them, don't warn on errors
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self.refreshing = task
+        return task
+
+    async def get(self):
+        if self.fresh():
+            self.hits += 1
+            return self.value + sum(self.pending.values())
+        task = self._start_refresh()
+        if self.valid:
+            self.stale_hits += 1
+            return self.value + sum(self.pending.values())
+        value = await asyncio.shield(task)
+        return value + sum(self.pending.values())
+
+    def invalidate(self):
+        """
+        Next get() fetches again and waits for it
+        """
+        self.valid = False
+        self.generation += 1
+        self.refreshing = None
+
+    def hold(self, key, delta):
+        """
+        Apply a change we know about until release(key), e.g. a payout
+        """
+        self.pending[key] = delta
+
+    def release(self, key):
+        """
+        The source shows the change now (or it never happened) - drop it and
+        fetch again, ignoring any fetch already running from before
+        """
+        if self.pending.pop(key, None) is not None:
+            self.invalidate()
+
+    def stats(self):
+        return {
+            "value": self.value,
+            "pending": sum(self.pending.values()),
+            "age": self.clock() - self.fetched_at if self.fetched_at else None,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "staleHits": self.stale_hits,
+            "fetches": self.fetches,
+            "shared": self.shared,
+            "errors": self.errors,
+        }
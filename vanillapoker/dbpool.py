@@ -0,0 +1,111 @@
+import os
+import time
+import weakref
+import aiomysql
+from contextlib import asynccontextmanager
+
+
+# Statements are kept as constants so every caller sends the exact same text -
+# PyMySQL interpolates client side, so there are no server-side prepared
+# statements to reuse, but this keeps the server's statement digest stable
+SQL_SELECT_USERS = "SELECT * FROM user_balances"
+SQL_SELECT_BALANCE = "SELECT * FROM user_balances WHERE address = %s"
+SQL_INSERT_USER = """
+    INSERT INTO user_balances (address, onChainBal, localBal, inPlay)
+    VALUES (%s, %s, %s, %s)
+"""
+SQL_UPDATE_BALANCE = """
+    UPDATE user_balances
+    SET onChainBal = %s, localBal = %s, inPlay = %s
+    WHERE address = %s
+"""
+
+
+class DBPool:
+    """
+    Thin wrapper around an aiomysql pool
+    Connections that sat idle for a while get pinged before being handed out
+    """
+
+    def __init__(
+        self,
+        minsize: int = 1,
+        maxsize: int = 10,
+        pool_recycle: int = 3600,
+        ping_after: float = 30.0,
+        **conn_kwargs,
+    ):
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.pool_recycle = pool_recycle
+        self.ping_after = ping_after
+        self.conn_kwargs = conn_kwargs
+        self.pool = None
+        # Connection -> last time it was returned to the pool
+        self.last_used = weakref.WeakKeyDictionary()
+
+        self.acquired = 0
+        self.pings = 0
+        self.ping_failures = 0
+
+    async def open(self):
+        self.pool = await aiomysql.create_pool(
+            minsize=self.minsize,
+            maxsize=self.maxsize,
+            pool_recycle=self.pool_recycle,
+            **self.conn_kwargs,
+        )
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+
+    @asynccontextmanager
+    async def connection(self):
+        async with self.pool.acquire() as connection:
+            self.acquired += 1
+            last_used = self.last_used.get(connection, 0)
+            if time.monotonic() - last_used > self.ping_after:
+                self.pings += 1
+                try:
+                    await connection.ping(reconnect=True)
+                except Exception:
+                    self.ping_failures += 1
+                    raise
+            try:
+                yield connection
+            finally:
+                self.last_used[connection] = time.monotonic()
+
+    def stats(self):
+        if self.pool is None:
+            return {"open": False}
+        return {
+            "open": True,
+            "size": self.pool.size,
+            "free": self.pool.freesize,
+            "minsize": self.minsize,
+            "maxsize": self.maxsize,
+            "acquired": self.acquired,
+            "pings": self.pings,
+            "pingFailures": self.ping_failures,
+        }
+
+
+def pool_from_env():
+    """
+    Pool settings come from the same env vars as the old per-call connections
+    """
+    return DBPool(
+        minsize=int(os.environ.get("SQL_POOL_MIN", 1)),
+        maxsize=int(os.environ.get("SQL_POOL_MAX", 10)),
+        pool_recycle=int(os.environ.get("SQL_POOL_RECYCLE", 3600)),
+        ping_after=float(os.environ.get("SQL_POOL_PING_AFTER", 30)),
+        host=os.environ.get("SQL_HOST", "localhost"),
+        port=int(os.environ.get("SQL_PORT", 3306)),
+        user=os.environ["SQL_USER"],
+        password=os.environ["SQL_PASS"],
+        db=os.environ.get("SQL_DB", "users"),
+    )
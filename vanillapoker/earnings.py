@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import asyncio
+import numpy as np
+
+SECONDS_PER_YEAR = 60 * 60 * 24 * 365
+
+
+class EarningsIndex:
+    """
+    NFT earning rate per address (sum of rarity / 100), kept up to date from
+    ownership changes instead of summed on every request.
+
+    Earnings are an annualized share of the token supply. Each address has a
+    checkpoint - the share earned up to `since` and the rarity it has held
+    since then - so what it has earned at any time is one multiply-add.
+    Checkpoints are folded forward whenever the rarity changes and saved to
+    disk, so earnings carry on across restarts.
+    """
+
+    def __init__(self, rarity_of, checkpoint_path: str = None, clock=time.time):
+        # rarity_of(token_id) -> rarity
+        self.rarity_of = rarity_of
+        self.checkpoint_path = checkpoint_path
+        self.clock = clock
+        # address -> summed rarity of the NFTs it owns now
+        self.rarity_sums = {}
+        # address -> {"pct", "since", "rarity", "start"}: share earned up to
+        # since, rarity held since then, and when this stretch of earning
+        # started (last payout)
+        self.accounts = {}
+        self.dirty = False
+        self.folds = 0
+
+    def rate(self, address: str) -> float:
+        return self.rarity_sums.get(address, 0) / 100
+
+    def _fold(self, address: str, now: float):
+        account = self.accounts.get(address)
+        if account is None:
+            account = {"pct": 0.0, "since": now, "rarity": 0, "start": now}
+            self.accounts[address] = account
+        account["pct"] += (
+            (now - account["since"]) / SECONDS_PER_YEAR * account["rarity"] / 100
+        )
+        account["since"] = now
+        account["rarity"] = self.rarity_sums.get(address, 0)
+        self.dirty = True
+        self.folds += 1
+        return account
+
+    def on_owner_change(self, token_id: int, old_owner, new_owner):
+        """
+        TransferIndexer listener - None means no owner (mint or burn)
+        """
+        rarity = self.rarity_of(token_id)
+        now = self.clock()
+        if old_owner is not None:
+            self.rarity_sums[old_owner] -= rarity
+            if not self.rarity_sums[old_owner]:
+                self.rarity_sums.pop(old_owner)
+            self._fold(old_owner, now)
+        if new_owner is not None:
+            self.rarity_sums[new_owner] = self.rarity_sums.get(new_owner, 0) + rarity
+            self._fold(new_owner, now)
+
+    def earned(self, address: str, now: float = None) -> float:
+        """
+        Share of the token supply earned since the last payout
+        """
+        account = self.accounts.get(address)
+        if account is None:
+            return 0.0
+        now = self.clock() if now is None else now
+        return account["pct"] + (
+            (now - account["since"]) / SECONDS_PER_YEAR * account["rarity"] / 100
+        )
+
+    def earned_many(self, addresses: list, now: float = None):
+        """
+        earned() for many addresses at once, as a float64 array
+        """
+        now = self.clock() if now is None else now
+        pct = np.zeros(len(addresses))
+        since = np.full(len(addresses), now)
+        rarity = np.zeros(len(addresses))
+        for i, address in enumerate(addresses):
+            account = self.accounts.get(address)
+            if account is not None:
+                pct[i] = account["pct"]
+                since[i] = account["since"]
+                rarity[i] = account["rarity"]
+        return pct + (now - since) / SECONDS_PER_YEAR * rarity / 100
+
+    def elapsed(self, address: str, now: float = None) -> float:
+        """
+        Seconds since the last payout, or since it started earning
+        """
+        account = self.accounts.get(address)
+        if account is None:
+            return 0.0
+        now = self.clock() if now is None else now
+        return now - account["start"]
+
+    def settle(self, address: str, paid: float):
+        """
+        Take a payout of `paid` (from earned()) off the account - whatever
+        it earned after that still counts
+        """
+        if address not in self.accounts:
+            return
+        account = self._fold(address, self.clock())
+        account["pct"] = max(account["pct"] - paid, 0.0)
+        account["start"] = account["since"]
+
+    def settle_many(self, addresses: list, paid):
+        """
+        settle() for many addresses, paid lines up with addresses
+        """
+        now = self.clock()
+        for address, amount in zip(addresses, paid.tolist()):
+            account = self.accounts.get(address)
+            if account is None:
+                continue
+            pct = account["pct"] + (
+                (now - account["since"]) / SECONDS_PER_YEAR * account["rarity"] / 100
+            )
+            account["pct"] = pct - amount if pct > amount else 0.0
+            account["since"] = now
+            account["start"] = now
+            account["rarity"] = self.rarity_sums.get(address, 0)
+        self.dirty = True
+
+    def load_checkpoint(self):
+        """
+        Load before NFT owners are, so each account is folded with the rarity
+        it held when saved - the downtime counts at the old rate
+        """
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, "r") as f:
+            self.accounts.update(json.load(f)["accounts"])
+
+    def reconcile(self):
+        """
+        Fold accounts whose rarity no longer matches what they own, for
+        owners that lost every NFT while we were down
+        """
+        now = self.clock()
+        for address, account in list(self.accounts.items()):
+            if account["rarity"] != self.rarity_sums.get(address, 0):
+                self._fold(address, now)
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path or not self.dirty:
+            return
+        # Write then rename, a crash mid-write leaves the old checkpoint intact
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"accounts": self.accounts}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self.dirty = False
+
+    async def run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.save_checkpoint()
+
+    def stats(self):
+        return {
+            "earners": len(self.rarity_sums),
+            "accounts": len(self.accounts),
+            "folds": self.folds,
+        }
@@ -0,0 +1,38 @@
+from collections import deque
+
+
+class EventStream:
+    """
+    Hands out per-table sequence numbers for emitted events and keeps the
+    most recent ones around so reconnecting clients can catch up
+    """
+
+    def __init__(self, max_events: int = 512):
+        # seq of the last event published, first event gets 1
+        self.seq = 0
+        self.buffer = deque(maxlen=max_events)
+
+    def publish(self, events):
+        """
+        Returns [(seq, event)] for the new events
+        """
+        seq_events = []
+        for event in events:
+            self.seq += 1
+            seq_events.append((self.seq, event))
+        self.buffer.extend(seq_events)
+        return seq_events
+
+    @property
+    def oldest_seq(self):
+        return self.buffer[0][0] if self.buffer else self.seq + 1
+
+    def since(self, last_seq: int):
+        """
+        Events after last_seq, or None if some of them were already dropped
+        (or last_seq is from the future) - caller should send a keyframe then
+        """
+        if last_seq > self.seq or last_seq < self.oldest_seq - 1:
+            return None
+        skip = last_seq - (self.oldest_seq - 1)
+        return list(self.buffer)[skip:]
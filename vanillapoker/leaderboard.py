@@ -0,0 +1,59 @@
+from sortedcontainers import SortedList
+
+
+class Leaderboard:
+    """
+    Users ranked by balance (localBal + inPlay), kept sorted as balances change
+    so reads only touch the slice that's returned
+    """
+
+    def __init__(self):
+        # address -> balance
+        self.balances = {}
+        # address -> earning rate, NFT holders may not have a balance yet
+        self.earning_rates = {}
+        # (-balance, address) so the biggest balance comes first
+        self.ranking = SortedList()
+
+    def __len__(self):
+        return len(self.balances)
+
+    def update_balance(self, address: str, balance: int):
+        if address in self.balances:
+            if self.balances[address] == balance:
+                return
+            self.ranking.remove((-self.balances[address], address))
+        self.balances[address] = balance
+        self.ranking.add((-balance, address))
+
+    def update_earning_rate(self, address: str, earning_rate: float):
+        # Only ranked by balance, so no need to touch the ordering
+        self.earning_rates[address] = earning_rate
+
+    def remove(self, address: str):
+        if address in self.balances:
+            self.ranking.remove((-self.balances.pop(address), address))
+
+    def rank(self, address: str):
+        """
+        0-based position, None if not ranked
+        """
+        if address not in self.balances:
+            return None
+        return self.ranking.index((-self.balances[address], address))
+
+    def page(self, offset: int = 0, limit: int = None):
+        stop = None if limit is None else offset + limit
+        leaders = []
+        for neg_balance, address in self.ranking.islice(offset, stop):
+            leaders.append(
+                {
+                    "address": address,
+                    "balance": -neg_balance,
+                    "earningRate": self.earning_rates.get(address, 0),
+                }
+            )
+        return leaders
+
+    def top(self, k: int):
+        return self.page(0, k)
@@ -0,0 +1,336 @@
+import os
+import glob
+import json
+import asyncio
+from collections import OrderedDict
+
+
+SQL_UPSERT_BALANCE = """
+    INSERT INTO user_balances (address, onChainBal, localBal, inPlay)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        onChainBal = VALUES(onChainBal),
+        localBal = VALUES(localBal),
+        inPlay = VALUES(inPlay)
+"""
+# settled_hands (id BIGINT AUTO_INCREMENT PRIMARY KEY, hand VARCHAR(64) UNIQUE)
+SQL_INSERT_SETTLED_HAND = "INSERT IGNORE INTO settled_hands (hand) VALUES (%s)"
+SQL_SELECT_SETTLED_HANDS = "SELECT hand FROM settled_hands ORDER BY id DESC LIMIT %s"
+
+
+class BalanceLedger:
+    """
+    In-memory source of truth for user_balances
+    Every mutation is appended to a journal file, and callers await sync()
+    before acknowledging it - one fsync off the event loop covers every write
+    made while the last one ran (group commit). Dirty rows get written back
+    to mysql in batches by flush(), along with the ids of hands settled
+    since, so a retried settlement is still recognised once the journal that
+    recorded it is gone
+    """
+
+    def __init__(self, pool, journal_path: str, fsync: bool = True):
+        self.pool = pool
+        self.journal_path = journal_path
+        self.fsync = fsync
+        # address -> {"address", "onChainBal", "localBal", "inPlay"}
+        self.balances = {}
+        self.dirty = set()
+        self.journal = None
+        self.journal_seq = 0
+        # Journal writes made so far, and how many of them are known on disk
+        self.write_seq = 0
+        self.synced_seq = 0
+        # The fsync running in a worker thread, at most one at a time
+        self.sync_task = None
+        self.flush_lock = asyncio.Lock()
+        # Called with (address, row) after every mutation
+        self.listeners = []
+        # Recently settled hand ids, so a retried settlement isn't applied twice
+        self.recent_hands = OrderedDict()
+        self.max_recent_hands = 10000
+        # Settled hand ids not in the db yet, written by the next flush
+        self.unflushed_hands = []
+
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.fsyncs = 0
+
+    def _rotated_journals(self):
+        paths = glob.glob(self.journal_path + ".*")
+        paths = [p for p in paths if p.rsplit(".", 1)[1].isdigit()]
+        return sorted(paths, key=lambda p: int(p.rsplit(".", 1)[1]))
+
+    async def load(self):
+        """
+        Pull every row from mysql, then replay anything in the journal that
+        didn't make it to the db before the last shutdown/crash
+        """
+        async with self.pool.connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT address, onChainBal, localBal, inPlay FROM user_balances"
+                )
+                for address, on_chain_bal, local_bal, in_play in await cursor.fetchall():
+                    # db entries are strings
+                    self.balances[address] = {
+                        "address": address,
+                        "onChainBal": int(float(on_chain_bal)),
+                        "localBal": int(float(local_bal)),
+                        "inPlay": int(float(in_play)),
+                    }
+                await cursor.execute(SQL_SELECT_SETTLED_HANDS, (self.max_recent_hands,))
+                # Newest first
+                for (hand,) in reversed(await cursor.fetchall()):
+                    self.recent_hands[hand] = True
+
+        journals = self._rotated_journals()
+        if os.path.exists(self.journal_path):
+            journals.append(self.journal_path)
+        for path in journals:
+            self._replay(path)
+        rotated = self._rotated_journals()
+        if rotated:
+            self.journal_seq = int(rotated[-1].rsplit(".", 1)[1])
+
+        self.journal = open(self.journal_path, "a")
+        for address in self.balances:
+            self._notify(address)
+        await self.flush()
+
+    def _replay(self, path):
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn write at the very end of the file - it was never acknowledged
+                    break
+                # Hand settlements are journaled as one record holding every seat
+                if row.get("hand") is not None and row["hand"] not in self.recent_hands:
+                    self._remember_hand(row["hand"])
+                for row in row.get("rows", [row]):
+                    self.balances[row["address"]] = row
+                    self.dirty.add(row["address"])
+
+    def _write(self, row, hand: str = None):
+        """
+        row can also be a list of rows, written as a single journal record
+        """
+        rows = row if isinstance(row, list) else [row]
+        record = {"hand": hand, "rows": rows} if isinstance(row, list) else row
+        self.journal.write(json.dumps(record) + "\n")
+        self.journal.flush()
+        self.write_seq += 1
+        for row in rows:
+            self.balances[row["address"]] = row
+            self.dirty.add(row["address"])
+            self._notify(row["address"])
+
+    async def sync(self):
+        """
+        Wait until every journal write made so far is on disk
+        """
+        if not self.fsync:
+            return
+        target = self.write_seq
+        while self.synced_seq < target:
+            if self.sync_task is None:
+                self.sync_task = asyncio.ensure_future(
+                    self._sync_file(self.journal, self.write_seq)
+                )
+            # Shielded - one waiter giving up mustn't cancel it for the rest
+            await asyncio.shield(self.sync_task)
+
+    async def _sync_file(self, journal, seq, close=False):
+        """
+        fsync journal in a worker thread, which covers writes up to seq
+        """
+        try:
+            await asyncio.to_thread(os.fsync, journal.fileno())
+            self.synced_seq = max(self.synced_seq, seq)
+            self.fsyncs += 1
+        finally:
+            if close:
+                journal.close()
+            self.sync_task = None
+
+    def _notify(self, address):
+        for listener in self.listeners:
+            listener(address, self.balances[address])
+
+    def exists(self, address: str):
+        return address in self.balances
+
+    def get(self, address: str):
+        """
+        Copy of the row, raises KeyError for unknown users
+        """
+        return dict(self.balances[address])
+
+    def rows(self):
+        return [dict(row) for row in self.balances.values()]
+
+    def create(self, address: str, on_chain_bal: int, local_bal: int, in_play: int):
+        assert address not in self.balances, "User already exists!"
+        self.set(address, on_chain_bal, local_bal, in_play)
+
+    def set(self, address: str, on_chain_bal: int, local_bal: int, in_play: int):
+        row = {
+            "address": address,
+            "onChainBal": int(on_chain_bal),
+            "localBal": int(local_bal),
+            "inPlay": int(in_play),
+        }
+        self._write(row)
+
+    def set_many(self, rows: list):
+        """
+        Overwrite many rows with a single journal write, rows are
+        {"address", "onChainBal", "localBal", "inPlay"}
+        """
+        rows = [
+            {
+                "address": row["address"],
+                "onChainBal": int(row["onChainBal"]),
+                "localBal": int(row["localBal"]),
+                "inPlay": int(row["inPlay"]),
+            }
+            for row in rows
+        ]
+        if rows:
+            self._write(rows)
+
+    def adjust(
+        self, address: str, on_chain_bal: int = 0, local_bal: int = 0, in_play: int = 0
+    ):
+        """
+        Apply deltas atomically, local balance can't go negative
+        """
+        row = self.balances[address]
+        assert row["localBal"] + local_bal >= 0, "Insufficient balance!"
+        self.set(
+            address,
+            row["onChainBal"] + on_chain_bal,
+            row["localBal"] + local_bal,
+            row["inPlay"] + in_play,
+        )
+
+    def settle_hand(self, hand: str, deltas: dict):
+        """
+        Move every seat's net result for a hand into inPlay in one journal write
+        hand is the full f"{table_id}-{hand_id}" identifier, a hand that was
+        already settled is skipped. The engine splits pots in whole chips, a
+        fractional delta is refused rather than rounded away
+        """
+        if hand in self.recent_hands:
+            return 0
+        for delta in deltas.values():
+            assert delta == int(delta), f"Fractional chips in hand {hand}!"
+        self._remember_hand(hand)
+        rows = []
+        for address, delta in deltas.items():
+            if address not in self.balances:
+                continue
+            row = dict(self.balances[address])
+            row["inPlay"] = row["inPlay"] + int(delta)
+            rows.append(row)
+        if rows:
+            self._write(rows, hand=hand)
+        return len(rows)
+
+    def _remember_hand(self, hand: str):
+        self.recent_hands[hand] = True
+        self.unflushed_hands.append(hand)
+        if len(self.recent_hands) > self.max_recent_hands:
+            self.recent_hands.popitem(last=False)
+
+    async def flush(self):
+        """
+        Write every dirty row, and the hands settled since the last flush, in
+        one transaction
+        """
+        async with self.flush_lock:
+            if not self.dirty and not self.unflushed_hands:
+                return 0
+            # Rotating closes the journal, not while an fsync is using it
+            while self.sync_task is not None:
+                await asyncio.shield(self.sync_task)
+            # Snapshot and rotate the journal without yielding, so the rotated
+            # file covers exactly the rows we're about to write
+            addresses = list(self.dirty)
+            self.dirty = set()
+            hands = self.unflushed_hands
+            self.unflushed_hands = []
+            rows = [
+                (
+                    a,
+                    str(self.balances[a]["onChainBal"]),
+                    str(self.balances[a]["localBal"]),
+                    str(self.balances[a]["inPlay"]),
+                )
+                for a in addresses
+            ]
+            if self.journal is not None:
+                rotated = self.journal
+                self.journal_seq += 1
+                os.replace(self.journal_path, f"{self.journal_path}.{self.journal_seq}")
+                self.journal = open(self.journal_path, "a")
+                if self.fsync and self.synced_seq < self.write_seq:
+                    # sync() waits on this before fsyncing the new journal,
+                    # so nothing is counted as synced out of order
+                    self.sync_task = asyncio.ensure_future(
+                        self._sync_file(rotated, self.write_seq, close=True)
+                    )
+                else:
+                    rotated.close()
+
+            try:
+                async with self.pool.connection() as connection:
+                    async with connection.cursor() as cursor:
+                        try:
+                            if rows:
+                                await cursor.executemany(SQL_UPSERT_BALANCE, rows)
+                            if hands:
+                                await cursor.executemany(
+                                    SQL_INSERT_SETTLED_HAND, [(h,) for h in hands]
+                                )
+                            await connection.commit()
+                        except Exception:
+                            await connection.rollback()
+                            raise
+            except Exception:
+                # Rotated journals stay on disk, next flush will pick these up again
+                self.dirty.update(addresses)
+                self.unflushed_hands = hands + self.unflushed_hands
+                raise
+
+            for path in self._rotated_journals():
+                os.remove(path)
+            self.flushes += 1
+            self.rows_flushed += len(rows)
+            return len(rows)
+
+    async def run_flusher(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print("BALANCE FLUSH FAILED", e)
+
+    async def close(self):
+        await self.flush()
+        await self.sync()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def stats(self):
+        return {
+            "users": len(self.balances),
+            "dirty": len(self.dirty),
+            "flushes": self.flushes,
+            "rowsFlushed": self.rows_flushed,
+            "fsyncs": self.fsyncs,
+        }
@@ -0,0 +1,135 @@
+import heapq
+from sortedcontainers import SortedList
+from vanillapoker.lobby import encode_cursor, decode_cursor
+
+MIN_RARITY = 1
+MAX_RARITY = 100
+# Keys are (amount, tokenId)
+KEY_TYPES = (int, int)
+
+
+class ListingIndex:
+    """
+    Marketplace listings kept sorted by price - overall, per cardNumber and
+    per rarity - so a page of /getListings only touches the listings it
+    returns, whatever the filters.
+
+    Keys are (amount, tokenId), unique and usable as cursors in both
+    directions.
+    """
+
+    def __init__(self):
+        # token_id -> {"tokenId", "seller", "amount", "cardNumber", "rarity"}
+        self.listings = {}
+        self.by_price = SortedList()
+        # cardNumber -> SortedList of keys
+        self.by_card = {}
+        # rarity -> SortedList of keys
+        self.by_rarity = {}
+
+    def __len__(self):
+        return len(self.listings)
+
+    def __contains__(self, token_id):
+        return token_id in self.listings
+
+    def get(self, token_id: int):
+        return self.listings.get(token_id)
+
+    def add(
+        self, token_id: int, seller: str, amount: int, card_number: int, rarity: int
+    ):
+        self.remove(token_id)
+        listing = {
+            "tokenId": token_id,
+            "seller": seller,
+            "amount": amount,
+            "cardNumber": card_number,
+            "rarity": rarity,
+        }
+        self.listings[token_id] = listing
+        key = (amount, token_id)
+        self.by_price.add(key)
+        self.by_card.setdefault(card_number, SortedList()).add(key)
+        self.by_rarity.setdefault(rarity, SortedList()).add(key)
+        return listing
+
+    def remove(self, token_id: int):
+        """
+        Returns the listing, None if it wasn't listed
+        """
+        listing = self.listings.pop(token_id, None)
+        if listing is None:
+            return None
+        key = (listing["amount"], token_id)
+        self.by_price.remove(key)
+        for groups, group_key in (
+            (self.by_card, listing["cardNumber"]),
+            (self.by_rarity, listing["rarity"]),
+        ):
+            groups[group_key].remove(key)
+            if not groups[group_key]:
+                groups.pop(group_key)
+        return listing
+
+    def query(
+        self,
+        card_number: int = None,
+        min_rarity: int = None,
+        max_rarity: int = None,
+        order: str = "asc",
+        cursor: str = None,
+        limit: int = None,
+    ):
+        """
+        Returns (listings, next_cursor), next_cursor is None on the last page
+        """
+        assert order in ("asc", "desc"), "Invalid order!"
+        assert limit is None or limit > 0, "Invalid limit!"
+        reverse = order == "desc"
+        min_rarity = MIN_RARITY if min_rarity is None else min_rarity
+        max_rarity = MAX_RARITY if max_rarity is None else max_rarity
+        # Cursor is the key of the last listing returned, so start just after it
+        after = decode_cursor(cursor, KEY_TYPES) if cursor else None
+        if reverse:
+            bounds = {"maximum": after, "inclusive": (True, after is None)}
+        else:
+            bounds = {"minimum": after, "inclusive": (after is None, True)}
+
+        # Narrowest sorted list that covers the filters, anything else is
+        # checked per listing
+        rarity_filtered = min_rarity > MIN_RARITY or max_rarity < MAX_RARITY
+        if card_number is not None:
+            keys = self.by_card.get(card_number, SortedList()).irange(
+                reverse=reverse, **bounds
+            )
+        elif rarity_filtered:
+            keys = heapq.merge(
+                *[
+                    self.by_rarity[rarity].irange(reverse=reverse, **bounds)
+                    for rarity in range(min_rarity, max_rarity + 1)
+                    if rarity in self.by_rarity
+                ],
+                reverse=reverse,
+            )
+        else:
+            keys = self.by_price.irange(reverse=reverse, **bounds)
+
+        listings = []
+        last_key = None
+        for key in keys:
+            listing = self.listings[key[1]]
+            if not min_rarity <= listing["rarity"] <= max_rarity:
+                continue
+            if limit is not None and len(listings) == limit:
+                return listings, encode_cursor(last_key)
+            listings.append(listing)
+            last_key = key
+        return listings, None
+
+    def stats(self):
+        return {
+            "listings": len(self.listings),
+            "cards": len(self.by_card),
+            "rarities": len(self.by_rarity),
+        }
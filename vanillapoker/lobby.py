@@ -0,0 +1,178 @@
+import json
+import base64
+from sortedcontainers import SortedList
+
+
+# Every sort key ends with tableId so keys are unique and usable as cursors
+SORT_KEYS = {
+    "stakes": lambda e: (e["bigBlind"], e["smallBlind"], e["numSeats"], e["tableId"]),
+    "players": lambda e: (-e["numPlayers"], e["bigBlind"], e["tableId"]),
+    "openSeats": lambda e: (
+        -(e["numSeats"] - e["numPlayers"]),
+        e["bigBlind"],
+        e["tableId"],
+    ),
+}
+# What each position of a sort key holds, cursors have to match it
+KEY_TYPES = {
+    "stakes": (int, int, int, str),
+    "players": (int, int, str),
+    "openSeats": (int, int, str),
+}
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str, types: tuple = None):
+    """
+    Inverse of encode_cursor, raises ValueError unless it decodes to a key
+    made of `types` - anything else would blow up comparing against real keys
+    """
+    key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(key, list):
+        raise ValueError("Invalid cursor")
+    if types is None:
+        return tuple(key)
+    if len(key) != len(types):
+        raise ValueError("Invalid cursor")
+    for value, value_type in zip(key, types):
+        # bool passes for int otherwise
+        if type(value) is not value_type:
+            raise ValueError("Invalid cursor")
+    return tuple(key)
+
+
+class LobbyIndex:
+    """
+    /getTables entries kept sorted several ways, plus per stakes/seat count
+    group totals - updated on create/join/leave instead of rebuilt per poll
+    """
+
+    def __init__(self):
+        # table_id -> {"tableId", "numSeats", "smallBlind", ...}
+        self.tables = {}
+        self.sorted = {sort: SortedList() for sort in SORT_KEYS}
+        # (smallBlind, bigBlind, numSeats) -> {"tables", "players"}
+        self.groups = {}
+
+    def __len__(self):
+        return len(self.tables)
+
+    def upsert(self, table_id: str, poker_table_obj):
+        entry = {
+            "tableId": table_id,
+            "numSeats": poker_table_obj.num_seats,
+            "smallBlind": poker_table_obj.small_blind,
+            "bigBlind": poker_table_obj.big_blind,
+            "minBuyin": poker_table_obj.min_buyin,
+            "maxBuyin": poker_table_obj.max_buyin,
+            "numPlayers": len(poker_table_obj.player_to_seat),
+        }
+        self.upsert_entry(entry)
+        return entry
+
+    def upsert_entry(self, entry):
+        table_id = entry["tableId"]
+        if self.tables.get(table_id) == entry:
+            return
+        self.remove(table_id)
+        self.tables[table_id] = entry
+        for sort, key_fn in SORT_KEYS.items():
+            self.sorted[sort].add(key_fn(entry))
+        group = self._group(entry)
+        group["tables"] += 1
+        group["players"] += entry["numPlayers"]
+
+    def remove(self, table_id: str):
+        entry = self.tables.pop(table_id, None)
+        if entry is None:
+            return
+        for sort, key_fn in SORT_KEYS.items():
+            self.sorted[sort].remove(key_fn(entry))
+        group = self._group(entry)
+        group["tables"] -= 1
+        group["players"] -= entry["numPlayers"]
+        if group["tables"] == 0:
+            group_key = (entry["smallBlind"], entry["bigBlind"], entry["numSeats"])
+            self.groups.pop(group_key)
+
+    def replace_where(self, belongs, entries):
+        """
+        Swap every entry where belongs(table_id) for entries - used to take a
+        full snapshot of another shard's tables
+        """
+        keep = {entry["tableId"] for entry in entries}
+        for table_id in [t for t in self.tables if belongs(t) and t not in keep]:
+            self.remove(table_id)
+        for entry in entries:
+            self.upsert_entry(entry)
+
+    def _group(self, entry):
+        group_key = (entry["smallBlind"], entry["bigBlind"], entry["numSeats"])
+        if group_key not in self.groups:
+            self.groups[group_key] = {"tables": 0, "players": 0}
+        return self.groups[group_key]
+
+    def summary(self):
+        return [
+            {
+                "smallBlind": small_blind,
+                "bigBlind": big_blind,
+                "numSeats": num_seats,
+                "tables": group["tables"],
+                "players": group["players"],
+                "openSeats": group["tables"] * num_seats - group["players"],
+            }
+            for (small_blind, big_blind, num_seats), group in sorted(
+                self.groups.items()
+            )
+        ]
+
+    def query(
+        self,
+        small_blind: int = None,
+        big_blind: int = None,
+        num_seats: int = None,
+        min_open_seats: int = None,
+        sort: str = "stakes",
+        cursor: str = None,
+        limit: int = None,
+    ):
+        """
+        Returns (entries, next_cursor), next_cursor is None on the last page
+        """
+        assert sort in SORT_KEYS, "Invalid sort!"
+        assert limit is None or limit > 0, "Invalid limit!"
+        key_fn = SORT_KEYS[sort]
+        # Cursor is the key of the last entry returned, so start just after it
+        minimum = decode_cursor(cursor, KEY_TYPES[sort]) if cursor else None
+        after_cursor = cursor is not None
+        # Sorted by stakes already, so jump straight to the right blinds
+        if sort == "stakes" and big_blind is not None:
+            if minimum is None or minimum < (big_blind,):
+                minimum = (big_blind,)
+                after_cursor = False
+
+        entries = []
+        last_key = None
+        keys = self.sorted[sort].irange(minimum, inclusive=(not after_cursor, True))
+        for key in keys:
+            entry = self.tables[key[-1]]
+            if sort == "stakes" and big_blind is not None and key[0] > big_blind:
+                break
+            if small_blind is not None and entry["smallBlind"] != small_blind:
+                continue
+            if big_blind is not None and entry["bigBlind"] != big_blind:
+                continue
+            if num_seats is not None and entry["numSeats"] != num_seats:
+                continue
+            open_seats = entry["numSeats"] - entry["numPlayers"]
+            if min_open_seats is not None and open_seats < min_open_seats:
+                continue
+            if limit is not None and len(entries) == limit:
+                return entries, encode_cursor(last_key)
+            entries.append(entry)
+            last_key = key_fn(entry)
+        return entries, None
@@ -0,0 +1,114 @@
+import json
+import asyncio
+from aiohttp import web
+
+# ownerOf(uint256)
+OWNER_OF_SELECTOR = "0x6352211e"
+
+
+class LocalRpcServer:
+    """
+    Stand-in for a hosted JSON-RPC node that answers the calls the api makes
+    (balances, nonces, fees, block number, ERC721 ownerOf) from dicts, with
+    optional latency per HTTP request - for tests and batching benchmarks.
+    Single requests and batches are both accepted, and every HTTP request
+    is counted the way a hosted provider would bill it.
+    """
+
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.chain_id = 84532
+        self.block_number = 1
+        self.gas_price = 10**9
+        # address (lowercase) -> wei
+        self.balances = {}
+        # address (lowercase) -> nonce
+        self.nonces = {}
+        # token_id -> owner address, for ownerOf on any contract
+        self.owners = {}
+        self.http_requests = 0
+        self.calls = 0
+        self.largest_batch = 0
+        self.runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _result(self, method, params):
+        if method == "eth_chainId":
+            return hex(self.chain_id)
+        if method == "eth_blockNumber":
+            return hex(self.block_number)
+        if method == "eth_gasPrice":
+            return hex(self.gas_price)
+        if method == "eth_maxPriorityFeePerGas":
+            return hex(self.gas_price // 10)
+        if method == "eth_getBalance":
+            return hex(self.balances.get(params[0].lower(), 0))
+        if method == "eth_getTransactionCount":
+            return hex(self.nonces.get(params[0].lower(), 0))
+        if method == "eth_call":
+            data = params[0].get("data") or params[0].get("input")
+            if data.startswith(OWNER_OF_SELECTOR):
+                owner = self.owners.get(int(data[10:], 16))
+                if owner is None:
+                    raise RevertError()
+                return "0x" + "0" * 24 + owner[2:].lower()
+        raise MethodNotFound(method)
+
+    def _handle(self, request):
+        self.calls += 1
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        try:
+            response["result"] = self._result(request["method"], request["params"])
+        except RevertError:
+            response["error"] = {"code": 3, "message": "execution reverted", "data": "0x"}
+        except MethodNotFound as e:
+            response["error"] = {"code": -32601, "message": f"method {e} not found"}
+        return response
+
+    async def handle_http(self, request):
+        self.http_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = await request.json()
+        if isinstance(body, list):
+            self.largest_batch = max(self.largest_batch, len(body))
+            result = [self._handle(item) for item in body]
+        else:
+            result = self._handle(body)
+        return web.Response(text=json.dumps(result), content_type="application/json")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/", self.handle_http)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        if self.port == 0:
+            self.port = self.runner.addresses[0][1]
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def stats(self):
+        return {
+            "httpRequests": self.http_requests,
+            "calls": self.calls,
+            "largestBatch": self.largest_batch,
+        }
+
+
+class RevertError(Exception):
+    pass
+
+
+class MethodNotFound(Exception):
+    pass
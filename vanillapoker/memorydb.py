@@ -0,0 +1,96 @@
+from contextlib import asynccontextmanager
+
+
+class MemoryCursor:
+    """
+    Understands just the user_balances and settled_hands statements
+    BalanceLedger sends
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def execute(self, sql, args=None):
+        assert sql.lstrip().upper().startswith("SELECT"), "Only SELECTs supported!"
+        self.db.queries += 1
+        if "settled_hands" in sql:
+            # Newest first, up to the limit
+            self.result = [(hand,) for hand in reversed(self.db.hands)][: args[0]]
+            return
+        # Stored as strings, same as the real table
+        self.result = [
+            (address, row["onChainBal"], row["localBal"], row["inPlay"])
+            for address, row in self.db.rows.items()
+        ]
+
+    async def fetchall(self):
+        return self.result
+
+    async def executemany(self, sql, rows):
+        if "settled_hands" in sql:
+            self.db.hands.extend(h for (h,) in rows if h not in self.db.hands)
+            return
+        assert "ON DUPLICATE KEY UPDATE" in sql, "Only upserts supported!"
+        self.db.writes += len(rows)
+        for address, on_chain_bal, local_bal, in_play in rows:
+            self.db.rows[address] = {
+                "onChainBal": str(on_chain_bal),
+                "localBal": str(local_bal),
+                "inPlay": str(in_play),
+            }
+
+
+class MemoryConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return MemoryCursor(self.db)
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class MemoryPool:
+    """
+    Stand-in for DBPool keeping user_balances in a dict - for load tests and
+    local runs without mysql, everything is lost when the process exits
+    (the balance journal still works as usual)
+    """
+
+    def __init__(self):
+        # address -> {"onChainBal", "localBal", "inPlay"}
+        self.rows = {}
+        # settled_hands, oldest first
+        self.hands = []
+        self.queries = 0
+        self.writes = 0
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @asynccontextmanager
+    async def connection(self):
+        yield MemoryConnection(self)
+
+    def stats(self):
+        return {
+            "open": True,
+            "memory": True,
+            "rows": len(self.rows),
+            "queries": self.queries,
+            "writes": self.writes,
+        }
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import asyncio
+import traceback
+from eth_utils import keccak, to_checksum_address
+
+TRANSFER_TOPIC = "0x" + keccak(text="Transfer(address,address,uint256)").hex()
+# Mints come from and burns go to the zero address
+ZERO_ADDRESS = "0x" + "0" * 40
+
+
+def topic_address(topic) -> str:
+    return to_checksum_address(bytes(topic)[-20:])
+
+
+class Web3LogSource:
+    """
+    Transfer logs for one ERC721 contract through an AsyncWeb3
+    """
+
+    def __init__(self, w3, address: str):
+        self.w3 = w3
+        self.address = to_checksum_address(address)
+        self.calls = 0
+
+    async def head(self) -> int:
+        self.calls += 1
+        return await self.w3.eth.block_number
+
+    async def block_hash(self, number: int):
+        """
+        None if the chain is shorter than that now
+        """
+        # Only imported once there's a chain to talk to, web3 is slow to load
+        from web3.exceptions import BlockNotFound
+
+        self.calls += 1
+        try:
+            block = await self.w3.eth.get_block(number)
+        except BlockNotFound:
+            return None
+        return block["hash"].hex()
+
+    async def transfers(self, from_block: int, to_block: int) -> list:
+        self.calls += 1
+        logs = await self.w3.eth.get_logs(
+            {
+                "address": self.address,
+                "topics": [TRANSFER_TOPIC],
+                "fromBlock": from_block,
+                "toBlock": to_block,
+            }
+        )
+        return [
+            {
+                "block": log["blockNumber"],
+                "blockHash": log["blockHash"].hex(),
+                "logIndex": log["logIndex"],
+                "from": topic_address(log["topics"][1]),
+                "to": topic_address(log["topics"][2]),
+                "tokenId": int.from_bytes(bytes(log["topics"][3]), "big"),
+            }
+            for log in logs
+            # ERC20 Transfers share the topic but don't index the amount
+            if len(log["topics"]) == 4
+        ]
+
+
+class TransferIndexer:
+    """
+    Keeps NFT owners from the contract's Transfer logs, reading block ranges
+    from a stored cursor so each refresh only costs the blocks since the last
+    one. Blocks are only read once they're confirmations deep, and a short
+    history of block hashes plus an undo log rolls back anything a deeper
+    reorg took away.
+
+    set_owner records what the app expects before the chain says so (a mint
+    or sale in flight) - it shows up straight away, and is dropped once a
+    confirmed Transfer agrees or after pending_ttl seconds if none does.
+    """
+
+    def __init__(
+        self,
+        source,
+        checkpoint_path: str = None,
+        start_block: int = 0,
+        confirmations: int = 12,
+        batch_blocks: int = 2000,
+        history: int = 128,
+        pending_ttl: float = 600,
+    ):
+        self.source = source
+        self.checkpoint_path = checkpoint_path
+        self.start_block = start_block
+        self.confirmations = confirmations
+        self.batch_blocks = batch_blocks
+        # How many block hashes to keep for spotting reorgs
+        self.history = history
+        self.pending_ttl = pending_ttl
+        # Last block indexed
+        self.block = start_block - 1
+        # token_id -> owner, from confirmed logs only
+        self.confirmed = {}
+        # token_id -> (owner, expires_at), set by the app and not yet on-chain
+        self.pending = {}
+        # address -> [token_id], this is nft_owners
+        self.owners = {}
+        # token_id -> address, confirmed with pending on top
+        self.token_owner = {}
+        # [block, hash] of indexed blocks, oldest first
+        self.hashes = []
+        # [block, token_id, previous confirmed owner], oldest first
+        self.undo = []
+        # Called as fn(token_id, old_owner, new_owner), None for no owner
+        self.listeners = []
+
+        self.transfers = 0
+        self.refreshes = 0
+        self.reorgs = 0
+
+    def _sync(self, token_id: int):
+        """
+        Bring token_owner/owners in line with confirmed + pending
+        """
+        if token_id in self.pending:
+            owner = self.pending[token_id][0]
+        else:
+            owner = self.confirmed.get(token_id)
+        old_owner = self.token_owner.get(token_id)
+        if old_owner == owner:
+            return False
+        if old_owner is not None:
+            self.owners[old_owner].remove(token_id)
+            if not self.owners[old_owner]:
+                self.owners.pop(old_owner)
+        if owner is None:
+            self.token_owner.pop(token_id)
+        else:
+            self.token_owner[token_id] = owner
+            self.owners.setdefault(owner, []).append(token_id)
+        for listener in self.listeners:
+            listener(token_id, old_owner, owner)
+        return True
+
+    def set_owner(self, token_id: int, owner: str) -> bool:
+        """
+        Record a mint or transfer the chain hasn't confirmed yet, returns
+        False if nothing changed
+        """
+        if self.confirmed.get(token_id) == owner:
+            self.pending.pop(token_id, None)
+        else:
+            self.pending[token_id] = (owner, time.monotonic() + self.pending_ttl)
+        return self._sync(token_id)
+
+    def _set_confirmed(self, token_id: int, owner):
+        if owner is None:
+            self.confirmed.pop(token_id, None)
+        else:
+            self.confirmed[token_id] = owner
+        # Only a Transfer to the owner we were waiting for settles it
+        if token_id in self.pending and self.pending[token_id][0] == owner:
+            self.pending.pop(token_id)
+        self._sync(token_id)
+
+    def _apply(self, transfer):
+        token_id = transfer["tokenId"]
+        owner = None if transfer["to"] == ZERO_ADDRESS else transfer["to"]
+        self.undo.append([transfer["block"], token_id, self.confirmed.get(token_id)])
+        self._set_confirmed(token_id, owner)
+        self.transfers += 1
+
+    def _remember(self, block: int, block_hash: str):
+        if self.hashes and self.hashes[-1][0] == block:
+            return
+        self.hashes.append([block, block_hash])
+        if len(self.hashes) > self.history:
+            self.hashes = self.hashes[-self.history :]
+            # Undo entries older than every hash we keep can never be used
+            oldest = self.hashes[0][0]
+            self.undo = [entry for entry in self.undo if entry[0] > oldest]
+
+    def _rollback(self, block: int):
+        """
+        Forget everything indexed after block
+        """
+        while self.undo and self.undo[-1][0] > block:
+            _, token_id, owner = self.undo.pop()
+            self._set_confirmed(token_id, owner)
+        self.hashes = [entry for entry in self.hashes if entry[0] <= block]
+        self.block = block
+
+    def _reset(self):
+        for token_id in list(self.confirmed):
+            self._set_confirmed(token_id, None)
+        self.hashes = []
+        self.undo = []
+        self.block = self.start_block - 1
+
+    async def check_reorg(self) -> bool:
+        """
+        Compare remembered hashes with the chain, newest first, and roll back
+        to the newest one still there. Returns True if anything was undone
+        """
+        for i in range(len(self.hashes) - 1, -1, -1):
+            block, block_hash = self.hashes[i]
+            if await self.source.block_hash(block) == block_hash:
+                if i == len(self.hashes) - 1:
+                    return False
+                self._rollback(block)
+                self.reorgs += 1
+                return True
+        if self.hashes:
+            # Deeper than our history, start over
+            self._reset()
+            self.reorgs += 1
+            return True
+        return False
+
+    async def _fetch(self, from_block: int, to_block: int) -> list:
+        try:
+            return await self.source.transfers(from_block, to_block)
+        except ValueError:
+            # Providers cap results per call, split the range and try again
+            if from_block == to_block:
+                raise
+            mid = (from_block + to_block) // 2
+            first = await self._fetch(from_block, mid)
+            return first + await self._fetch(mid + 1, to_block)
+
+    async def index(self) -> int:
+        """
+        Read logs up to head - confirmations, returns how many Transfers
+        were applied
+        """
+        applied = 0
+        await self.check_reorg()
+        safe = await self.source.head() - self.confirmations
+        while self.block < safe:
+            to_block = min(self.block + self.batch_blocks, safe)
+            transfers = await self._fetch(self.block + 1, to_block)
+            transfers.sort(key=lambda t: (t["block"], t["logIndex"]))
+            for transfer in transfers:
+                self._apply(transfer)
+                self._remember(transfer["block"], transfer["blockHash"])
+            applied += len(transfers)
+            self._remember(to_block, await self.source.block_hash(to_block))
+            self.block = to_block
+        return applied
+
+    def expire_pending(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        for token_id, (_, expires_at) in list(self.pending.items()):
+            if expires_at <= now:
+                self.pending.pop(token_id)
+                self._sync(token_id)
+
+    def load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, "r") as f:
+            checkpoint = json.load(f)
+        for token_id, owner in checkpoint["owners"].items():
+            self._set_confirmed(int(token_id), owner)
+        self.block = checkpoint["block"]
+        self.hashes = checkpoint["hashes"]
+        self.undo = checkpoint["undo"]
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        checkpoint = {
+            "block": self.block,
+            "owners": self.confirmed,
+            "hashes": self.hashes,
+            "undo": self.undo,
+        }
+        # Write then rename, a crash mid-write leaves the old checkpoint intact
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    async def refresh(self) -> int:
+        applied = await self.index()
+        self.expire_pending()
+        self.refreshes += 1
+        self.save_checkpoint()
+        return applied
+
+    async def run(self, interval: float):
+        """
+        Background refresh loop
+        """
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                # RPC trouble - keep what we have and try again next time
+                traceback.print_exc()
+            await asyncio.sleep(interval)
+
+    def stats(self):
+        return {
+            "tokens": len(self.token_owner),
+            "owners": len(self.owners),
+            "block": self.block,
+            "pending": len(self.pending),
+            "transfers": self.transfers,
+            "reorgs": self.reorgs,
+            "refreshes": self.refreshes,
+            "calls": getattr(self.source, "calls", None),
+        }
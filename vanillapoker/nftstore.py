@@ -0,0 +1,135 @@
+import random
+import numpy as np
+
+NUM_CARDS = 52
+
+
+class NFTStore:
+    """
+    Card properties for every tokenId as columns - cardNumber, rarity and
+    forSale in numpy arrays indexed by tokenId, 3 bytes a token instead of a
+    dict each.
+
+    Properties come from a PRNG seeded once, so token i always gets the same
+    card. Tokens past the ones generated so far are generated on first use,
+    up to max_tokens.
+    """
+
+    def __init__(self, count: int = 1000, seed: int = 0, max_tokens: int = 1000000):
+        self.rng = random.Random(seed)
+        self.max_tokens = max_tokens
+        self.count = 0
+        self.card_number = np.zeros(0, dtype=np.uint8)
+        self.rarity = np.zeros(0, dtype=np.uint8)
+        self.for_sale = np.zeros(0, dtype=bool)
+        self.ensure(count - 1)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, token_id):
+        return 0 <= token_id < self.count
+
+    def ensure(self, token_id: int):
+        """
+        Generate properties up to and including token_id
+        """
+        if token_id < self.count:
+            return
+        if token_id >= self.max_tokens:
+            raise KeyError(token_id)
+        new_count = token_id + 1
+        if new_count > len(self.rarity):
+            # Double so a run of mints doesn't copy the arrays every time
+            capacity = min(max(new_count, 2 * len(self.rarity)), self.max_tokens)
+            for name in ("card_number", "rarity", "for_sale"):
+                column = getattr(self, name)
+                grown = np.zeros(capacity, dtype=column.dtype)
+                grown[: self.count] = column[: self.count]
+                setattr(self, name, grown)
+        for i in range(self.count, new_count):
+            # Same draw order the contract's naming convention was copied with
+            self.card_number[i] = self.rng.randint(0, NUM_CARDS - 1)
+            self.rarity[i] = self.rng.randint(1, 100)
+        self.count = new_count
+
+    def _check(self, token_id: int):
+        # numpy would happily wrap negative ids around
+        if not 0 <= token_id < self.count:
+            raise KeyError(token_id)
+
+    def metadata(self, token_id: int):
+        """
+        {"cardNumber", "rarity", "forSale"}, raises KeyError for unknown tokens
+        """
+        self._check(token_id)
+        return {
+            "cardNumber": int(self.card_number[token_id]),
+            "rarity": int(self.rarity[token_id]),
+            "forSale": bool(self.for_sale[token_id]),
+        }
+
+    def many(self, token_ids: list):
+        """
+        metadata() for several tokens, as {tokenId: metadata}
+        """
+        ids = np.asarray(token_ids, dtype=np.int64)
+        if len(ids) and (ids.min() < 0 or ids.max() >= self.count):
+            raise KeyError([t for t in token_ids if t not in self])
+        cards = self.card_number[ids].tolist()
+        rarities = self.rarity[ids].tolist()
+        for_sale = self.for_sale[ids].tolist()
+        return {
+            token_id: {"cardNumber": card, "rarity": rarity, "forSale": listed}
+            for token_id, card, rarity, listed in zip(
+                token_ids, cards, rarities, for_sale
+            )
+        }
+
+    def card_of(self, token_id: int) -> int:
+        self.ensure(token_id)
+        self._check(token_id)
+        return int(self.card_number[token_id])
+
+    def rarity_of(self, token_id: int) -> int:
+        self.ensure(token_id)
+        self._check(token_id)
+        return int(self.rarity[token_id])
+
+    def set_for_sale(self, token_id: int, for_sale: bool):
+        self._check(token_id)
+        self.for_sale[token_id] = for_sale
+
+    def rarity_sums(self, owners: dict):
+        """
+        {address: [tokenId, ...]} -> {address: summed rarity}, in one pass
+        """
+        addresses = [address for address, tokens in owners.items() if tokens]
+        if not addresses:
+            return {}
+        lengths = [len(owners[address]) for address in addresses]
+        ids = np.fromiter(
+            (t for address in addresses for t in owners[address]),
+            dtype=np.int64,
+            count=sum(lengths),
+        )
+        group = np.repeat(np.arange(len(addresses)), lengths)
+        sums = np.bincount(group, weights=self.rarity[ids], minlength=len(addresses))
+        return dict(zip(addresses, sums.astype(np.int64).tolist()))
+
+    def card_counts(self, token_ids=None):
+        """
+        How many of token_ids (default every token) there are of each
+        cardNumber, as a list indexed by cardNumber
+        """
+        cards = self.card_number[: self.count]
+        if token_ids is not None:
+            cards = cards[np.asarray(token_ids, dtype=np.int64)]
+        return np.bincount(cards, minlength=NUM_CARDS).tolist()
+
+    def stats(self):
+        return {
+            "tokens": self.count,
+            "forSale": int(self.for_sale[: self.count].sum()),
+            "bytes": self.card_number.nbytes + self.rarity.nbytes + self.for_sale.nbytes,
+        }
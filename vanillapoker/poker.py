@@ -102,12 +102,19 @@ class PokerTable:
         # Append every single event here for the api to pop them off
         # TODO - look to be smarter about this...
         self.events_pop = []
+        # Stack deltas per finished hand, for the api to write to balances
+        self.settlements_pop = []
+        # Stack each player started the current hand with (adjusted for rebuys)
+        self.hand_start_stacks = {}
         # Will be specific to table: f"{table_id}-{hand_id}" is full unique hand identifier
         # Note - first hand_id will actually be 1 (it's incremented in another function)
         self.hand_id = 0
         self.hand_histories = {}
         self._increment_hand_history()
 
+        # Bumped on every mutation so the api can cache snapshots per version
+        self.version = 0
+
     def _increment_hand_history(self):
         # Map from hand_id to events list
         self.hand_id += 1
@@ -208,6 +215,7 @@ class PokerTable:
         """
         address should be a unique identifier for that player
         """
+        self.version += 1
         assert 0 <= seat_i <= self.num_seats - 1, "Invalid seat_i!"
         assert self.seats[seat_i] == None, "seat_i taken!"
         assert address not in self.player_to_seat, "Player already joined!"
@@ -227,6 +235,7 @@ class PokerTable:
             "last_amount": None,
         }
         self.player_to_seat[address] = seat_i
+        self.hand_start_stacks[address] = deposit_amount
 
         # If they join when a hand is in progress, wait until next hand
         if self.hand_stage != HS_SB_POST_STAGE:
@@ -250,18 +259,24 @@ class PokerTable:
         self._transition_hand_stage()
 
     def leave_table(self, seat_i: int, address: str):
+        self.version += 1
         assert self.seats[seat_i]["address"] == address, "Player not at seat!"
         self.seats[seat_i] = None
         self.player_to_seat.pop(address)
+        self.hand_start_stacks.pop(address, None)
         tag_lt = {"tag": "leaveTable", "player": address, "seat": seat_i}
         self.events.append(tag_lt)
         self.events_pop.append(tag_lt)
 
     def rebuy(self, seat_i: int, rebuy_amount: int, address: str):
+        self.version += 1
         assert self.seats[seat_i]["address"] == address, "Player not at seat!"
         new_stack = self.seats[seat_i]["stack"] + rebuy_amount
         assert self.min_buyin <= new_stack <= self.max_buyin, "Invalid rebuy amount"
         self.seats[seat_i]["stack"] = new_stack
+        self.hand_start_stacks[address] = (
+            self.hand_start_stacks.get(address, 0) + rebuy_amount
+        )
 
         tag_rb = {
             "tag": "rebuy",
@@ -340,6 +355,7 @@ class PokerTable:
         return hs_new
 
     def take_action(self, action_type: int, address: str, amount: int, external=True):
+        self.version += 1
         seat_i = self.player_to_seat[address]
         assert seat_i == self.whose_turn, "Not player's turn!"
 
@@ -432,19 +448,35 @@ class PokerTable:
                     winner_i = [seat_i]
                 elif self.seats[seat_i]["showdown_val"] == winner_val:
                     winner_i.append(seat_i)
-            # Credit winnings
+            # Credit winnings - split in whole chips, the odd chips go one each
+            # to the winners closest to the button's left
+            share, odd_chips = divmod(pot["amount"], max(len(winner_i), 1))
+            by_position = sorted(
+                winner_i, key=lambda i: (i - self.button - 1) % self.num_seats
+            )
+            winnings = {
+                seat_i: share + (1 if n < odd_chips else 0)
+                for n, seat_i in enumerate(by_position)
+            }
             for seat_i in winner_i:
-                self.seats[seat_i]["stack"] += pot["amount"] / len(winner_i)
+                self.seats[seat_i]["stack"] += winnings[seat_i]
             # And add our event
             # [{ potTotal: 60, winners: { 0: 60 } }];
-            # pot_dict = {seat_i: pot["amount"] / len(winner_i) for seat_i in winner_i}
-            winner_dict = {seat_i: pot["amount"] / len(winner_i) for seat_i in winner_i}
+            winner_dict = {seat_i: winnings[seat_i] for seat_i in winner_i}
             pot_dict = {"potTotal": pot["amount"], "winners": winner_dict}
             action["pots"].append(pot_dict)
 
         self.events.append(action)
         self.events_pop.append(action)
 
+        # Net result of the hand for every seated player
+        deltas = {}
+        for seat in self.seats:
+            if seat is not None:
+                start_stack = self.hand_start_stacks.get(seat["address"], seat["stack"])
+                deltas[seat["address"]] = seat["stack"] - start_stack
+        self.settlements_pop.append({"handId": self.hand_id, "deltas": deltas})
+
     def _get_showdown_val(self, cards):
         """
         Showdown value
@@ -638,6 +670,10 @@ class PokerTable:
                     self.seats[seat_i]["in_hand"] = True
                     self.seats[seat_i]["sitting_out"] = False
 
+        self.hand_start_stacks = {
+            seat["address"]: seat["stack"] for seat in self.seats if seat is not None
+        }
+
         self._increment_button()
         self.whose_turn = self.button
 
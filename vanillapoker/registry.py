@@ -0,0 +1,178 @@
+import os
+import json
+import time
+
+
+OPEN = "open"
+ACTIVE = "active"
+IDLE = "idle"
+CLOSED = "closed"
+
+
+class TableIdAllocator:
+    """
+    Hands out table ids from a counter - with num_shards > 1 each shard only
+    hands out ids where int(table_id) % num_shards == shard_index, so shards
+    never collide and anyone can tell which shard owns a table
+
+    With a state_path the counter survives restarts: ids are reserved in
+    blocks and the end of the block is saved before any id in it is handed
+    out, so a crash never hands the same id (and its hand keys) out twice
+    """
+
+    def __init__(
+        self,
+        first_id: int = 10000,
+        shard_index: int = 0,
+        num_shards: int = 1,
+        state_path: str = None,
+        reserve: int = 100,
+    ):
+        assert 0 <= shard_index < num_shards
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+        self.state_path = state_path
+        self.reserve = reserve
+        # Smallest id >= first_id that belongs to this shard
+        self.first_id = self._align(first_id)
+        self.next_id = self.first_id
+        if state_path and os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                saved = json.load(f)["next_id"]
+            # Everything below it may have been handed out before the restart
+            self.next_id = max(self.next_id, self._align(saved))
+        # Ids below this are already covered by the saved state
+        self.reserved_to = self.next_id
+
+    def _align(self, table_id: int) -> int:
+        return table_id + (self.shard_index - table_id) % self.num_shards
+
+    def _save_reservation(self):
+        self.reserved_to = self.next_id + self.reserve * self.num_shards
+        # Write then rename, and make sure it's on disk before using the block
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"next_id": self.reserved_to}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def allocate(self) -> str:
+        if self.state_path and self.next_id >= self.reserved_to:
+            # Once every `reserve` tables, so the write stays off the hot path
+            self._save_reservation()
+        table_id = self.next_id
+        self.next_id += self.num_shards
+        return str(table_id)
+
+    def issued(self, table_id: str) -> bool:
+        if not table_id.isdigit():
+            return False
+        table_id = int(table_id)
+        return (
+            self.first_id <= table_id < self.next_id
+            and table_id % self.num_shards == self.shard_index
+        )
+
+
+class TableRegistry:
+    """
+    Owns the table store and each table's lifecycle:
+        open - created, nobody has sat down yet
+        active - at least one player seated
+        idle - everyone left
+        closed - collected, gone from the store
+    Tables that stay open/idle for idle_ttl seconds get collected
+    """
+
+    def __init__(self, allocator: TableIdAllocator = None, idle_ttl: float = 600):
+        self.allocator = allocator or TableIdAllocator()
+        self.idle_ttl = idle_ttl
+        # table_id -> PokerTable, this is TABLE_STORE
+        self.tables = {}
+        self.states = {}
+        # table_id -> time.monotonic() when it last became empty
+        self.empty_since = {}
+        self.created = 0
+        self.collected = 0
+
+    def __contains__(self, table_id):
+        return table_id in self.tables
+
+    def __getitem__(self, table_id):
+        return self.tables[table_id]
+
+    def __len__(self):
+        return len(self.tables)
+
+    def add(self, poker_table_obj) -> str:
+        table_id = self.allocator.allocate()
+        # Only possible if someone put a table in by hand
+        while table_id in self.tables:
+            table_id = self.allocator.allocate()
+        self.tables[table_id] = poker_table_obj
+        self.states[table_id] = OPEN
+        self.empty_since[table_id] = time.monotonic()
+        self.created += 1
+        return table_id
+
+    def touch(self, table_id: str):
+        """
+        Call after a join/leave so the lifecycle state follows the seat count
+        """
+        if table_id not in self.tables:
+            return
+        if self.tables[table_id].player_to_seat:
+            self.states[table_id] = ACTIVE
+            self.empty_since.pop(table_id, None)
+        elif self.states[table_id] == ACTIVE:
+            self.states[table_id] = IDLE
+            self.empty_since[table_id] = time.monotonic()
+
+    def collectable(self, now: float = None):
+        """
+        Tables that have been empty for longer than idle_ttl
+        """
+        now = time.monotonic() if now is None else now
+        return [
+            table_id
+            for table_id, since in self.empty_since.items()
+            if now - since >= self.idle_ttl
+        ]
+
+    def collect(self, table_id: str, now: float = None) -> bool:
+        """
+        Remove the table if it is still empty and past idle_ttl - the caller
+        should run this on the table's actor so a queued join can't race it
+        """
+        now = time.monotonic() if now is None else now
+        since = self.empty_since.get(table_id)
+        if since is None or now - since < self.idle_ttl:
+            return False
+        if self.tables[table_id].player_to_seat:
+            return False
+        self.tables.pop(table_id)
+        self.empty_since.pop(table_id)
+        self.states.pop(table_id)
+        self.collected += 1
+        return True
+
+    def state(self, table_id: str):
+        if table_id in self.states:
+            return self.states[table_id]
+        # Ids are never reused, so anything we issued that's gone was collected
+        return CLOSED if self.allocator.issued(table_id) else None
+
+    def metrics(self):
+        counts = {OPEN: 0, ACTIVE: 0, IDLE: 0}
+        for state in self.states.values():
+            counts[state] += 1
+        return {
+            "live": len(self.tables),
+            "open": counts[OPEN],
+            "active": counts[ACTIVE],
+            "idle": counts[IDLE],
+            "created": self.created,
+            "collected": self.collected,
+            "idleTtl": self.idle_ttl,
+        }
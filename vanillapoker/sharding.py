@@ -0,0 +1,59 @@
+import os
+
+
+def shard_for(table_id: str, num_shards: int) -> int:
+    """
+    Which worker owns a table - matches how TableIdAllocator hands out ids
+    """
+    try:
+        return int(table_id) % num_shards
+    except (TypeError, ValueError):
+        # Not a table we could have created, let the home shard say so
+        return 0
+
+
+class ShardConfig:
+    """
+    Where this worker sits in the deployment
+    Shard 0 is the home shard - it owns the balance ledger, NFTs and the
+    leaderboard, every shard (including home) owns the tables that hash to it
+    """
+
+    def __init__(
+        self,
+        shard_index: int = 0,
+        num_shards: int = 1,
+        urls=None,
+        bus_url: str = None,
+        secret: str = "",
+    ):
+        assert 0 <= shard_index < num_shards
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        # shard index -> base url, only needed to reach the home shard
+        self.urls = urls or []
+        self.bus_url = bus_url
+        # Sent on /internal/ calls so only other shards can make them
+        self.secret = secret
+
+    @property
+    def is_home(self):
+        return self.shard_index == 0
+
+    @property
+    def home_url(self):
+        return self.urls[0]
+
+    def owns(self, table_id: str) -> bool:
+        return shard_for(table_id, self.num_shards) == self.shard_index
+
+
+def config_from_env():
+    urls = [u for u in os.environ.get("SHARD_URLS", "").split(",") if u]
+    return ShardConfig(
+        shard_index=int(os.environ.get("SHARD_INDEX", 0)),
+        num_shards=int(os.environ.get("NUM_SHARDS", 1)),
+        urls=urls,
+        bus_url=os.environ.get("BUS_URL"),
+        secret=os.environ.get("SHARD_SECRET", ""),
+    )
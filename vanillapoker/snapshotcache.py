@@ -0,0 +1,51 @@
+import uuid
+
+
+class SnapshotCache:
+    """
+    Encoded responses keyed by (kind, table_id, ...) and tagged with the
+    table version they were built from - rebuilt only when the version moves
+    """
+
+    def __init__(self):
+        # key -> (version, etag, body)
+        self.entries = {}
+        # Versions restart with the process, so keep etags from matching
+        # anything a previous process handed out
+        self.epoch = uuid.uuid4().hex[:8]
+        self.hits = 0
+        self.misses = 0
+
+    def etag(self, key, version: int):
+        key_str = "-".join(str(k) for k in key)
+        return f'"{self.epoch}-{key_str}-v{version}"'
+
+    def get(self, key, version: int, build):
+        """
+        Returns (etag, body), build() is only called on a miss and should
+        return the encoded body
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1], entry[2]
+        self.misses += 1
+        etag = self.etag(key, version)
+        body = build()
+        self.entries[key] = (version, etag, body)
+        return etag, body
+
+    def drop_table(self, table_id: str):
+        for key in [k for k in self.entries if k[1] == table_id]:
+            self.entries.pop(key)
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def etag_matches(if_none_match: str, etag: str):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [x.strip() for x in if_none_match.split(",")]
@@ -0,0 +1,105 @@
+import time
+import asyncio
+import traceback
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Startup:
+    """
+    Named startup phases run as background tasks, so the app can take
+    requests while the slow parts load. Endpoints that need a phase wait on
+    it, and the app counts as ready once every required phase is done.
+    """
+
+    def __init__(self):
+        self.created = time.perf_counter()
+        # name -> {"status", "required", "seconds", "error"}
+        self.phases = {}
+        self.events = {}
+        self.tasks = []
+
+    def add(self, name: str, required: bool = True):
+        self.phases[name] = {
+            "status": PENDING,
+            "required": required,
+            "seconds": None,
+            "error": None,
+        }
+        self.events[name] = asyncio.Event()
+
+    def record(self, name: str, seconds: float):
+        """
+        A phase that already happened, e.g. module import
+        """
+        self.add(name, required=False)
+        self.phases[name].update(status=DONE, seconds=round(seconds, 4))
+        self.events[name].set()
+
+    async def _run(self, name, fn):
+        phase = self.phases[name]
+        phase["status"] = RUNNING
+        t0 = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                await fn()
+            else:
+                # Plain functions are blocking work (file parsing, imports)
+                await asyncio.to_thread(fn)
+        except Exception as e:
+            phase["status"] = FAILED
+            phase["error"] = repr(e)
+            traceback.print_exc()
+        else:
+            phase["status"] = DONE
+        phase["seconds"] = round(time.perf_counter() - t0, 4)
+        self.events[name].set()
+
+    def start(self, name: str, fn, required: bool = True):
+        """
+        fn is an async function, or a blocking one to run in a thread
+        """
+        self.add(name, required)
+        self.tasks.append(asyncio.create_task(self._run(name, fn)))
+
+    async def wait(self, name: str, timeout: float = None):
+        """
+        Raises RuntimeError if the phase failed, TimeoutError if it's still
+        going after timeout seconds
+        """
+        await asyncio.wait_for(self.events[name].wait(), timeout)
+        if self.phases[name]["status"] == FAILED:
+            raise RuntimeError(f"Startup phase {name} failed")
+
+    def done(self, name: str) -> bool:
+        return self.phases.get(name, {}).get("status") == DONE
+
+    @property
+    def ready(self) -> bool:
+        return all(
+            phase["status"] == DONE
+            for phase in self.phases.values()
+            if phase["required"]
+        )
+
+    @property
+    def failed(self) -> bool:
+        return any(
+            phase["status"] == FAILED
+            for phase in self.phases.values()
+            if phase["required"]
+        )
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def report(self):
+        return {
+            "ready": self.ready,
+            "uptime": round(time.perf_counter() - self.created, 4),
+            "phases": self.phases,
+        }
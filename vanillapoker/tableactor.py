@@ -0,0 +1,96 @@
+import time
+import asyncio
+
+
+class TableBusyError(Exception):
+    pass
+
+
+class TableActor:
+    """
+    Runs every mutation for a single table one at a time, in order
+    Each table gets its own queue + worker so a busy table only slows itself down
+    """
+
+    def __init__(self, table_id: str, max_queue: int = 64):
+        self.table_id = table_id
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.worker = None
+
+        # Backpressure metrics
+        self.processed = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_last = 0.0
+        self.service_total = 0.0
+
+    def start(self):
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        # Anyone still waiting on a job should not hang forever
+        while not self.queue.empty():
+            _, _, fut, _ = self.queue.get_nowait()
+            if not fut.done():
+                fut.set_exception(TableBusyError("Table actor stopped!"))
+
+    async def submit(self, fn, *args):
+        """
+        Queue up fn(*args) (a coroutine function) and wait for its result
+        Raises TableBusyError if the queue is already full
+        """
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((fn, args, fut, time.monotonic()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise TableBusyError("Table busy!")
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return await fut
+
+    async def _run(self):
+        while True:
+            fn, args, fut, queued_at = await self.queue.get()
+            start = time.monotonic()
+            wait = start - queued_at
+            self.wait_last = wait
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            try:
+                # Caller may have given up (request cancelled) - skip the work then
+                if not fut.cancelled():
+                    res = await fn(*args)
+                    if not fut.done():
+                        fut.set_result(res)
+            except Exception as e:
+                if not fut.done():
+                    fut.set_exception(e)
+            finally:
+                self.processed += 1
+                self.service_total += time.monotonic() - start
+                self.queue.task_done()
+
+    def metrics(self):
+        processed = max(self.processed, 1)
+        return {
+            "tableId": self.table_id,
+            "queueDepth": self.queue.qsize(),
+            "maxQueueDepth": self.max_depth,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "waitMsLast": self.wait_last * 1000,
+            "waitMsAvg": self.wait_total / processed * 1000,
+            "waitMsMax": self.wait_max * 1000,
+            "serviceMsAvg": self.service_total / processed * 1000,
+        }
@@ -0,0 +1,429 @@
+import math
+import time
+import uuid
+import asyncio
+import traceback
+from collections import OrderedDict, deque
+from web3.exceptions import (
+    BadFunctionCallOutput,
+    ContractLogicError,
+    TransactionNotFound,
+)
+
+# A call that reverts (or returns nothing at all) while building the tx
+REVERTED = (ContractLogicError, BadFunctionCallOutput)
+try:
+    from eth_tester.exceptions import TransactionFailed
+
+    # eth-tester raises its own error when a call reverts
+    REVERTED += (TransactionFailed,)
+except ImportError:
+    pass
+
+QUEUED = "queued"
+SENT = "sent"
+CONFIRMED = "confirmed"
+FAILED = "failed"
+
+
+def is_nonce_error(e) -> bool:
+    # "nonce too low" from nodes, "Invalid transaction nonce" from eth-tester
+    return "nonce" in str(e).lower()
+
+
+class Job:
+    def __init__(self, kind, tx, on_failed=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        # A contract function (has build_transaction) or a plain tx dict
+        self.tx = tx
+        self.on_failed = on_failed
+        self.status = QUEUED
+        self.error = None
+        self.nonce = None
+        # Every hash sent for this nonce, any one of them can get mined
+        self.hashes = []
+        # The last tx sent, bumps re-sign it with higher fees
+        self.sent_tx = None
+        # Hashes of the no-op self-transfers sent to take back the nonce
+        self.cancel_hashes = []
+        self.attempts = 0
+        self.bumps = 0
+        self.created = time.time()
+        self.sent_at = None
+        self.first_sent_at = None
+        self.finished = None
+
+    def info(self):
+        return {
+            "jobId": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "error": self.error,
+            "nonce": self.nonce,
+            "txHash": self.hashes[-1] if self.hashes else None,
+            "txHashes": self.hashes,
+            "attempts": self.attempts,
+            "bumps": self.bumps,
+            "cancelled": bool(self.cancel_hashes),
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class TxQueue:
+    """
+    Sends every transaction for one signing account. Nonces are handed out
+    locally (synced from the chain at start and after a nonce error), a single
+    sender drains the queue so concurrent requests never share a nonce, and
+    receipts are polled in the background - a tx that sits unmined for
+    bump_after seconds is re-sent with fees raised by gas_bump.
+
+    A job still unmined give_up_after seconds after it was first sent fails
+    once the node no longer has any of its txs. If the node does, the nonce
+    is taken back with a no-op self-transfer first, so a failed (refunded)
+    job can never land on-chain later.
+
+    submit() returns a job id straight away, get() has its progress.
+    """
+
+    def __init__(
+        self,
+        w3,
+        account,
+        max_in_flight: int = 16,
+        send_interval: float = 0.0,
+        poll_interval: float = 2.0,
+        bump_after: float = 30.0,
+        gas_bump: float = 1.125,
+        max_bumps: int = 5,
+        max_attempts: int = 3,
+        give_up_after: float = 600.0,
+        max_jobs: int = 10000,
+    ):
+        self.w3 = w3
+        # eth_account LocalAccount that signs everything
+        self.account = account
+        # Unconfirmed txs allowed at once, nodes cap pending txs per sender
+        self.max_in_flight = max_in_flight
+        # Pause between sends within a batch
+        self.send_interval = send_interval
+        self.poll_interval = poll_interval
+        self.bump_after = bump_after
+        # Nodes want replacements at least 10% pricier
+        self.gas_bump = gas_bump
+        self.max_bumps = max_bumps
+        self.max_attempts = max_attempts
+        self.give_up_after = give_up_after
+        self.max_jobs = max_jobs
+        self.chain_id = None
+        # Next nonce to use, None means ask the chain
+        self.nonce = None
+        # job id -> Job, oldest first
+        self.jobs = OrderedDict()
+        self.queued = deque()
+        # job id -> Job for sent but unconfirmed
+        self.in_flight = {}
+        self.wakeup = asyncio.Event()
+        # Called as fn(job) when a job is confirmed or fails
+        self.listeners = []
+
+        self.sent = 0
+        self.confirmed = 0
+        self.failed = 0
+        self.bumped = 0
+        self.cancelled = 0
+        self.batches = 0
+
+    def submit(self, kind: str, tx, on_failed=None) -> str:
+        """
+        tx is a contract function call or a dict with to/value/data (and gas,
+        otherwise it's estimated) - from, nonce, fees and chainId are filled
+        in here. on_failed(job) runs if it never makes it on-chain or reverts
+        """
+        job = Job(kind, tx, on_failed)
+        self.jobs[job.id] = job
+        self.queued.append(job)
+        self.wakeup.set()
+        self._trim_jobs()
+        return job.id
+
+    def get(self, job_id: str):
+        job = self.jobs.get(job_id)
+        return job.info() if job is not None else None
+
+    def _trim_jobs(self):
+        # Forget the oldest finished jobs, never ones still in progress
+        excess = len(self.jobs) - self.max_jobs
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id].finished is not None:
+                self.jobs.pop(job_id)
+                excess -= 1
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        self.in_flight.pop(job.id, None)
+        if status == CONFIRMED:
+            self.confirmed += 1
+        else:
+            self.failed += 1
+            if job.on_failed is not None:
+                try:
+                    job.on_failed(job)
+                except Exception:
+                    traceback.print_exc()
+        for listener in self.listeners:
+            listener(job)
+        # A slot opened up
+        self.wakeup.set()
+
+    async def _fees(self):
+        block = await self.w3.eth.get_block("latest")
+        tip = await self.w3.eth.max_priority_fee
+        # Room for the base fee to double before the tx is priced out
+        return {
+            "maxFeePerGas": block["baseFeePerGas"] * 2 + tip,
+            "maxPriorityFeePerGas": tip,
+        }
+
+    async def _build(self, job, nonce, fees):
+        params = {
+            "from": self.account.address,
+            "nonce": nonce,
+            "chainId": self.chain_id,
+            "type": 2,
+            **fees,
+        }
+        if hasattr(job.tx, "build_transaction"):
+            # Estimates gas, so a call that would revert fails here
+            return await job.tx.build_transaction(params)
+        tx = {**job.tx, **params}
+        if "gas" not in tx:
+            tx["gas"] = await self.w3.eth.estimate_gas(tx)
+        return tx
+
+    async def _send(self, tx):
+        """
+        Returns the hash, also when the node says it already has the tx
+        """
+        signed = self.account.sign_transaction(tx)
+        try:
+            await self.w3.eth.send_raw_transaction(signed.rawTransaction)
+        except Exception as e:
+            if "already known" not in str(e).lower():
+                raise
+        return signed.hash.hex()
+
+    async def _known(self, tx_hash) -> bool:
+        try:
+            await self.w3.eth.get_transaction(tx_hash)
+        except TransactionNotFound:
+            return False
+        return True
+
+    async def _send_new(self, job, fees):
+        tx = None
+        # Every tx we tried to send, a send that errored may still have
+        # reached the node
+        tried = []
+        while job.attempts < self.max_attempts:
+            job.attempts += 1
+            if self.nonce is None:
+                self.nonce = await self.w3.eth.get_transaction_count(
+                    self.account.address, "pending"
+                )
+            last_tx = tx
+            try:
+                tx = await self._build(job, self.nonce, fees)
+                tried.append(tx)
+                tx_hash = await self._send(tx)
+            except REVERTED as e:
+                self._finish(job, FAILED, f"Reverted: {e}")
+                return
+            except Exception as e:
+                job.error = str(e)
+                if not is_nonce_error(e):
+                    await asyncio.sleep(self.poll_interval * job.attempts)
+                    continue
+                # A send that timed out may have reached the node after all,
+                # don't pay twice with a fresh nonce
+                if last_tx is not None:
+                    signed = self.account.sign_transaction(last_tx)
+                    if await self._known(signed.hash.hex()):
+                        tx, tx_hash = last_tx, signed.hash.hex()
+                        self._sent(job, tx, tx_hash)
+                        return
+                # Something else used our nonce, start again from the chain
+                self.nonce = None
+                continue
+            self._sent(job, tx, tx_hash)
+            return
+        # Don't fail (and refund) a job whose tx can still get mined
+        for tx in reversed(tried):
+            tx_hash = self.account.sign_transaction(tx).hash.hex()
+            try:
+                known = await self._known(tx_hash)
+            except Exception:
+                # Can't tell - track it, the receipt check sorts it out
+                known = True
+            if known:
+                self._sent(job, tx, tx_hash)
+                return
+        self._finish(job, FAILED, job.error)
+
+    def _sent(self, job, tx, tx_hash):
+        job.nonce = tx["nonce"]
+        job.sent_tx = tx
+        job.hashes.append(tx_hash)
+        job.status = SENT
+        job.error = None
+        job.sent_at = time.monotonic()
+        job.first_sent_at = job.sent_at
+        self.nonce = tx["nonce"] + 1
+        self.in_flight[job.id] = job
+        self.sent += 1
+
+    async def send_queued(self):
+        """
+        Send everything queued, as far as max_in_flight allows - fees are
+        looked up once per batch
+        """
+        if not self.queued or len(self.in_flight) >= self.max_in_flight:
+            return
+        fees = await self._fees()
+        self.batches += 1
+        while self.queued and len(self.in_flight) < self.max_in_flight:
+            await self._send_new(self.queued.popleft(), fees)
+            if self.send_interval:
+                await asyncio.sleep(self.send_interval)
+
+    async def _receipt(self, job):
+        """
+        (tx hash, receipt) for whichever of the job's txs got mined
+        """
+        for tx_hash in job.hashes:
+            try:
+                return tx_hash, await self.w3.eth.get_transaction_receipt(tx_hash)
+            except TransactionNotFound:
+                continue
+        return None, None
+
+    async def _bump(self, job):
+        tx = dict(job.sent_tx)
+        for key in ("maxFeePerGas", "maxPriorityFeePerGas"):
+            tx[key] = math.ceil(tx[key] * self.gas_bump)
+        job.bumps += 1
+        self.bumped += 1
+        job.sent_at = time.monotonic()
+        try:
+            tx_hash = await self._send(tx)
+        except Exception as e:
+            # Likely already mined (nonce too low) - the next poll finds it
+            job.error = str(e)
+            return
+        job.sent_tx = tx
+        job.hashes.append(tx_hash)
+        if job.cancel_hashes:
+            job.cancel_hashes.append(tx_hash)
+
+    async def _cancel(self, job):
+        # Same nonce, pricier than anything sent for it so far
+        tx = {
+            "from": self.account.address,
+            "to": self.account.address,
+            "value": 0,
+            "gas": 21000,
+            "nonce": job.nonce,
+            "chainId": self.chain_id,
+            "type": 2,
+        }
+        for key in ("maxFeePerGas", "maxPriorityFeePerGas"):
+            tx[key] = math.ceil(job.sent_tx[key] * self.gas_bump)
+        job.sent_at = time.monotonic()
+        try:
+            tx_hash = await self._send(tx)
+        except Exception as e:
+            job.error = str(e)
+            return
+        self.cancelled += 1
+        job.sent_tx = tx
+        job.hashes.append(tx_hash)
+        job.cancel_hashes.append(tx_hash)
+
+    async def _give_up(self, job):
+        for tx_hash in job.hashes:
+            if await self._known(tx_hash):
+                break
+        else:
+            # The node dropped every one of them, nothing can land any more.
+            # Later nonces may be waiting behind this one, start again from
+            # the chain so the next job fills the gap
+            self.nonce = None
+            self._finish(job, FAILED, f"Not mined within {self.give_up_after}s")
+            return
+        if not job.cancel_hashes:
+            await self._cancel(job)
+        elif job.bumps < 2 * self.max_bumps:
+            # The cancel is stuck too, keep raising its fee
+            await self._bump(job)
+
+    async def check_receipts(self):
+        for job in list(self.in_flight.values()):
+            tx_hash, receipt = await self._receipt(job)
+            if receipt is not None:
+                if tx_hash in job.cancel_hashes:
+                    self._finish(job, FAILED, "Cancelled, not mined in time")
+                elif receipt["status"] == 1:
+                    self._finish(job, CONFIRMED)
+                else:
+                    self._finish(job, FAILED, "Reverted")
+                continue
+            now = time.monotonic()
+            if now - job.sent_at < self.bump_after:
+                continue
+            if now - job.first_sent_at >= self.give_up_after:
+                await self._give_up(job)
+            elif job.bumps < self.max_bumps:
+                await self._bump(job)
+
+    async def _run_sender(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            try:
+                await self.send_queued()
+            except Exception:
+                # RPC trouble getting fees - jobs stay queued for next time
+                traceback.print_exc()
+                await asyncio.sleep(self.poll_interval)
+                self.wakeup.set()
+
+    async def _run_tracker(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.check_receipts()
+            except Exception:
+                traceback.print_exc()
+
+    async def run(self):
+        self.chain_id = await self.w3.eth.chain_id
+        await asyncio.gather(self._run_sender(), self._run_tracker())
+
+    def stats(self):
+        return {
+            "address": self.account.address,
+            "nonce": self.nonce,
+            "queued": len(self.queued),
+            "inFlight": len(self.in_flight),
+            "sent": self.sent,
+            "confirmed": self.confirmed,
+            "failed": self.failed,
+            "bumped": self.bumped,
+            "cancelled": self.cancelled,
+            "batches": self.batches,
+        }
@@ -0,0 +1,95 @@
+# Events that never carry private data go to everyone as-is
+PUBLIC_TAGS = {"joinTable", "leaveTable", "rebuy", "showdown", "settle"}
+
+
+def redact_players(players, seat_i=None):
+    """
+    Hide holecards of every player except the one at seat_i
+    """
+    redacted = []
+    for i, player in enumerate(players):
+        if player is None or i == seat_i or not player.get("holecards"):
+            redacted.append(player)
+        else:
+            redacted.append({**player, "holecards": []})
+    return redacted
+
+
+def view_for(event, seat_i=None):
+    """
+    What the player at seat_i sees of an event, seat_i=None for spectators
+    """
+    tag = event.get("tag")
+    if tag == "cards" and event["cardType"].startswith("p"):
+        if event["cardType"] == f"p{seat_i}":
+            return event
+        # Still tell them cards were dealt, just not which ones
+        return {**event, "cards": []}
+    if tag == "gameState":
+        return {**event, "players": redact_players(event["players"], seat_i)}
+    return event
+
+
+def redact_hand(events):
+    """
+    Spectator view of a hand's events, for hands still being played
+    """
+    return [view_for(event) for event in events]
+
+
+def redact_gamestate(state: dict):
+    """
+    Spectator view of a table's full engine state (PokerTable.__dict__) -
+    no deck, no holecards, and the hand in progress redacted
+    """
+    hand_id = state["hand_id"]
+    redacted = {k: v for k, v in state.items() if k != "deck"}
+    redacted["seats"] = redact_players(state["seats"])
+    redacted["events"] = redact_hand(state["events"])
+    redacted["events_pop"] = redact_hand(state["events_pop"])
+    redacted["hand_histories"] = {
+        i: redact_hand(events) if i == hand_id else events
+        for i, events in state["hand_histories"].items()
+    }
+    return redacted
+
+
+def sees_private(event, seat_i) -> bool:
+    """
+    Whether seat_i's view of an event has anything spectators don't see
+    """
+    if seat_i is None:
+        return False
+    tag = event.get("tag")
+    if tag == "cards":
+        return event["cardType"] == f"p{seat_i}"
+    if tag == "gameState":
+        player = event["players"][seat_i]
+        return bool(player and player.get("holecards"))
+    return False
+
+
+def project(view_fn, sees_private_fn, num_seats: int):
+    """
+    Group audiences that see the same thing and build one view per group
+    Returns [(audiences, view)] where audiences holds seat indexes and None
+    for spectators - a seat that sees nothing private shares the spectators'
+    view, which is built once
+    """
+    groups = {}
+    for audience in [None] + list(range(num_seats)):
+        key = audience if sees_private_fn(audience) else None
+        if key not in groups:
+            groups[key] = (view_fn(audience), [])
+        groups[key][1].append(audience)
+    return [(audiences, view) for view, audiences in groups.values()]
+
+
+def project_event(event, num_seats: int):
+    if event.get("tag") in PUBLIC_TAGS:
+        return [([None] + list(range(num_seats)), event)]
+    return project(
+        lambda seat_i: view_for(event, seat_i),
+        lambda seat_i: sees_private(event, seat_i),
+        num_seats,
+    )